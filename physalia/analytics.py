@@ -116,8 +116,8 @@ def hypothesis_test(sample_a, sample_b):
 
     """
     return ttest_ind(
-        [measurement.energy_consumption for measurement in sample_a],
-        [measurement.energy_consumption for measurement in sample_b],
+        np.array(sample_a, dtype='float'),
+        np.array(sample_b, dtype='float'),
         equal_var=False
     )
 
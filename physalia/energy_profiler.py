@@ -1,13 +1,20 @@
 """Module with main classes for energy profiling."""
 
+import asyncio
+import concurrent.futures
+import copy
 import time
-import subprocess
 import types
 import click
 from physalia.power_meters import EmulatedPowerMeter
 from physalia.models import Measurement
+from physalia.traces import PowerTrace
 import physalia.utils.android as android_utils
 from physalia.exceptions import PhysaliaExecutionFailed
+from physalia import retry
+from physalia.retry import RetryPolicy
+from physalia import tracing
+from physalia.utils import aio
 
 
 class AndroidUseCase(object):
@@ -23,6 +30,10 @@ class AndroidUseCase(object):
         prepare         method to run before interaction
         cleanup         method to run after interaction
 
+    Attributes:
+        serialno        serial number of the Android device to use; adb's
+                        default device is used when None.
+
     """
 
     # pylint: disable=not-callable
@@ -39,6 +50,8 @@ class AndroidUseCase(object):
         self.app_pkg = app_pkg
         self.app_version = app_version
         self.notes = None
+        self.serialno = None
+        self._power_meter = None
         if run:
             self._run = types.MethodType(run, self)
         if prepare:
@@ -58,129 +71,515 @@ class AndroidUseCase(object):
         # pylint: disable=method-hidden
         pass
 
+    def for_device(self, serialno):
+        """Get a copy of this use case that runs on device `serialno`."""
+        use_case = copy.copy(self)
+        for name in ('_run', '_prepare', '_cleanup'):
+            method = self.__dict__.get(name)
+            if method is not None:
+                setattr(use_case, name, types.MethodType(method.__func__, use_case))
+        use_case.serialno = serialno
+        return use_case
+
+    @tracing.traced()
     def prepare(self):
         """Prepare environment for running."""
-        self._prepare()
+        aio.call_sync(self._prepare)
 
+    @tracing.traced()
     def cleanup(self):
         """Clean environment after running."""
-        self._cleanup()
+        aio.call_sync(self._cleanup)
+
+    def mark(self, label):
+        """Start a new segment named `label` in the ongoing measurement.
+
+        The energy consumption and duration of each segment are stored in
+        `Measurement.segments`. Marks outside a measurement are ignored.
+        """
+        if self._power_meter is not None:
+            self._power_meter.mark(label)
+
+    @property
+    def executor(self):
+        """Executor running the blocking steps of the device, in `arun`."""
+        return aio.dedicated_executor(self.serialno)
+
+    async def aprepare(self):
+        """Prepare environment for running.
+
+        A coroutine function given as `prepare` is awaited; otherwise
+        `prepare` runs in the executor of the device.
+        """
+        if asyncio.iscoroutinefunction(self._prepare):
+            await self._prepare()
+        else:
+            await aio.run_in(self.executor, self.prepare)
+
+    async def acleanup(self):
+        """Clean environment after running.
+
+        A coroutine function given as `cleanup` is awaited; otherwise
+        `cleanup` runs in the executor of the device.
+        """
+        if asyncio.iscoroutinefunction(self._cleanup):
+            await self._cleanup()
+        else:
+            await aio.run_in(self.executor, self.cleanup)
 
-    def run(self, power_meter=default_power_meter, retry_limit=1):
+    @tracing.traced()
+    def run(self, power_meter=default_power_meter, retry_limit=1,
+            retry_policy=None, barrier=None):
         """Measure the routine stored in `_run`.
 
+        Every step runs in the calling thread. The host time spent in
+        each phase (prepare, start, run, stop and cleanup) is stored in
+        `Measurement.phases`.
+
+        Args:
+            power_meter     Power meter to use in the measurement.
+            retry_limit     Number of times to retry on error.
+            retry_policy    `RetryPolicy` deciding which failures to retry
+                            and when (see `arun`).
+            barrier         `concurrent.futures.Future` to wait for after
+                            preparing and before starting the power meter.
+
         Returns:
             Measurement: data collected from experiment
 
         """
-        try:
-            self.prepare()
-            power_meter.start()
-            success = self._run()
-            energy_consumption, duration, error_flag = power_meter.stop()
-            self.cleanup()
-            if error_flag:
-                raise PhysaliaExecutionFailed()
-            
-            measurement = Measurement(
-                time.time(),
-                self.name,
-                self.app_pkg,
-                self.app_version,
-                android_utils.get_device_model(),
-                duration,
-                energy_consumption,
-                str(power_meter),
-                success is None or success,
-                self.notes
-            )
-            
-            return measurement
-        except KeyboardInterrupt as error:
-            raise error
-        except BaseException as error:
-            click.secho("Measurement {} has failed".format(self.name), fg='red')
-            click.secho(str(error), fg='red')
-            if retry_limit == 1:
-                # click.secho("Waiting 5 minutes for Monsoon to recover...", fg='red')
-                # time.sleep(5*60)
-                # hack: reinit power_meter
-                power_meter.reinit()
-
-            if retry_limit > 0:
-                click.secho("Retrying...", fg='yellow')
-                return self.run(power_meter, retry_limit-1)
+        if retry_policy is None:
+            retry_policy = RetryPolicy.from_retry_limit(retry_limit)
+        retries = retry_policy.attempt()
+        while True:
+            try:
+                measurement = self._measure(power_meter, barrier)
+                measurement.retries = dict(retries.counts)
+                return measurement
+            except Exception as error:  # pylint: disable=broad-except
+                failure, delay = self._retry_delay(
+                    power_meter, retry_policy, retries, error
+                )
+                if delay is None:
+                    raise
+            if failure == retry.METER:
+                power_meter.reconnect()
+            time.sleep(delay)
+
+    @tracing.traced()
+    async def arun(self, power_meter=default_power_meter, retry_limit=1,
+                   barrier=None, retry_policy=None):
+        """Measure the routine stored in `_run`, asynchronously.
+
+        `run`, `prepare` and `cleanup` may be given as coroutine functions.
+        Blocking ones run in the executor of the device (see `executor`),
+        so that other tasks (e.g., measurements in other devices) progress
+        meanwhile. A blocking `run` is queued in that thread along with
+        starting and stopping the power meter, so that no queueing delay
+        is measured.
+
+        Failed attempts are retried as decided by the retry policy. The
+        number of retries of each kind of failure is stored in
+        `Measurement.retries`.
+
+        Args:
+            power_meter     Power meter to use in the measurement.
+            retry_limit     Number of times to retry on error.
+            barrier         Future to wait for after preparing and before
+                            starting the power meter. Its outcome is left
+                            to the caller.
+            retry_policy    `RetryPolicy` deciding which failures to retry
+                            and when. By default, any failure but fatal
+                            ones is retried up to `retry_limit` times
+                            (see `RetryPolicy.from_retry_limit`).
+
+        Returns:
+            Measurement: data collected from experiment
+
+        """
+        if retry_policy is None:
+            retry_policy = RetryPolicy.from_retry_limit(retry_limit)
+        retries = retry_policy.attempt()
+        while True:
+            try:
+                measurement = await self._ameasure(power_meter, barrier)
+                measurement.retries = dict(retries.counts)
+                return measurement
+            except Exception as error:  # pylint: disable=broad-except
+                failure, delay = self._retry_delay(
+                    power_meter, retry_policy, retries, error
+                )
+                if delay is None:
+                    raise
+            if failure == retry.METER:
+                await aio.run_in(self.executor, power_meter.reconnect)
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, power_meter, retry_policy, retries, error):
+        """Account for a failed attempt.
+
+        Returns:
+            tuple: kind of failure; seconds to wait before retrying, or
+            None if the failure should not be retried.
+
+        """
+        failure = retry_policy.classify(error)
+        click.secho(
+            "Measurement {} has failed ({}): {}".format(
+                self.name, failure, error
+            ),
+            fg='red'
+        )
+        delay = retries.retry(failure)
+        if delay is None:
             printstack = getattr(error, "printStackTrace", None)
             if callable(printstack):
                 printstack()
-            raise error
+            return failure, None
+        tracing.instant("retry", failure=failure)
+        if failure == retry.METER:
+            click.secho("Reconnecting {}...".format(power_meter),
+                        fg='yellow')
+        click.secho("Retrying in {:.1f}s...".format(delay), fg='yellow')
+        return failure, delay
+
+    def _measure_window(self, power_meter, lap):
+        """Run a blocking `_run` between starting and stopping the meter.
+
+        Returns:
+            tuple: result of `_run`; result of stopping the power meter.
+
+        """
+        power_meter.start()
+        lap("start")
+        self._power_meter = power_meter
+        try:
+            with tracing.span("use case", use_case=self.name):
+                success = aio.call_sync(self._run)
+        except BaseException:
+            # do not leave the power meter running
+            try:
+                power_meter.stop()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            raise
+        finally:
+            self._power_meter = None
+        lap("run")
+        stopped = power_meter.stop()
+        lap("stop")
+        return success, stopped
+
+    async def _ameasure_window(self, power_meter, lap):
+        """Await a coroutine `_run` between starting and stopping the meter.
+
+        The power meter is started and stopped in the executor of the
+        device, not to wait behind the work of other devices.
+        """
+        await aio.run_in(self.executor, power_meter.start)
+        lap("start")
+        self._power_meter = power_meter
+        try:
+            with tracing.span("use case", use_case=self.name):
+                success = await self._run()
+        except BaseException:
+            try:
+                await aio.run_in(self.executor, power_meter.stop)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            raise
+        finally:
+            self._power_meter = None
+        lap("run")
+        stopped = await aio.run_in(self.executor, power_meter.stop)
+        lap("stop")
+        return success, stopped
 
+    def _measure(self, power_meter, barrier):
+        """Make a single attempt to measure the use case."""
+        phases, lap = _phase_timer()
+        self.prepare()
+        lap("prepare")
+        if barrier is not None:
+            with tracing.span("barrier"):
+                concurrent.futures.wait([barrier])
+            lap("wait")
+        success, stopped = self._measure_window(power_meter, lap)
+        self.cleanup()
+        lap("cleanup")
+        self._check_stopped(power_meter, stopped)
+        device_info = android_utils.get_device_info(self.serialno)
+        return self._new_measurement(power_meter, success, stopped, phases,
+                                     device_info)
+
+    async def _ameasure(self, power_meter, barrier):
+        """Make a single attempt to measure the use case, asynchronously."""
+        phases, lap = _phase_timer()
+        await self.aprepare()
+        lap("prepare")
+        if barrier is not None:
+            with tracing.span("barrier"):
+                await asyncio.wait([asyncio.wrap_future(barrier)])
+            lap("wait")
+        if asyncio.iscoroutinefunction(self._run):
+            success, stopped = await self._ameasure_window(power_meter, lap)
+        else:
+            success, stopped = await aio.run_in(
+                self.executor, self._measure_window, power_meter, lap
+            )
+        await self.acleanup()
+        lap("cleanup")
+        self._check_stopped(power_meter, stopped)
+        device_info = await android_utils.aget_device_info(self.serialno)
+        return self._new_measurement(power_meter, success, stopped, phases,
+                                     device_info)
+
+    @staticmethod
+    def _check_stopped(power_meter, stopped):
+        _, _, error_flag = stopped
+        if error_flag:
+            raise PhysaliaExecutionFailed(
+                "{} did not collect samples.".format(power_meter)
+            )
+
+    def _new_measurement(self, power_meter, success, stopped, phases,
+                         device_info):
+        # pylint: disable=too-many-arguments
+        energy_consumption, duration, _ = stopped
+        return Measurement(
+            time.time(),
+            self.name,
+            self.app_pkg,
+            self.app_version,
+            device_info.model,
+            duration,
+            energy_consumption,
+            str(power_meter),
+            success is None or success,
+            self.notes,
+            power_meter.last_trace,
+            power_meter.last_segments,
+            phases
+        )
+
+    @tracing.traced()
     def profile(self, power_meter=default_power_meter,
                 verbose=True, count=30, retry_limit=1,
-                save_to_csv=None):
+                save_to_csv=None, session=False, pipelined=False,
+                retry_policy=None):
         """Run a batch of measurements.
 
+        Every measurement runs in the calling thread, as in `run`.
+
         Args:
             power_meter     Power meter to use in measurements.
             verbose         Log activiy (default=True).
             count           Run experiment several times (default=30).
             retry_limit     Number of times to retry on error.
             save_to_csv     File name to store measurement.
+            session         Keep the power meter sampling across all
+                            iterations instead of restarting it in each
+                            one (default=False).
+            pipelined       Persist and post-process each measurement in
+                            a background worker while the next iteration
+                            is prepared. The worker is always idle while
+                            measuring (default=False).
+            retry_policy    `RetryPolicy` deciding which failures to retry
+                            and when (see `arun`).
+        Returns: Set of measurements
+
+        """
+        results = []
+        persister = _Persister(save_to_csv, pipelined)
+        android_utils.get_device_info(self.serialno, refresh=True)
+        if session:
+            power_meter.start_session()
+        try:
+            for _ in range(count):
+                results.append(self.run(
+                    power_meter=power_meter,
+                    retry_limit=retry_limit,
+                    retry_policy=retry_policy,
+                    barrier=persister.pending
+                ))
+                # raise errors of the previous iteration
+                persister.check()
+                persister.submit(results[-1])
+        finally:
+            persister.close()
+            if session:
+                power_meter.stop_session()
+        persister.check()
+        self._report(results, verbose)
+        return results
+
+    @tracing.traced()
+    async def aprofile(self, power_meter=default_power_meter,
+                       verbose=True, count=30, retry_limit=1,
+                       save_to_csv=None, session=False, pipelined=False,
+                       retry_policy=None):
+        """Run a batch of measurements, asynchronously.
+
+        Takes the same arguments as `profile`. Several use cases, each
+        bound to its own device and power meter, can be profiled
+        concurrently with `asyncio.gather`.
+
         Returns: Set of measurements
 
         """
         results = []
-        for i in range(count):
-            result = self.run(power_meter=power_meter, retry_limit=retry_limit)
-            if result:
-                results.append(result)
-                if save_to_csv:
-                    result.save_to_csv(save_to_csv)
-            else:
-                click.secho("Error in execution {} of {}. Skipping.".format(i, self.name), fg="red")
+        persister = _Persister(save_to_csv, pipelined)
+        await android_utils.aget_device_info(self.serialno, refresh=True)
+        if session:
+            await power_meter.astart_session()
+        try:
+            for _ in range(count):
+                results.append(await self.arun(
+                    power_meter=power_meter,
+                    retry_limit=retry_limit,
+                    barrier=persister.pending,
+                    retry_policy=retry_policy
+                ))
+                persister.check()
+                await aio.run_in_executor(persister.submit, results[-1])
+        finally:
+            await aio.run_in_executor(persister.close)
+            if session:
+                await power_meter.astop_session()
+        persister.check()
+        self._report(results, verbose)
+        return results
+
+    def _report(self, results, verbose):
+        """Log the results of a batch of measurements."""
         if verbose and results:
             click.secho("Energy consumption results for {}: "
                         "{:.3f} Joules (s = {:.3f}).\n"
                         "It took {:.1f} seconds (s = {:.1f})."
                         .format(self.app_pkg, *Measurement.describe(results)),
                         fg='green')
-        return results
+            self._report_overhead(results)
+
+    @staticmethod
+    def _report_overhead(measurements):
+        """Log the mean host time of each phase of the measurements."""
+        phases = Measurement.describe_phases(measurements)
+        if not phases:
+            return
+        click.secho(
+            "Host time per phase: " + ", ".join(
+                "{} {:.3f}s (s = {:.3f})".format(phase, mean, std)
+                for phase, (mean, std) in phases.items()
+            ),
+            fg='blue'
+        )
 
     def profile_and_persist(self, power_meter=default_power_meter,
                             verbose=True, count=30):
         """Measure a batch of measurements and save it."""
         results = self.profile(power_meter, verbose, count)
-        for measurement in results:
-            measurement.persist()
+        Measurement.persist_many(results)
         return results
 
     def uninstall_app(self):
         """Uninstall app of the Android device."""
         click.secho("Uninstalling {}".format(self.app_pkg), fg='blue')
-        subprocess.check_output(["adb", "uninstall", self.app_pkg])
+        android_utils.uninstall_app(self.app_pkg, self.serialno)
 
     def install_app(self):
         """Install App."""
         click.secho("Installing {}".format(self.app_apk), fg='blue')
-        android_utils.install_apk(self.app_apk)
+        android_utils.install_apk(self.app_apk, self.serialno, self.app_pkg)
+
+    def clear_app_data(self):
+        """Reset the app in the Android device to a fresh state."""
+        click.secho("Clearing data of {}".format(self.app_pkg), fg='blue')
+        android_utils.clear_app_data(self.app_pkg, self.serialno)
+
+    @tracing.traced()
+    def prepare_apk(self, clear_data=True):
+        """Make sure the Android device has the app of this use case.
 
-    def prepare_apk(self):
-        """Reinstall app in the Android device."""
-        self.uninstall_app()
-        self.install_app()
+        The app is reinstalled only if the device does not have this
+        exact apk. Otherwise, its data is cleared.
+
+        Args:
+            clear_data      Start the app from a fresh state when it is
+                            already installed (default=True).
+        """
+        if android_utils.is_apk_installed(self.app_apk, self.app_pkg,
+                                          self.serialno):
+            if clear_data:
+                self.clear_app_data()
+        else:
+            self.uninstall_app()
+            self.install_app()
 
     def open_app(self):
         """Open app in the device."""
         click.secho("Opening app {}".format(self.app_pkg), fg='blue')
-        subprocess.check_output(
-            "adb shell monkey -p {} --pct-syskeys 0 1".format(self.app_pkg),
-            shell=True
-        )
+        android_utils.open_app(self.app_pkg, self.serialno)
 
     def kill_app(self):
         """Tell the device to kill the app of this use case."""
         click.secho("Killing app {}".format(self.app_pkg), fg='blue')
-        subprocess.check_output(
-            "adb shell am force-stop {}".format(self.app_pkg),
-            shell=True
+        android_utils.kill_app(self.app_pkg, self.serialno)
+
+
+def _phase_timer():
+    """Get a list of (phase, duration) and a function to lap a phase."""
+    phases = []
+    last_lap = [time.perf_counter()]
+
+    def lap(phase):
+        now = time.perf_counter()
+        phases.append((phase, now - last_lap[0]))
+        last_lap[0] = now
+
+    return phases, lap
+
+
+class _Persister(object):
+    """Persists the measurements of a batch, pipelined or not.
+
+    When pipelined, each measurement is persisted and post-processed in
+    a background worker; `pending` is the future of the last one, to be
+    waited for before the next measurement starts.
+    """
+
+    def __init__(self, save_to_csv, pipelined):  # noqa: D107
+        self.save_to_csv = save_to_csv
+        self.worker = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            if pipelined else None
         )
+        self.pending = None
+
+    def submit(self, measurement):
+        """Persist a measurement, in the worker if pipelined."""
+        if self.worker is None:
+            if self.save_to_csv:
+                measurement.save_to_csv(self.save_to_csv)
+            return
+        self.pending = self.worker.submit(
+            _post_process, measurement, self.save_to_csv
+        )
+
+    def check(self):
+        """Raise the error of the last measurement persisted, if any."""
+        if self.pending is not None and self.pending.done():
+            self.pending.result()
+
+    def close(self):
+        """Wait for the pending measurement and stop the worker."""
+        if self.worker is not None:
+            self.worker.shutdown(wait=True)
+
+
+@tracing.traced()
+def _post_process(measurement, save_to_csv):
+    """Persist a measurement and index its trace, if any."""
+    if measurement.trace:
+        PowerTrace(measurement.trace).build_index()
+    if save_to_csv:
+        measurement.save_to_csv(save_to_csv)
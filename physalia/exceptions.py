@@ -4,3 +4,8 @@ class PhysaliaExecutionFailed(Exception):
     """Raise when the execution of an experiment as failed."""
 
     pass
+
+class DeviceNotFound(Exception):
+    """Raise when an Android device is not available in time."""
+
+    pass
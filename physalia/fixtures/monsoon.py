@@ -0,0 +1,117 @@
+"""Fixtures to use Monsoon-based code without hardware."""
+
+import threading
+import time
+
+import numpy
+
+
+class SimulatedSampleEngine(object):
+    """Stand-in for `Monsoon.sampleEngine.SampleEngine`.
+
+    Emits main current and voltage samples in batches, as the real
+    engine does, through the periodic sampling API used by
+    `MonsoonReader`.
+
+    Args:
+        current         Mean current in mA.
+        noise           Standard deviation of the current in mA.
+        voltage         Main voltage in V.
+        sample_hz       Sampling rate.
+        batch_size      Number of samples processed at a time.
+        dropout_rate    Probability of dropping each batch of samples.
+        stop_latency    Seconds it takes to stop once requested.
+        realtime        Emit samples at the pace of the sampling rate; if
+                        False, samples are emitted as fast as possible.
+        seed            Seed of the random number generator.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=too-many-arguments
+    # pylint: disable=invalid-name
+    # Mimic the naming of the Monsoon API.
+
+    def __init__(self, current=300.0, noise=20.0, voltage=3.8,
+                 sample_hz=5000, batch_size=128, dropout_rate=0.0,
+                 stop_latency=0.0, realtime=True, seed=None):  # noqa: D107
+        self.current = current
+        self.noise = noise
+        self.voltage = voltage
+        self.sample_hz = sample_hz
+        self.batch_size = batch_size
+        self.dropout_rate = dropout_rate
+        self.stop_latency = stop_latency
+        self.realtime = realtime
+        self.dropped = 0
+        self.sample_count = 0
+        self._random = numpy.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self._start_time = None
+        self._timestamps = []
+        self._currents = []
+        self._voltages = []
+
+    def ConsoleOutput(self, boolValue):
+        """Ignore console output settings."""
+        pass
+
+    def periodicStartSampling(self, calTime=1250):
+        """Enter sample mode; samples are emitted while collecting."""
+        # pylint: disable=unused-argument
+        self.sample_count = 0
+        self.dropped = 0
+        with self._lock:
+            self._timestamps, self._currents, self._voltages = [], [], []
+        self._start_time = time.time()
+        return self.getSamples()
+
+    def periodicCollectSamples(self, samples=100, legacy_timestamp=False):
+        """Emit at least `samples` samples and return those not read yet."""
+        # pylint: disable=unused-argument
+        interval = 1.0/self.sample_hz
+        target = self.sample_count + samples
+        while self.sample_count < target:
+            timestamps = (
+                self._start_time +
+                (self.sample_count + numpy.arange(self.batch_size))*interval
+            )
+            if self.realtime:
+                delay = timestamps[-1] - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.sample_count += self.batch_size
+            if self._random.random_sample() < self.dropout_rate:
+                self.dropped += self.batch_size
+                continue
+            currents = self._random.normal(
+                self.current, self.noise, self.batch_size
+            )
+            voltages = numpy.full(self.batch_size, self.voltage)
+            with self._lock:
+                self._currents.append(currents)
+                self._voltages.append(voltages)
+                self._timestamps.append(timestamps - self._start_time)
+        return self.getSamples()
+
+    def periodicStopSampling(self, closeCSV=False):
+        """Leave sample mode."""
+        # pylint: disable=unused-argument
+        time.sleep(self.stop_latency)
+
+    def getSamples(self):
+        """Return and clear the samples collected so far.
+
+        Format is: [timestamp, main, usb, aux, mainVolts, usbVolts].
+        """
+        with self._lock:
+            timestamps, self._timestamps = self._timestamps, []
+            currents, self._currents = self._currents, []
+            voltages, self._voltages = self._voltages, []
+        return [
+            list(numpy.concatenate(timestamps)) if timestamps else [],
+            list(numpy.concatenate(currents)) if currents else [],
+            [],
+            [],
+            list(numpy.concatenate(voltages)) if voltages else [],
+            [],
+        ]
@@ -0,0 +1,19 @@
+"""Fixtures for power traces."""
+
+import numpy
+
+
+def create_synthetic_trace(duration=1.0, current=300.0, noise=20.0,
+                           sample_hz=5000, seed=1):
+    """Fake samples of a power meter.
+
+    Returns:
+        tuple: arrays of timestamps (s) and currents (mA).
+
+    """
+    if seed is not None:
+        numpy.random.seed(seed)
+    count = int(duration * sample_hz)
+    timestamps = numpy.arange(count) / float(sample_hz)
+    currents = numpy.random.normal(loc=current, scale=noise, size=count)
+    return timestamps, currents
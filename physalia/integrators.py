@@ -0,0 +1,144 @@
+"""Numerical integration of power meter samples into energy consumption.
+
+Samples are pairs of timestamps (in seconds) and currents (in mA).
+Energy is integrated with the rectangle rule: each current is held
+until the timestamp of the next sample.
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+def integrate(timestamps, currents):
+    """Integrate a complete set of samples.
+
+    Args:
+        timestamps (array-like): sample timestamps in seconds.
+        currents (array-like): sample currents in mA.
+
+    Returns:
+        float: energy consumption.
+
+    """
+    timestamps = np.asarray(timestamps, dtype='float')
+    currents = np.asarray(currents, dtype='float')
+    if len(timestamps) < 2:
+        return 0.0
+    return float(np.dot(currents[:-1], np.diff(timestamps)))/1000
+
+
+def cumulative_energy(timestamps, currents):
+    """Energy consumed from the first sample up to each sample.
+
+    Uses the same integration rule as `integrate`, hence the last element
+    is the energy consumption of the whole set of samples.
+
+    Returns:
+        numpy.ndarray: cumulative energy, with the same length as the
+            given samples.
+
+    """
+    timestamps = np.asarray(timestamps, dtype='float')
+    currents = np.asarray(currents, dtype='float')
+    cumulative = np.zeros(len(timestamps))
+    if len(timestamps) > 1:
+        np.cumsum(currents[:-1]*np.diff(timestamps), out=cumulative[1:])
+        cumulative /= 1000
+    return cumulative
+
+
+class StreamingIntegrator(object):
+    """Integrate samples incrementally, chunk by chunk.
+
+    Only the running totals and the last sample are kept in memory, so
+    the result of a capture is available in constant time regardless of
+    its length. Feeding every chunk to `add` yields the same result as
+    calling `integrate` with all samples at once.
+
+    Checkpoints record the cumulative energy at given timestamps as the
+    samples covering them arrive. Only unresolved checkpoints are kept;
+    callers hold on to those they need.
+
+    Attributes:
+        energy_consumption      Energy integrated so far.
+        sample_count            Number of samples integrated so far.
+        first_timestamp         Timestamp of the first sample.
+        last_timestamp          Timestamp of the last sample.
+
+    """
+
+    def __init__(self):  # noqa: D102,D107
+        self.energy_consumption = 0.0
+        self.sample_count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._last_current = None
+        self._pending_checkpoints = deque()
+
+    def checkpoint(self, timestamp):
+        """Record the cumulative energy at `timestamp`.
+
+        The energy is taken at the last sample at or before `timestamp`.
+        Checkpoints must be registered in chronological order; if the
+        samples have already gone past `timestamp`, the energy integrated
+        so far is used.
+
+        Returns:
+            list: the checkpoint [timestamp, cumulative energy]; energy
+            is None until resolved.
+
+        """
+        checkpoint = [timestamp, None]
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            checkpoint[1] = self.energy_consumption
+        else:
+            self._pending_checkpoints.append(checkpoint)
+        return checkpoint
+
+    def flush(self):
+        """Resolve pending checkpoints with the energy integrated so far."""
+        while self._pending_checkpoints:
+            self._pending_checkpoints.popleft()[1] = self.energy_consumption
+
+    def add(self, timestamps, currents):
+        """Integrate a new chunk of samples.
+
+        Args:
+            timestamps (array-like): sample timestamps in seconds.
+            currents (array-like): sample currents in mA, same length.
+
+        """
+        timestamps = np.asarray(timestamps, dtype='float')
+        currents = np.asarray(currents, dtype='float')
+        count = len(timestamps)
+        if count == 0:
+            return
+        if self.last_timestamp is None:
+            self.first_timestamp = float(timestamps[0])
+        else:
+            timestamps = np.concatenate(([self.last_timestamp], timestamps))
+            currents = np.concatenate(([self._last_current], currents))
+        pending = self._pending_checkpoints
+        if pending and pending[0][0] <= timestamps[-1]:
+            cumulative = (
+                self.energy_consumption +
+                cumulative_energy(timestamps, currents)
+            )
+            while pending and pending[0][0] <= timestamps[-1]:
+                checkpoint = pending.popleft()
+                index = np.searchsorted(timestamps, checkpoint[0], 'right') - 1
+                checkpoint[1] = float(cumulative[max(index, 0)])
+            self.energy_consumption = float(cumulative[-1])
+        else:
+            self.energy_consumption += integrate(timestamps, currents)
+        self.sample_count += count
+        self.last_timestamp = float(timestamps[-1])
+        self._last_current = float(currents[-1])
+
+    @property
+    def duration(self):
+        """Time elapsed between the first and the last sample."""
+        if self.last_timestamp is None:
+            return 0.0
+        return self.last_timestamp - self.first_timestamp
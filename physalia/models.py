@@ -1,15 +1,16 @@
 """Models that require persistence."""
 
-import csv
+import json
 import os
-from pathlib import Path
+import threading
 
-from itertools import groupby
 from collections import OrderedDict
 from operator import itemgetter
 import bisect
 import numpy
 
+from physalia.storage import BatchWriter, COLUMNS, CSVStorage, open_storage
+
 class Measurement(object):
     """Energy measurement information.
 
@@ -22,6 +23,18 @@ class Measurement(object):
         duration                Time it takes to execute the use case.
         energy_consumption      Mean of the measurements.
         power_meter             Name of the power meter used.
+        success                 Whether the use case ran successfully.
+        notes                   Free text about the measurement.
+        trace                   Path of the file with the recorded samples.
+        segments                List of (label, duration, energy_consumption)
+                                of the segments marked during the use case.
+        phases                  List of (phase, duration) of each step of
+                                the measurement on the host, in order
+                                (e.g., prepare, start, run, stop, cleanup;
+                                wait, in pipelined profiling, until the
+                                previous measurement is persisted).
+        retries                 Number of retries of each kind of failure
+                                before the measurement succeeded.
 
     """
 
@@ -30,6 +43,7 @@ class Measurement(object):
     # Eight is reasonable in this case.
 
     csv_storage = "./db.csv"
+    storage = None
     COLUMN_APP_PKG = 2
     COLUMN_USE_CASE = 1
     COLUMN_NAME = COLUMN_USE_CASE
@@ -46,6 +60,10 @@ class Measurement(object):
             power_meter="NA",
             success=True,
             notes=None,
+            trace=None,
+            segments=None,
+            phases=None,
+            retries=None,
     ):  # noqa: D102,D107
         self.persisted = False
         self.timestamp = float(timestamp)
@@ -56,49 +74,101 @@ class Measurement(object):
         self.duration = float(duration)
         self.energy_consumption = float(energy_consumption)
         self.power_meter = power_meter
+        if isinstance(success, str):
+            success = success == "True"
         self.success = success
         self.notes = notes
+        self.trace = trace or None
+        if isinstance(segments, str):
+            segments = json.loads(segments) if segments else None
+        self.segments = [
+            (label, float(duration), float(energy_consumption))
+            for label, duration, energy_consumption in segments or ()
+        ]
+        if isinstance(phases, str):
+            phases = json.loads(phases) if phases else None
+        self.phases = [
+            (phase, float(duration)) for phase, duration in phases or ()
+        ]
+        if isinstance(retries, str):
+            retries = json.loads(retries) if retries else None
+        self.retries = {
+            failure: int(count) for failure, count in (retries or {}).items()
+        }
 
     def persist(self):
         """Store measurement in the database."""
         if self.persisted:
             return False
-        self.save_to_csv(self.csv_storage)
+        self.get_storage().append([self.to_row()])
         self.persisted = True
         return True
 
     def save_to_csv(self, filename):
         """Store measurements in a CSV file."""
-        if not Path(filename).is_file():
-            with open(filename, 'wt') as csvfile:
-                csv_writer = csv.writer(csvfile)
-                # csv_writer.writeheader()
-                csv_writer.writerow([
-                    "timestamp",
-                    "use_case",
-                    "app_pkg",
-                    "app_version",
-                    "device_model",
-                    "duration",
-                    "energy_consumption",
-                    "power_meter",
-                    "success",
-                    "notes",
-                ])
-        with open(filename, 'at') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow([
-                self.timestamp,
-                self.use_case,
-                self.app_pkg,
-                self.app_version,
-                self.device_model,
-                self.duration,
-                self.energy_consumption,
-                self.power_meter,
-                self.success,
-                self.notes,
-            ])
+        CSVStorage(filename).append([self.to_row()])
+
+    @classmethod
+    def batch_writer(cls, filename=None, batch_size=1000, flush_interval=1.0):
+        """Get a writer storing the rows of measurements in batches.
+
+        Args:
+            filename: CSV file to store measurements; the database is
+                used by default.
+            batch_size: number of buffered measurements that triggers a
+                flush.
+            flush_interval: seconds after which a write triggers a flush.
+
+        Returns:
+            BatchWriter: context manager; call `write(measurement.to_row())`.
+
+        """
+        storage = CSVStorage(filename) if filename else cls.get_storage()
+        return BatchWriter(storage, batch_size, flush_interval)
+
+    @classmethod
+    def persist_many(cls, measurements, batch_size=1000):
+        """Store many measurements in the database, in batches.
+
+        Measurements that were already persisted are skipped. The others
+        are marked as persisted once their batch is stored.
+
+        Returns:
+            int: number of measurements stored.
+
+        """
+        count = 0
+        pending = []
+        with cls.batch_writer(batch_size=batch_size) as writer:
+            for measurement in measurements:
+                if measurement.persisted:
+                    continue
+                writer.write(measurement.to_row())
+                pending.append(measurement)
+                count += 1
+                if not writer.buffered:
+                    _mark_persisted(pending)
+        _mark_persisted(pending)
+        return count
+
+    def to_row(self):
+        """Get the values to store, in the order of `storage.COLUMNS`."""
+        return [
+            self.timestamp,
+            self.use_case,
+            self.app_pkg,
+            self.app_version,
+            self.device_model,
+            self.duration,
+            self.energy_consumption,
+            self.power_meter,
+            self.success,
+            self.notes,
+            self.trace,
+            json.dumps(self.segments) if self.segments else None,
+            json.dumps(self.phases) if self.phases else None,
+            json.dumps(self.retries) if self.retries else None,
+        ]
 
     def __str__(self):
         """Get description of the measurement."""
@@ -131,20 +201,47 @@ class Measurement(object):
         """Convert measurement to float using energy consumption."""
         return self.energy_consumption
 
+    @classmethod
+    def get_storage(cls):
+        """Get the storage of the database.
+
+        Unless `storage` is set, it is the storage of the file at
+        `csv_storage`, which is an SQLite database if its extension is
+        .db, .sqlite or .sqlite3.
+        """
+        if cls.storage is not None:
+            return cls.storage
+        return open_storage(cls.csv_storage)
+
+    @classmethod
+    def get_index(cls):
+        """Get the in-memory index of the database, up to date.
+
+        Indexes are kept for the lifetime of the process, one per
+        database, and only read what was stored since they were last
+        used.
+        """
+        storage = cls.get_storage()
+        if isinstance(storage, CSVStorage):
+            key = os.path.abspath(storage.path)
+        else:
+            key = storage
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _indexes[key] = MeasurementIndex(storage)
+        index.refresh()
+        return index
+
     @classmethod
     def clear_database(cls):
         """Clear database. Deletes CSV data file."""
-        try:
-            os.remove(cls.csv_storage)
-        except OSError:
-            pass
+        cls.get_storage().clear()
 
     @classmethod
     def _get_unique_from_column(cls, column_index):
         """Get unique values of the given column."""
-        with open(cls.csv_storage, 'rt') as csvfile:
-            csv_reader = csv.reader(csvfile)
-            return {row[column_index] for row in csv_reader}
+        return set(cls.get_index().unique(COLUMNS[column_index]))
 
     @classmethod
     def get_unique_apps(cls):
@@ -164,6 +261,8 @@ class Measurement(object):
             List of unique use cases.
 
         """
+        if isinstance(measurements, MeasurementSet):
+            return measurements.unique("use_case")
         return {
             measurement.use_case
             for measurement in measurements
@@ -173,15 +272,22 @@ class Measurement(object):
     def get_all_entries_of_app(cls, app, use_case):
         """Get all entries that have a specific app and use case.
 
-        If the use_case is None, all use_cases are retrieved.
+        If the use_case is None, all use_cases are retrieved. The
+        measurements are shared with the index of the database and should
+        not be modified.
         """
-        with open(cls.csv_storage, 'rt') as csvfile:
-            csv_reader = csv.reader(csvfile)
-            return [
-                Measurement(*row) for row in csv_reader
-                if row[cls.COLUMN_USE_CASE] == use_case or use_case is None and
-                row[cls.COLUMN_APP_PKG] == app
-            ]
+        return cls.get_index().query(app_pkg=app, use_case=use_case)
+
+    @classmethod
+    def get_measurement_set(cls, app=None, use_case=None):
+        """Get the entries of an app and use case as a `MeasurementSet`.
+
+        Unlike `get_all_entries_of_app`, no `Measurement` is created.
+        None filters are ignored.
+        """
+        return MeasurementSet.from_rows(
+            cls.get_storage().query(app_pkg=app, use_case=use_case)
+        )
 
     @classmethod
     def get_entries_with_name_like(cls, name, measurements):
@@ -205,6 +311,8 @@ class Measurement(object):
         len_measurements = len(measurements)
         if len_measurements == 0:
             raise Exception("Empty sample.")
+        if isinstance(measurements, MeasurementSet):
+            return float(numpy.mean(measurements.energy_consumption))
 
         energy_consumptions = [
             float(measurement.energy_consumption)
@@ -227,18 +335,22 @@ class Measurement(object):
         if len_measurements == 0:
             return
 
-        energy_consumptions = [
-            float(measurement.energy_consumption)
-            for measurement in measurements
-        ]
-        energy_consumption_mean = sum(energy_consumptions) / len_measurements
+        if isinstance(measurements, MeasurementSet):
+            energy_consumptions = measurements.energy_consumption
+            durations = measurements.duration
+        else:
+            energy_consumptions = numpy.fromiter(
+                (measurement.energy_consumption
+                 for measurement in measurements),
+                dtype=float, count=len_measurements
+            )
+            durations = numpy.fromiter(
+                (measurement.duration for measurement in measurements),
+                dtype=float, count=len_measurements
+            )
+        energy_consumption_mean = float(numpy.mean(energy_consumptions))
         energy_consumption_std = numpy.std(energy_consumptions)
-
-        durations = [
-            float(measurement.duration)
-            for measurement in measurements
-        ]
-        duration_mean = sum(durations) / len_measurements
+        duration_mean = float(numpy.mean(durations))
         duration_std = numpy.std(durations)
         return (
             energy_consumption_mean,
@@ -247,6 +359,48 @@ class Measurement(object):
             duration_std,
         )
 
+    @classmethod
+    def describe_segments(cls, measurements):
+        """Descriptive statistics for each segment of a set of measurements.
+
+        Returns:
+            OrderedDict with key=segment label and value=tuple of Energy
+            consumption mean, std, Duration mean, std.
+
+        """
+        segments = OrderedDict()
+        for measurement in measurements:
+            for label, duration, energy_consumption in measurement.segments:
+                segments.setdefault(label, []).append(
+                    (energy_consumption, duration)
+                )
+        return OrderedDict(
+            (label, (
+                numpy.mean([energy for energy, _ in values]),
+                numpy.std([energy for energy, _ in values]),
+                numpy.mean([duration for _, duration in values]),
+                numpy.std([duration for _, duration in values]),
+            ))
+            for label, values in segments.items()
+        )
+
+    @classmethod
+    def describe_phases(cls, measurements):
+        """Descriptive statistics for each phase of a set of measurements.
+
+        Returns:
+            OrderedDict with key=phase and value=tuple of Duration mean, std.
+
+        """
+        phases = OrderedDict()
+        for measurement in measurements:
+            for phase, duration in measurement.phases:
+                phases.setdefault(phase, []).append(duration)
+        return OrderedDict(
+            (phase, (numpy.mean(durations), numpy.std(durations)))
+            for phase, durations in phases.items()
+        )
+
     @classmethod
     def describe_app_use_case(cls, app, use_case):
         """Descriptive statistics for a stored App use case.
@@ -276,23 +430,12 @@ class Measurement(object):
             OrderedDict with key=app_pkg and value=energy_consumption
 
         """
-        with open(cls.csv_storage, 'rt') as csvfile:
-            csv_reader = csv.reader(csvfile)
-
-            data = [Measurement(*row) for row in csv_reader]
-            data = sorted(data, key=lambda msrmnt: msrmnt.app_pkg)
-            grouped_data = {
-                k: Measurement.mean_energy_consumption(list(group))
-                for (k, group) in groupby(
-                    data,
-                    key=lambda msrmnt: msrmnt.app_pkg
-                )
-            }
-            sorted_data = OrderedDict(sorted(
-                list(grouped_data.items()),
-                key=itemgetter(1)
-            ))
-            return sorted_data
+        grouped_data = cls.get_index().mean_energy_by_app()
+        sorted_data = OrderedDict(sorted(
+            list(grouped_data.items()),
+            key=itemgetter(1)
+        ))
+        return sorted_data
 
     @classmethod
     def get_position_in_ranking(cls, measurements):
@@ -304,3 +447,274 @@ class Measurement(object):
             bisect.bisect_left(consumptions, energy_consumption)+1,
             len(consumptions)
         )
+
+
+class MeasurementSet(object):
+    """Measurements held column by column in a NumPy structured array.
+
+    Energy consumption, duration and timestamp are stored as floats, and
+    app, use case, version and device as codes into shared lists of
+    labels. A set is accepted wherever a list of `Measurement` is:
+    converting it to an array gives its energy consumptions, indexing
+    it with an integer gives a `Measurement` (with only the columns of
+    the set), and indexing it with a slice or a boolean mask gives a
+    new set.
+
+    Args:
+        data            Structured array with dtype `DTYPE`.
+        categories      Dict with the list of labels of each categorical
+                        column.
+
+    """
+
+    CATEGORICAL = ("use_case", "app_pkg", "app_version", "device_model")
+    DTYPE = numpy.dtype(
+        [("timestamp", "f8"), ("duration", "f8"),
+         ("energy_consumption", "f8"), ("success", "?")] +
+        [(column, "i4") for column in CATEGORICAL]
+    )
+
+    def __init__(self, data, categories):  # noqa: D107
+        self.data = data
+        self.categories = categories
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a set from rows in the order of `storage.COLUMNS`."""
+        indexes = {column: COLUMNS.index(column) for column in cls.DTYPE.names}
+        codes = {column: {} for column in cls.CATEGORICAL}
+        records = []
+        for row in rows:
+            success = row[indexes["success"]]
+            if isinstance(success, str):
+                success = success == "True"
+            records.append(
+                (float(row[indexes["timestamp"]]),
+                 float(row[indexes["duration"]]),
+                 float(row[indexes["energy_consumption"]]),
+                 bool(success)) +
+                tuple(
+                    codes[column].setdefault(row[indexes[column]],
+                                             len(codes[column]))
+                    for column in cls.CATEGORICAL
+                )
+            )
+        return cls(
+            numpy.array(records, dtype=cls.DTYPE),
+            {column: list(codes[column]) for column in cls.CATEGORICAL}
+        )
+
+    @classmethod
+    def from_measurements(cls, measurements):
+        """Create a set from measurements."""
+        if isinstance(measurements, MeasurementSet):
+            return measurements
+        return cls.from_rows(
+            measurement.to_row() for measurement in measurements
+        )
+
+    def __len__(self):  # noqa: D105
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):  # noqa: D105
+        # a copy, unless asked not to, so that callers can scale it
+        return numpy.array(self.data["energy_consumption"], dtype=dtype,
+                           copy=copy is not False)
+
+    def __getitem__(self, key):  # noqa: D105
+        if isinstance(key, (int, numpy.integer)):
+            return self._measurement(self.data[key])
+        return MeasurementSet(self.data[key], self.categories)
+
+    def __iter__(self):  # noqa: D105
+        for record in self.data:
+            yield self._measurement(record)
+
+    def _measurement(self, record):
+        return Measurement(
+            record["timestamp"],
+            self.label(record, "use_case"),
+            self.label(record, "app_pkg"),
+            self.label(record, "app_version"),
+            self.label(record, "device_model"),
+            record["duration"],
+            record["energy_consumption"],
+            success=bool(record["success"]),
+        )
+
+    def label(self, record, column):
+        """Get the label of a categorical column of a record."""
+        return self.categories[column][record[column]]
+
+    @property
+    def energy_consumption(self):
+        """View of the energy consumptions."""
+        return self.data["energy_consumption"]
+
+    @property
+    def duration(self):
+        """View of the durations."""
+        return self.data["duration"]
+
+    @property
+    def timestamp(self):
+        """View of the timestamps."""
+        return self.data["timestamp"]
+
+    def column(self, column):
+        """Get the values of a column; labels for categorical columns."""
+        if column in self.categories:
+            labels = numpy.array(self.categories[column], dtype=object)
+            return labels[self.data[column]]
+        return self.data[column]
+
+    def unique(self, column):
+        """Get the distinct labels of a categorical column in the set."""
+        labels = self.categories[column]
+        return {labels[code] for code in numpy.unique(self.data[column])}
+
+    def filter(self, **criteria):
+        """Get the measurements whose columns have the given labels.
+
+        Args:
+            criteria: label, or list of labels, of categorical columns.
+
+        Returns:
+            MeasurementSet: measurements that match every criterion.
+
+        """
+        mask = numpy.ones(len(self.data), dtype=bool)
+        for column, labels in criteria.items():
+            if isinstance(labels, str) or not hasattr(labels, '__iter__'):
+                labels = [labels]
+            known = self.categories[column]
+            codes = [known.index(label) for label in labels if label in known]
+            mask &= numpy.isin(self.data[column], codes)
+        return self[mask]
+
+    def groupby(self, column):
+        """Split the set by the labels of a categorical column.
+
+        Returns:
+            OrderedDict: set of the measurements of each label.
+
+        """
+        codes = self.data[column]
+        order = numpy.argsort(codes, kind="stable")
+        group_codes, starts = numpy.unique(codes[order], return_index=True)
+        labels = self.categories[column]
+        return OrderedDict(
+            (labels[code], self[indexes])
+            for code, indexes in zip(group_codes,
+                                     numpy.split(order, starts[1:]))
+        )
+
+
+class MeasurementIndex(object):
+    """In-memory index of the measurements of a storage.
+
+    Measurements are loaded once and indexed by each of `KEYS`. When the
+    version of the storage changes, only the rows stored since the last
+    refresh are read, unless the storage was rewritten.
+
+    Args:
+        storage     `Storage` of the measurements.
+
+    """
+
+    KEYS = ("app_pkg", "use_case", "app_version", "device_model")
+
+    def __init__(self, storage):  # noqa: D107
+        self.storage = storage
+        self.measurements = []
+        self._lock = threading.Lock()
+        self._version = None
+        self._position = None
+        self._index = {}
+        self._energy_by_app = {}
+        self._reset()
+
+    def _reset(self):
+        self.measurements = []
+        self._position = None
+        self._index = {key: {} for key in self.KEYS}
+        self._energy_by_app = OrderedDict()
+
+    def _add(self, measurement):
+        measurement.persisted = True
+        self.measurements.append(measurement)
+        for key in self.KEYS:
+            self._index[key].setdefault(
+                getattr(measurement, key), []
+            ).append(measurement)
+        total = self._energy_by_app.setdefault(measurement.app_pkg, [0.0, 0])
+        total[0] += measurement.energy_consumption
+        total[1] += 1
+
+    def refresh(self):
+        """Read the measurements stored since the last refresh."""
+        with self._lock:
+            version = self.storage.version()
+            if version is not None and version == self._version:
+                return
+            result = None
+            if version is not None and self._position is not None:
+                result = self.storage.read_from(self._position)
+            if result is None:
+                self._reset()
+                result = self.storage.read_from()
+            rows, self._position = result
+            for row in rows:
+                self._add(Measurement(*row))
+            self._version = version
+
+    def query(self, **filters):
+        """Get the measurements that match every filter given.
+
+        Args:
+            filters: value of any of `KEYS`; None values are ignored.
+
+        Returns:
+            list: matching measurements, in the order they were stored.
+
+        """
+        filters = {
+            key: value for key, value in filters.items() if value is not None
+        }
+        if not filters:
+            return list(self.measurements)
+        candidates = min(
+            (self._index[key].get(value, []) for key, value in filters.items()),
+            key=len
+        )
+        return [
+            measurement for measurement in candidates
+            if all(getattr(measurement, key) == value
+                   for key, value in filters.items())
+        ]
+
+    def unique(self, key):
+        """Get the distinct values of an indexed column."""
+        if key in self._index:
+            return list(self._index[key])
+        return list(OrderedDict.fromkeys(
+            getattr(measurement, key) for measurement in self.measurements
+        ))
+
+    def mean_energy_by_app(self):
+        """Get the mean energy consumption of each app."""
+        return {
+            app_pkg: energy / count
+            for app_pkg, (energy, count) in self._energy_by_app.items()
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _mark_persisted(measurements):
+    """Mark stored measurements as persisted, emptying the list."""
+    for measurement in measurements:
+        measurement.persisted = True
+    del measurements[:]
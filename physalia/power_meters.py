@@ -1,7 +1,10 @@
 """Models to interact with different power meters."""
 
 import abc
+import os
+import threading
 import time
+import uuid
 import warnings
 
 import click
@@ -10,18 +13,40 @@ from Monsoon.sampleEngine import SampleEngine
 from Monsoon import LVPM, HVPM
 import Monsoon.pmapi as pmapi
 
+from physalia.integrators import StreamingIntegrator
+from physalia.replay import ReplayReader
+from physalia.subscriptions import PowerStats, Subscription
 from physalia.third_party import monsoon_async
+from physalia.traces import TraceWriter
+from physalia.tracing import traced
+from physalia.utils.aio import run_in_executor
 from physalia.utils import android
 from physalia.utils.monsoon import set_voltage_if_different
 
-import numpy as np
-
 
 class PowerMeter(object):
-    """Abstract class for interaction with a power monitor."""
+    """Abstract class for interaction with a power monitor.
+
+    Each method has a coroutine counterpart prefixed with `a` (e.g.,
+    `astart`) for use with asyncio. By default, they run the blocking
+    method in the default executor of the event loop.
+
+    Attributes:
+        last_trace      Path of the trace recorded in the last
+                        measurement, if any.
+        last_segments   List of (label, duration, energy consumption) of
+                        each segment of the last measurement, delimited
+                        by `mark`. The first segment is labeled "start".
+        in_session      Whether a session is ongoing.
+    """
 
     __metaclass__ = abc.ABCMeta
 
+    last_trace = None
+    last_segments = ()
+    in_session = False
+    _subscriptions = ()
+
     @abc.abstractmethod
     def start(self):
         """Start measuring energy consumption."""
@@ -37,21 +62,132 @@ class PowerMeter(object):
         """
         return
 
+    def mark(self, label):
+        """Start a new segment named `label` in the ongoing measurement.
+
+        Power meters that cannot attribute energy to segments ignore it.
+        """
+        pass
+
+    def subscribe(self, callback, interval=1.0, window=10.0):
+        """Receive rolling statistics while sampling.
+
+        Power meters that do not sample (e.g., `EmulatedPowerMeter`)
+        deliver the statistics of each whole measurement when it stops,
+        regardless of `interval` and `window`.
+
+        Args:
+            callback: function receiving `PowerStats`.
+            interval: seconds between each delivery.
+            window: seconds of samples covered by the statistics.
+
+        Returns:
+            Subscription: call `cancel` on it to stop receiving statistics.
+
+        """
+        subscription = Subscription(callback, interval, window)
+        self._subscriptions = [
+            active for active in self._subscriptions if active.active
+        ] + [subscription]
+        return subscription
+
+    def _publish(self, start, end, energy_consumption):
+        """Deliver the statistics of a whole measurement to subscribers."""
+        duration = end - start
+        power = energy_consumption/duration if duration > 0 else 0.0
+        stats = PowerStats(end, power, power, power, energy_consumption)
+        for subscription in self._subscriptions:
+            if subscription.active:
+                subscription.callback(stats)
+
+    def start_session(self):
+        """Sample continuously until `stop_session` is called.
+
+        Within a session, `start` and `stop` delimit measurements in the
+        ongoing stream of samples instead of starting and stopping the
+        power meter. Power meters without support for sessions keep
+        starting and stopping for each measurement.
+        """
+        self.in_session = True
+
+    def stop_session(self):
+        """Stop the ongoing session."""
+        self.in_session = False
+
     def reinit(self):
         """Reinitialize power meter upon unexpected behavior."""
         pass
 
+    def reconnect(self):
+        """Reconnect to the power monitor after it failed.
+
+        Power meters without a connection to reset do nothing.
+        """
+        pass
+
+    async def astart(self):
+        """Start measuring energy consumption."""
+        await run_in_executor(self.start)
+
+    async def astop(self):
+        """Stop measuring energy consumption.
+
+        Returns:
+            tuple: energy consumption in Joules; duration; error flag.
+
+        """
+        return await run_in_executor(self.stop)
+
+    async def astart_session(self):
+        """Sample continuously until `astop_session` is called."""
+        await run_in_executor(self.start_session)
+
+    async def astop_session(self):
+        """Stop the ongoing session."""
+        await run_in_executor(self.stop_session)
+
+    async def areconnect(self):
+        """Reconnect to the power monitor after it failed."""
+        await run_in_executor(self.reconnect)
+
+
+def _segments_from_marks(marks, end):
+    """Compute duration and energy of the segments delimited by marks.
+
+    Args:
+        marks: list of (label, [timestamp, cumulative energy]).
+        end: [timestamp, cumulative energy] at the end of the measurement.
+
+    Returns:
+        list: (label, duration, energy consumption) of each segment.
+
+    """
+    boundaries = [checkpoint for _, checkpoint in marks[1:]] + [end]
+    return [
+        (label, max(stop[0]-start[0], 0.0), max(stop[1]-start[1], 0.0))
+        for (label, start), stop in zip(marks, boundaries)
+    ]
+
 
 class EmulatedPowerMeter(PowerMeter):
     """PowerMeter implementation to emulate a power monitor."""
 
     def __init__(self):  # noqa: D102,D107
         self.start_time = None
+        self._marks = []
 
+    @traced(category='power_meter')
     def start(self):
         """Start measuring energy consumption."""
         self.start_time = time.time()
+        self._marks = [("start", [0.0, 0.0])]
 
+    def mark(self, label):
+        """Start a new segment named `label` in the ongoing measurement."""
+        elapsed = time.time() - self.start_time
+        self._marks.append((label, [elapsed, elapsed]))
+
+    @traced(category='power_meter')
     def stop(self):
         """Stop measuring energy consumption.
 
@@ -61,56 +197,321 @@ class EmulatedPowerMeter(PowerMeter):
         """
         duration = time.time() - self.start_time
         energy_consumption = duration
+        self.last_segments = _segments_from_marks(
+            self._marks,
+            [duration, energy_consumption]
+        )
+        self._publish(self.start_time, self.start_time + duration,
+                      energy_consumption)
         return energy_consumption, duration, False
 
+    async def astart(self):
+        """Start measuring energy consumption."""
+        self.start()
+
+    async def astop(self):
+        """Stop measuring energy consumption."""
+        return self.stop()
+
     def __str__(self):
         """Return the name of this power meter."""
         return "Emulated"
 
-class MonsoonPowerMeter(PowerMeter):
+class SamplingPowerMeter(PowerMeter):
+    """PowerMeter that integrates a stream of samples.
+
+    Samples are handed over in chunks by a reader thread and integrated
+    as they arrive. Subclasses only have to provide the reader.
+
+    Args:
+        trace_dir   Directory in which the samples of each measurement
+                    are recorded. Samples are not recorded by default.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    session_stop_timeout = 5
+
+    def __init__(self, trace_dir=None):  # noqa: D102,D107
+        self.trace_dir = trace_dir
+        self.reader = None
+        self.integrator = None
+        self.trace_writer = None
+        self._marks = []
+        self._window = [0.0, float('inf')]
+        self._samples_received = threading.Condition()
+        self._subscriptions = []
+
+    @abc.abstractmethod
+    def _create_reader(self, on_samples):
+        """Create the thread that collects samples.
+
+        The reader has to provide `start`, `stop` and `timestamp` (the
+        current time in the clock of the samples), and hand chunks of
+        (timestamps, currents) to `on_samples`.
+        """
+        return
+
+    def _start_capture(self):
+        """Start sampling and integrating samples in the background."""
+        self.integrator = StreamingIntegrator()
+        self.reader = self._create_reader(self._on_samples)
+        self.reader.start()
+
+    @traced(category='power_meter')
+    def start_session(self):
+        """Sample continuously until `stop_session` is called."""
+        super(SamplingPowerMeter, self).start_session()
+        self._start_capture()
+
+    @traced(category='power_meter')
+    def stop_session(self):
+        """Stop the ongoing session."""
+        self.reader.stop()
+        super(SamplingPowerMeter, self).stop_session()
+
+    @traced(category='power_meter')
+    def start(self):
+        """Start measuring energy consumption."""
+        self.last_trace = None
+        self._close_trace()
+        if self.in_session:
+            with self._samples_received:
+                begin = self.integrator.checkpoint(self.timestamp())
+                self._open_trace(begin[0])
+        else:
+            begin = [0.0, 0.0]
+            self._open_trace(begin[0])
+            self._start_capture()
+        self._marks = [("start", begin)]
+
+    async def astart(self):
+        """Start measuring energy consumption.
+
+        Starting only spawns the reader, so it does not block.
+        """
+        self.start()
+
+    def timestamp(self):
+        """Get the current time in the clock of the ongoing measurement."""
+        return self.reader.timestamp()
+
+    def mark(self, label):
+        """Start a new segment named `label` in the ongoing measurement."""
+        with self._samples_received:
+            checkpoint = self.integrator.checkpoint(self.timestamp())
+        self._marks.append((label, checkpoint))
+
+    def subscribe(self, callback, interval=1.0, window=10.0):
+        """Receive rolling statistics while sampling.
+
+        Statistics are computed from each chunk of samples as it arrives
+        and delivered from the thread that processes samples.
+        """
+        subscription = Subscription(callback, interval, window)
+        with self._samples_received:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def _on_samples(self, timestamps, currents):
+        deliveries = []
+        with self._samples_received:
+            start = self.integrator.last_timestamp
+            energy_consumption = self.integrator.energy_consumption
+            self.integrator.add(timestamps, currents)
+            if self.trace_writer:
+                in_window = (
+                    (timestamps >= self._window[0]) &
+                    (timestamps <= self._window[1])
+                )
+                self.trace_writer.write(
+                    timestamps[in_window],
+                    currents[in_window]
+                )
+            self._subscriptions = [
+                subscription for subscription in self._subscriptions
+                if subscription.active
+            ]
+            for subscription in self._subscriptions:
+                stats = subscription.update(
+                    timestamps[0] if start is None else start,
+                    timestamps[-1],
+                    self.integrator.energy_consumption - energy_consumption,
+                    currents.min(),
+                    currents.max(),
+                    self.integrator.energy_consumption
+                )
+                if stats:
+                    deliveries.append((subscription.callback, stats))
+            self._samples_received.notify_all()
+        for callback, stats in deliveries:
+            callback(stats)
+
+    def _open_trace(self, start_timestamp):
+        self._window = [start_timestamp, float('inf')]
+        if self.trace_dir:
+            self.trace_writer = TraceWriter(os.path.join(
+                self.trace_dir,
+                "{}.trace".format(uuid.uuid4().hex)
+            ))
+
+    def _close_trace(self):
+        with self._samples_received:
+            trace_writer, self.trace_writer = self.trace_writer, None
+        if trace_writer:
+            trace_writer.close()
+        return trace_writer
+
+    @traced(category='power_meter')
+    def stop(self):
+        """Stop measuring.
+
+        Samples are integrated while the capture is running, so stopping
+        only has to process the last chunk of samples. Within a session,
+        it waits until the samples up to this moment have been received.
+
+        Returns:
+            tuple: energy consumption in Joules; duration; error flag.
+
+        """
+        if self.in_session:
+            with self._samples_received:
+                end = self.integrator.checkpoint(self.timestamp())
+                self._window[1] = end[0]
+                received = self._samples_received.wait_for(
+                    lambda: end[1] is not None,
+                    timeout=self.session_stop_timeout
+                )
+        else:
+            self.reader.stop()
+            with self._samples_received:
+                self.integrator.flush()
+            end = [
+                self.integrator.last_timestamp or 0.0,
+                self.integrator.energy_consumption
+            ]
+            received = self.integrator.sample_count > 0
+        trace_writer = self._close_trace()
+        if trace_writer:
+            self.last_trace = trace_writer.path
+        if not received:
+            self.last_segments = ()
+            return None, None, True
+        self.last_segments = _segments_from_marks(self._marks, end)
+        begin = self._marks[0][1]
+        return end[1] - begin[1], end[0] - begin[0], False
+
+
+class ReplayPowerMeter(SamplingPowerMeter):
+    """PowerMeter implementation that plays back recorded traces.
+
+    Samples go through the same path as the ones of a real power meter,
+    which allows to benchmark the profiling pipeline without hardware.
+    Each measurement plays the next trace, and sessions play all traces
+    in a loop.
+
+    Args:
+        traces      Traces to play (paths, `PowerTrace` objects or tuples
+                    of timestamps and currents).
+        speed       Playback speed relative to real time; None plays
+                    samples as fast as possible.
+        chunk_size  Number of samples handed over at a time.
+        trace_dir   Directory in which the samples of each measurement
+                    are recorded.
+    """
+
+    def __init__(self, traces, speed=1.0, chunk_size=128,
+                 trace_dir=None):  # noqa: D102,D107
+        super(ReplayPowerMeter, self).__init__(trace_dir)
+        self.traces = list(traces)
+        self.speed = speed
+        self.chunk_size = chunk_size
+        self._next_trace = 0
+
+    def _create_reader(self, on_samples):
+        if self.in_session:
+            traces = self.traces
+        else:
+            traces = [self.traces[self._next_trace]]
+            self._next_trace = (self._next_trace + 1) % len(self.traces)
+        return ReplayReader(
+            traces,
+            on_samples,
+            speed=self.speed,
+            chunk_size=self.chunk_size,
+            loop=self.in_session
+        )
+
+    def __str__(self):
+        """Return the name of this power meter."""
+        return "Replay"
+
+
+class MonsoonPowerMeter(SamplingPowerMeter):
     """PowerMeter implementation for Monsoon LVPM.
 
     Make sure the Android device has Passlock disabled.
     Your server and device have to be connected to the same network.
+
+    Args:
+        voltage     Voltage output of the power monitor.
+        serial      Serial number of the power monitor.
+        trace_dir   Directory in which the samples of each measurement
+                    are recorded. Samples are not recorded by default.
+        engine      Sample engine to use instead of setting up a Monsoon
+                    and an Android device (e.g., `SimulatedSampleEngine`).
+        device_serialno
+                    Serial number of the Android device powered by this
+                    Monsoon. Once connected through wifi, it is updated
+                    with the wifi serial number of the device.
+        device_timeout
+                    Seconds to wait for the Android device to be online
+                    and booted during setup.
     """
 
-    def __init__(self, voltage=3.8, serial=None):  # noqa: D102,D107
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, voltage=3.8, serial=None, trace_dir=None,
+                 engine=None, device_serialno=None,
+                 device_timeout=180):  # noqa: D102,D107
+        super(MonsoonPowerMeter, self).__init__(trace_dir)
         self.monsoon = None
         self.serial = serial
         self.voltage = voltage
-        self.monsoon_reader = None
-        self.monsoon_data = None
-        self.engine = None
-        self.setup_monsoon()
-
+        self.device_serialno = device_serialno
+        self.device_timeout = device_timeout
+        self.engine = engine
+        if engine is None:
+            self.setup_monsoon()
+            self.setup_device()
+
+    @traced(category='power_meter')
+    def setup_device(self):
+        """Wait for the Android device and connect to it through wifi."""
         click.secho(
             "Monsoon is ready.",
             fg='green'
         )
-        if not android.is_android_device_available():
+        if not android.is_android_device_available(self.device_serialno):
             click.secho(
                 "You can now turn the phone on.",
                 fg='blue'
             )
-        for i in range(180):
-            time.sleep(1)
-            if android.is_android_device_available():
-                time.sleep(2)
-                click.secho(
-                    "Found a {}!".format(android.get_device_model()),
-                    fg='green'
-                )
-                break
-            if i%15 == 0:
-                click.secho(
-                    "Waiting for an Android device...",
-                    fg='blue'
-                )
-            if i == 179:
-                raise Exception("Could not find device.")
-        android.connect_adb_through_wifi()
+            click.secho(
+                "Waiting for an Android device...",
+                fg='blue'
+            )
+        device = android.wait_for_device(
+            self.device_serialno,
+            self.device_timeout
+        )
+        click.secho(
+            "Found a {}!".format(android.get_device_model(device)),
+            fg='green'
+        )
+        self.device_serialno = android.connect_adb_through_wifi(device)
         self.monsoon_usb_enabled(False)
-        if android.is_locked():
+        if android.is_locked(self.device_serialno):
             click.secho(
                 "Device seems to be locked. "
                 "Disabling Passlock is recommended!",
@@ -120,10 +521,23 @@ class MonsoonPowerMeter(PowerMeter):
     def reinit(self):
         """Reinitialize power meter upon unexpected behavior."""
         warnings.warn(
-            "reinit is deprecated and does nothing",
+            "reinit is deprecated and does nothing, use reconnect",
             DeprecationWarning
         )
 
+    @traced(category='power_meter')
+    def reconnect(self):
+        """Set up the Monsoon again, e.g., after a USB reset.
+
+        Does nothing with a sample engine given on creation.
+        """
+        if self.monsoon is None:
+            return
+        self.monsoon.Reconnect()
+        set_voltage_if_different(self.monsoon, self.voltage)
+        self.monsoon_usb_enabled(False)
+
+    @traced(category='power_meter')
     def setup_monsoon(self):
         """Set up monsoon.
 
@@ -143,8 +557,8 @@ class MonsoonPowerMeter(PowerMeter):
         self.engine = SampleEngine(self.monsoon)
         self.engine.ConsoleOutput(False)
 
-        if android.is_android_device_available():
-            android.reconnect_adb_through_usb()
+        if android.is_android_device_available(self.device_serialno):
+            android.reconnect_adb_through_usb(self.device_serialno)
         self.monsoon_usb_enabled(True)
 
     def monsoon_usb_enabled(self, enabled):
@@ -158,36 +572,37 @@ class MonsoonPowerMeter(PowerMeter):
             }[enabled]
         )
 
-    def start(self):
-        """Start measuring energy consumption."""
-        self.monsoon_reader = monsoon_async.MonsoonReader(
-            self.engine,
-        )
-        self.monsoon_reader.start()
+    def _create_reader(self, on_samples):
+        return monsoon_async.MonsoonReader(self.engine, on_samples=on_samples)
 
+    @traced(category='power_meter')
     def stop(self):
-        """Stop measuring."""
-        self.monsoon_reader.stop()
-        samples = self.engine.getSamples()
-        if len(samples) == 3:
-            timestamps = samples[0]
-            currents = samples[1]
-            if timestamps:
-                sample_hz = 50000
-                delta_time = 1/sample_hz
-                time_deltas = [j-i for i, j in zip(timestamps[:-1], timestamps[1:])]
-
-                energy_consumption = sum(np.array(currents[:-1])*np.array(time_deltas))/1000
-                # energy_consumption = sum(currents)*delta_time
-                duration = timestamps[-1]
-                return energy_consumption, duration, False
-        return None, None, True
+        """Stop measuring.
+
+        Returns:
+            tuple: energy consumption in Joules; duration; error flag.
+
+        """
+        result = super(MonsoonPowerMeter, self).stop()
+        if self.reader.overflow_count:
+            click.secho(
+                "{} samples were dropped because they could not be "
+                "processed in time.".format(self.reader.overflow_count),
+                fg='yellow'
+            )
+        return result
+
+    @property
+    def monsoon_reader(self):
+        """Reader of the ongoing measurement."""
+        return self.reader
 
     def __str__(self):
         """Return the name of this power meter."""
         return "Monsoon"
 
 class MonsoonHVPMPowerMeter(MonsoonPowerMeter):
+    @traced(category='power_meter')
     def setup_monsoon(self):
         """Set up monsoon HVPM.
 
@@ -207,6 +622,6 @@ class MonsoonHVPMPowerMeter(MonsoonPowerMeter):
         self.engine = SampleEngine(self.monsoon)
         self.engine.ConsoleOutput(False)
 
-        if android.is_android_device_available():
-            android.reconnect_adb_through_usb()
+        if android.is_android_device_available(self.device_serialno):
+            android.reconnect_adb_through_usb(self.device_serialno)
         self.monsoon_usb_enabled(True)
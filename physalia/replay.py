@@ -0,0 +1,124 @@
+"""Playback of recorded power traces as if sampled by a power meter."""
+
+import itertools
+import time
+from threading import Thread, Event
+
+import numpy as np
+
+from physalia.traces import PowerTrace, load_trace
+
+
+def as_samples(source):
+    """Get the timestamps and currents of a trace.
+
+    Args:
+        source: path of a trace file, `PowerTrace`, array of trace
+            records, or tuple of (timestamps, currents).
+
+    Returns:
+        tuple: arrays of timestamps and currents.
+
+    """
+    if isinstance(source, str):
+        source = load_trace(source)
+    if isinstance(source, PowerTrace):
+        return source.timestamps, source.currents
+    if isinstance(source, np.ndarray) and source.dtype.names:
+        return source['timestamp'], source['current']
+    timestamps, currents = source
+    return (
+        np.asarray(timestamps, dtype='float'),
+        np.asarray(currents, dtype='float')
+    )
+
+
+class ReplayReader(Thread):
+    """`Thread` that plays back traces in chunks of samples.
+
+    Traces are played one after the other, with timestamps shifted so
+    that playback starts at zero and never goes back in time.
+
+    Args:
+        sources         Traces to play (see `as_samples`).
+        on_samples      Callback receiving chunks of (timestamps, currents).
+        speed           Playback speed relative to real time; None plays
+                        samples as fast as possible.
+        chunk_size      Number of samples handed over in each chunk.
+        loop            Repeat the traces until the reader is stopped.
+    """
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, sources, on_samples, speed=1.0,
+                 chunk_size=128, loop=False):  # noqa: D107
+        super(ReplayReader, self).__init__()
+        self.daemon = True
+        self.sources = [as_samples(source) for source in sources]
+        self.on_samples = on_samples
+        self.speed = speed
+        self.chunk_size = chunk_size
+        self.loop = loop
+        self.start_time = None
+        self.position = 0.0
+        self._stopped = Event()
+
+    def timestamp(self):
+        """Get the current time in the clock of the played samples."""
+        if self.speed is None or self.start_time is None:
+            return self.position
+        return (time.time() - self.start_time) * self.speed
+
+    def run(self):
+        """Play the traces."""
+        self.start_time = time.time()
+        if not any(len(timestamps) for timestamps, _ in self.sources):
+            return
+        sources = self.sources
+        if self.loop:
+            sources = itertools.cycle(sources)
+        offset = 0.0
+        for timestamps, currents in sources:
+            if len(timestamps) == 0:
+                continue
+            timestamps = timestamps - timestamps[0] + offset
+            for start in range(0, len(timestamps), self.chunk_size):
+                chunk = slice(start, start + self.chunk_size)
+                if not self._play(timestamps[chunk], currents[chunk]):
+                    return
+            offset = timestamps[-1]
+            if len(timestamps) > 1:
+                offset += timestamps[-1] - timestamps[-2]
+
+    def _play(self, timestamps, currents):
+        """Hand a chunk over once it is due.
+
+        Returns:
+            bool: False if the reader was stopped.
+
+        """
+        if self.speed is not None:
+            delay = self.start_time + timestamps[-1]/self.speed - time.time()
+            if delay > 0 and self._stopped.wait(delay):
+                due = timestamps <= self.timestamp()
+                timestamps, currents = timestamps[due], currents[due]
+                if len(timestamps):
+                    self.on_samples(timestamps, currents)
+                    self.position = timestamps[-1]
+                return False
+        elif self._stopped.is_set():
+            return False
+        self.on_samples(timestamps, currents)
+        self.position = timestamps[-1]
+        return True
+
+    def stop(self):
+        """Stop playing.
+
+        When playing as fast as possible a single pass over the traces,
+        wait for the playback to finish instead.
+        """
+        if self.speed is not None or self.loop:
+            self._stopped.set()
+        self.join()
@@ -0,0 +1,131 @@
+"""Policies to retry measurements that fail.
+
+Failures are classified so that each kind gets its own handling:
+
+    transient   Hiccups of adb or of the connection to the device.
+    meter       The power meter failed (e.g., USB reset, no samples).
+                The power meter is reconnected before retrying.
+    app         The use case itself failed.
+    fatal       Never retried.
+"""
+
+import subprocess
+
+try:
+    from usb.core import USBError
+except ImportError:
+    USBError = ()
+
+from physalia.exceptions import DeviceNotFound, PhysaliaExecutionFailed
+from physalia.utils.adb import AdbSessionError
+
+TRANSIENT = 'transient'
+METER = 'meter'
+APP = 'app'
+FATAL = 'fatal'
+
+
+def classify_failure(error):
+    """Get the kind of failure of an exception raised by a measurement."""
+    if isinstance(error, (subprocess.CalledProcessError,
+                          subprocess.TimeoutExpired,
+                          AdbSessionError,
+                          DeviceNotFound,
+                          ConnectionError,
+                          TimeoutError)):
+        return TRANSIENT
+    if isinstance(error, (USBError, PhysaliaExecutionFailed)):
+        return METER
+    return APP
+
+
+class RetryPolicy(object):
+    """Policy to retry failed measurements.
+
+    Args:
+        max_retries     Maximum number of retries of a measurement.
+        budgets         Maximum number of retries of each kind of failure
+                        (default: `RetryPolicy.default_budgets`).
+        backoff         Seconds to wait before the first retry.
+        backoff_factor  Factor applied to the wait of each next retry.
+        max_backoff     Maximum seconds to wait before a retry.
+        classify        Function getting the kind of failure of an
+                        exception, or None to use `classify_failure`.
+
+    """
+
+    # pylint: disable=too-many-arguments
+
+    default_budgets = {TRANSIENT: 3, METER: 2, APP: 1, FATAL: 0}
+
+    def __init__(self, max_retries=1, budgets=None, backoff=1.0,
+                 backoff_factor=2.0, max_backoff=60.0,
+                 classify=None):  # noqa: D107
+        self.max_retries = max_retries
+        self.budgets = dict(self.default_budgets)
+        self.budgets.update(budgets or {})
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self._classify = classify
+
+    @classmethod
+    def from_retry_limit(cls, retry_limit):
+        """Get a policy of up to `retry_limit` retries of any non-fatal failure.
+
+        This is the policy used when only `retry_limit` is given.
+        """
+        budgets = {
+            failure: max(budget, retry_limit)
+            for failure, budget in cls.default_budgets.items()
+            if failure != FATAL
+        }
+        return cls(max_retries=retry_limit, budgets=budgets)
+
+    def classify(self, error):
+        """Get the kind of failure of an exception."""
+        failure = self._classify(error) if self._classify else None
+        return failure or classify_failure(error)
+
+    def delay(self, retry):
+        """Get the seconds to wait before the `retry`-th retry."""
+        return min(
+            self.backoff * self.backoff_factor ** (retry - 1),
+            self.max_backoff
+        )
+
+    def attempt(self):
+        """Get the state of the retries of a new measurement."""
+        return RetryState(self)
+
+
+class RetryState(object):
+    """Retries of a measurement under a `RetryPolicy`.
+
+    Attributes:
+        counts      Number of retries of each kind of failure.
+    """
+
+    def __init__(self, policy):  # noqa: D107
+        self.policy = policy
+        self.counts = {}
+
+    @property
+    def total(self):
+        """Number of retries so far."""
+        return sum(self.counts.values())
+
+    def retry(self, failure):
+        """Account for a retry of a failure of kind `failure`.
+
+        Returns:
+            float: seconds to wait before retrying, or None if the
+            failure should not be retried.
+
+        """
+        if self.total >= self.policy.max_retries:
+            return None
+        if self.counts.get(failure, 0) >= self.policy.budgets.get(failure, 0):
+            return None
+        self.counts[failure] = self.counts.get(failure, 0) + 1
+        return self.policy.delay(self.total)
@@ -0,0 +1,113 @@
+"""Run measurements concurrently on several devices."""
+
+import threading
+from collections import namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import click
+
+from physalia.models import Measurement
+
+Rig = namedtuple('Rig', ['power_meter', 'serialno'])
+Rig.__doc__ = """Power meter bound to the Android device it powers."""
+
+
+class DevicePool(object):
+    """Pool of rigs that run iterations of use cases concurrently.
+
+    Each rig is served by its own worker thread, which takes iterations
+    from a shared queue. Every worker runs its own copy of each use case,
+    bound to the serial number of its device.
+
+    Args:
+        rigs    List of `Rig`, or of power meters that know the serial
+                number of their device (`device_serialno`).
+
+    """
+
+    def __init__(self, rigs):  # noqa: D107
+        self.rigs = [
+            rig if isinstance(rig, Rig)
+            else Rig(rig, getattr(rig, 'device_serialno', None))
+            for rig in rigs
+        ]
+        self._lock = threading.Lock()
+
+    def profile(self, use_cases, count=30, retry_limit=1,
+                save_to_csv=None, verbose=True, retry_policy=None):
+        """Run `count` measurements of each use case across all rigs.
+
+        Args:
+            use_cases       List of `AndroidUseCase`.
+            count           Number of measurements of each use case.
+            retry_limit     Number of times to retry on error.
+            save_to_csv     File name to store measurements.
+            verbose         Log activity (default=True).
+            retry_policy    `RetryPolicy` deciding which failures to retry
+                            and when (see `AndroidUseCase.arun`).
+        Returns: List with the measurements of each use case.
+
+        """
+        # pylint: disable=too-many-arguments
+        iterations = queue.Queue()
+        for index in range(len(use_cases)):
+            for _ in range(count):
+                iterations.put(index)
+        results = [[] for _ in use_cases]
+        errors = []
+        workers = [
+            threading.Thread(
+                target=self._work,
+                args=(rig, use_cases, iterations, results, errors,
+                      retry_limit, save_to_csv, retry_policy)
+            )
+            for rig in self.rigs
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        if verbose:
+            for use_case, measurements in zip(use_cases, results):
+                if measurements:
+                    click.secho("Energy consumption results for {}: "
+                                "{:.3f} Joules (s = {:.3f}).\n"
+                                "It took {:.1f} seconds (s = {:.1f})."
+                                .format(use_case.app_pkg,
+                                        *Measurement.describe(measurements)),
+                                fg='green')
+        return results
+
+    def _work(self, rig, use_cases, iterations, results, errors,
+              retry_limit, save_to_csv, retry_policy):
+        # pylint: disable=too-many-arguments
+        local_use_cases = {}
+        while not errors:
+            try:
+                index = iterations.get_nowait()
+            except queue.Empty:
+                return
+            if index not in local_use_cases:
+                local_use_cases[index] = use_cases[index].for_device(
+                    rig.serialno
+                )
+            try:
+                measurement = local_use_cases[index].run(
+                    power_meter=rig.power_meter,
+                    retry_limit=retry_limit,
+                    retry_policy=retry_policy
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                with self._lock:
+                    errors.append(error)
+                return
+            with self._lock:
+                results[index].append(measurement)
+                if save_to_csv:
+                    measurement.save_to_csv(save_to_csv)
@@ -0,0 +1,572 @@
+"""Storage backends for measurements.
+
+Backends store measurements as rows with the values of `COLUMNS`, and
+answer the queries of `Measurement` without it having to load every
+row. Use `open_storage` to get the backend of a database file.
+"""
+
+import abc
+import contextlib
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COLUMNS = (
+    "timestamp",
+    "use_case",
+    "app_pkg",
+    "app_version",
+    "device_model",
+    "duration",
+    "energy_consumption",
+    "power_meter",
+    "success",
+    "notes",
+    "trace",
+    "segments",
+    "phases",
+    "retries",
+)
+
+# columns every row has, even those of older files
+REQUIRED_COLUMNS = COLUMNS[:COLUMNS.index("energy_consumption") + 1]
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+class Storage(object):
+    """Abstract class of a database of measurements."""
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def append(self, rows):
+        """Store rows of measurements."""
+        return
+
+    @contextlib.contextmanager
+    def sink(self):
+        """Keep the storage open for several appends.
+
+        Yields:
+            function: stores a list of rows.
+
+        """
+        yield self.append
+
+    def version(self):
+        """Get a value that changes whenever the database changes.
+
+        Returns:
+            object: version of the database, or None if unknown.
+
+        """
+        return None
+
+    def read_from(self, position=None):
+        """Get the rows stored after `position`.
+
+        Args:
+            position: position returned by a previous call, or None to
+                read every row.
+
+        Returns:
+            tuple: list of rows and position after them, or None if
+            `position` is no longer valid (e.g., the database was
+            cleared).
+
+        """
+        if position is not None:
+            return None
+        return self.query(), 0
+
+    @abc.abstractmethod
+    def query(self, app_pkg=None, use_case=None):
+        """Get the rows of the measurements that match every filter given.
+
+        Returns:
+            list: rows of the measurements.
+
+        """
+        return
+
+    @abc.abstractmethod
+    def unique(self, column):
+        """Get the distinct values of a column."""
+        return
+
+    @abc.abstractmethod
+    def mean_energy_by_app(self):
+        """Get the mean energy consumption of each app.
+
+        Returns:
+            dict: mean energy consumption by app package.
+
+        """
+        return
+
+    @abc.abstractmethod
+    def clear(self):
+        """Delete every measurement."""
+        return
+
+
+@contextlib.contextmanager
+def _file_lock(file_descriptor, exclusive=True):
+    """Hold a lock of a file, shared with other processes."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(file_descriptor, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(file_descriptor, fcntl.LOCK_UN)
+
+
+def _is_measurement(row):
+    """Check whether a CSV row is a complete measurement, not the header."""
+    return len(row) >= len(REQUIRED_COLUMNS) and row[0] != COLUMNS[0]
+
+
+def _complete_size(file_descriptor, size):
+    """Get the size of a file without its last line, if incomplete."""
+    end = size
+    while end > 0:
+        start = max(end - 4096, 0)
+        os.lseek(file_descriptor, start, os.SEEK_SET)
+        chunk = os.read(file_descriptor, end - start)
+        if end == size and chunk.endswith(b"\n"):
+            return size
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def _to_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+class CSVStorage(Storage):
+    """Measurements stored in a CSV file, with a header row.
+
+    Every query reads the whole file.
+
+    Several processes can append to the same file: rows are written
+    under an exclusive lock of the file (where `fcntl` is available), in
+    a single write per batch, and only the first write of an empty file
+    adds the header. A row left incomplete by a crash is never read,
+    and is removed before new rows are appended.
+    """
+
+    def __init__(self, path):  # noqa: D107
+        self.path = path
+
+    def _open(self):
+        return os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+
+    @staticmethod
+    def _write(file_descriptor, rows):
+        data = _to_csv(rows)
+        with _file_lock(file_descriptor):
+            size = os.fstat(file_descriptor).st_size
+            complete_size = _complete_size(file_descriptor, size)
+            if complete_size < size:
+                os.ftruncate(file_descriptor, complete_size)
+            if complete_size == 0:
+                data = _to_csv([COLUMNS]) + data
+            while data:
+                data = data[os.write(file_descriptor, data):]
+
+    def append(self, rows):
+        """Store rows of measurements."""
+        file_descriptor = self._open()
+        try:
+            self._write(file_descriptor, rows)
+        finally:
+            os.close(file_descriptor)
+
+    @contextlib.contextmanager
+    def sink(self):
+        """Keep the file open for several appends."""
+        file_descriptor = self._open()
+        try:
+            yield lambda rows: self._write(file_descriptor, rows)
+        finally:
+            os.close(file_descriptor)
+
+    def version(self):
+        """Get the inode, modification time and size of the file."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return (0, 0, 0)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def read_from(self, position=None):
+        """Get the rows appended after `position`.
+
+        Only the tail of the file after `position` is read. The position
+        is invalid once the file is replaced or truncated, which is told
+        by the bytes that preceded it.
+        """
+        inode, offset, last_bytes = position or (None, 0, b"")
+        try:
+            file_descriptor = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return None if position else ([], None)
+        try:
+            with _file_lock(file_descriptor, exclusive=False):
+                stat = os.fstat(file_descriptor)
+                if position and (stat.st_ino != inode or
+                                 stat.st_size < offset):
+                    return None
+                os.lseek(file_descriptor, offset - len(last_bytes),
+                         os.SEEK_SET)
+                if os.read(file_descriptor, len(last_bytes)) != last_bytes:
+                    return None
+                chunks = []
+                remaining = stat.st_size - offset
+                while remaining > 0:
+                    chunk = os.read(file_descriptor, remaining)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+        finally:
+            os.close(file_descriptor)
+        data = b"".join(chunks)
+        # an incomplete last row is read once it is complete or removed
+        data = data[:data.rfind(b"\n") + 1]
+        last_bytes = (last_bytes + data)[-64:]
+        rows = [
+            row for row in csv.reader(io.StringIO(data.decode('utf-8'),
+                                                  newline=''))
+            if _is_measurement(row)
+        ]
+        return rows, (stat.st_ino, offset + len(data), last_bytes)
+
+    def __iter__(self):
+        """Iterate over the rows of the file, without the header."""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rt', encoding='utf-8', newline='') as csvfile:
+            # only the last line can lack its newline, if incomplete
+            lines = (line for line in csvfile if line.endswith("\n"))
+            for row in csv.reader(lines):
+                if _is_measurement(row):
+                    yield row
+
+    def query(self, app_pkg=None, use_case=None):
+        """Get the rows of the measurements that match every filter given."""
+        app_pkg_index = COLUMNS.index("app_pkg")
+        use_case_index = COLUMNS.index("use_case")
+        return [
+            row for row in self
+            if (app_pkg is None or row[app_pkg_index] == app_pkg) and
+            (use_case is None or row[use_case_index] == use_case)
+        ]
+
+    def unique(self, column):
+        """Get the distinct values of a column."""
+        index = COLUMNS.index(column)
+        return {row[index] for row in self}
+
+    def mean_energy_by_app(self):
+        """Get the mean energy consumption of each app."""
+        app_pkg_index = COLUMNS.index("app_pkg")
+        energy_index = COLUMNS.index("energy_consumption")
+        totals = OrderedDict()
+        for row in self:
+            total = totals.setdefault(row[app_pkg_index], [0.0, 0])
+            total[0] += float(row[energy_index])
+            total[1] += 1
+        return {
+            app_pkg: energy / count
+            for app_pkg, (energy, count) in totals.items()
+        }
+
+    def clear(self):
+        """Delete the file."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SQLiteStorage(Storage):
+    """Measurements stored in an indexed SQLite database.
+
+    The database runs in write-ahead logging mode, so that reads do not
+    block the writes of an ongoing campaign.
+    """
+
+    _COLUMN_TYPES = {
+        "timestamp": "REAL",
+        "duration": "REAL",
+        "energy_consumption": "REAL",
+        "success": "INTEGER",
+    }
+    INDEXED_COLUMNS = ("app_pkg", "use_case", "app_version", "device_model")
+
+    def __init__(self, path):  # noqa: D107
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS measurements ({})".format(
+                    ", ".join(
+                        "{} {}".format(
+                            column, self._COLUMN_TYPES.get(column, "TEXT")
+                        )
+                        for column in COLUMNS
+                    )
+                )
+            )
+            for column in self.INDEXED_COLUMNS:
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS measurements_{0} "
+                    "ON measurements ({0})".format(column)
+                )
+
+    @staticmethod
+    def _from_sql(row):
+        row = list(row)
+        success_index = COLUMNS.index("success")
+        if row[success_index] is not None:
+            row[success_index] = bool(row[success_index])
+        return row
+
+    def append(self, rows):
+        """Store rows of measurements."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO measurements VALUES ({})".format(
+                    ", ".join("?" for _ in COLUMNS)
+                ),
+                rows
+            )
+
+    def version(self):
+        """Get the version of the data, as changed by any connection."""
+        with self._lock:
+            data_version, = self._connection.execute(
+                "PRAGMA data_version"
+            ).fetchone()
+            return (data_version, self._connection.total_changes)
+
+    def read_from(self, position=None):
+        """Get the rows inserted after `position`.
+
+        The position is invalid once the database was cleared or the
+        rows up to it were deleted, which are told by the generation
+        bumped by `clear` and by the largest rowid.
+        """
+        generation, last_rowid = position or (None, 0)
+        with self._lock:
+            current_generation, = self._connection.execute(
+                "PRAGMA user_version"
+            ).fetchone()
+            if position:
+                max_rowid, = self._connection.execute(
+                    "SELECT MAX(rowid) FROM measurements"
+                ).fetchone()
+                if (generation != current_generation or
+                        (max_rowid or 0) < last_rowid):
+                    return None
+            rows = self._connection.execute(
+                "SELECT rowid, * FROM measurements WHERE rowid > ? "
+                "ORDER BY rowid",
+                (last_rowid,)
+            ).fetchall()
+        if rows:
+            last_rowid = rows[-1][0]
+        return (
+            [self._from_sql(row[1:]) for row in rows],
+            (current_generation, last_rowid)
+        )
+
+    def query(self, app_pkg=None, use_case=None):
+        """Get the rows of the measurements that match every filter given."""
+        filters = [
+            (column, value)
+            for column, value in (("app_pkg", app_pkg), ("use_case", use_case))
+            if value is not None
+        ]
+        sql = "SELECT * FROM measurements"
+        if filters:
+            sql += " WHERE " + " AND ".join(
+                "{} = ?".format(column) for column, _ in filters
+            )
+        with self._lock:
+            rows = self._connection.execute(
+                sql, [value for _, value in filters]
+            ).fetchall()
+        return [self._from_sql(row) for row in rows]
+
+    def unique(self, column):
+        """Get the distinct values of a column."""
+        if column not in COLUMNS:
+            raise ValueError("Unknown column {}".format(column))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT {} FROM measurements".format(column)
+            ).fetchall()
+        return {value for value, in rows}
+
+    def mean_energy_by_app(self):
+        """Get the mean energy consumption of each app."""
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT app_pkg, AVG(energy_consumption) FROM measurements "
+                "GROUP BY app_pkg"
+            ).fetchall())
+
+    def clear(self):
+        """Delete every measurement."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM measurements")
+            # rowids restart, so readers need to tell the data apart
+            generation, = self._connection.execute(
+                "PRAGMA user_version"
+            ).fetchone()
+            self._connection.execute(
+                "PRAGMA user_version = {:d}".format(generation + 1)
+            )
+
+    def close(self):
+        """Close the connection to the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class BatchWriter(object):  # pylint: disable=too-many-instance-attributes
+    """Context manager that stores rows in batches.
+
+    The storage is kept open while the writer is, and buffered rows are
+    stored once there are `batch_size` of them, on the first write at
+    least `flush_interval` seconds after the last flush, and on exit.
+    There is no timer: rows stay buffered until one of those happens.
+
+    Args:
+        storage         `Storage` receiving the rows.
+        batch_size      Number of buffered rows that triggers a flush.
+        flush_interval  Seconds after which a write triggers a flush.
+
+    """
+
+    def __init__(self, storage, batch_size=1000,
+                 flush_interval=1.0):  # noqa: D107
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = threading.Lock()
+        self._sink = None
+        self._append = None
+        self._last_flush = time.time()
+
+    def __enter__(self):  # noqa: D105
+        self._sink = self.storage.sink()
+        self._append = self._sink.__enter__()
+        self._last_flush = time.time()
+        return self
+
+    def __exit__(self, *exc_info):  # noqa: D105
+        try:
+            self.flush()
+        finally:
+            sink, self._sink, self._append = self._sink, None, None
+            sink.__exit__(*exc_info)
+        return False
+
+    def write(self, row):
+        """Buffer a row, flushing if a threshold is reached."""
+        with self._lock:
+            self._rows.append(row)
+            if (len(self._rows) >= self.batch_size or
+                    time.time() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    @property
+    def buffered(self):
+        """Get the number of rows not stored yet."""
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self):
+        """Store the buffered rows."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self._append(rows)
+        self._last_flush = time.time()
+
+
+_sqlite_storages = {}
+_sqlite_storages_lock = threading.Lock()
+
+
+def open_storage(path):
+    """Get the storage of a database file.
+
+    Files with extension .db, .sqlite or .sqlite3 are SQLite databases,
+    whose connection is shared. Other files are CSV.
+    """
+    if os.path.splitext(path)[1].lower() not in SQLITE_EXTENSIONS:
+        return CSVStorage(path)
+    key = os.path.abspath(path)
+    with _sqlite_storages_lock:
+        storage = _sqlite_storages.get(key)
+        if storage is None:
+            storage = _sqlite_storages[key] = SQLiteStorage(path)
+        return storage
+
+
+def migrate_csv_to_sqlite(csv_path, sqlite_path, batch_size=10000):
+    """Copy the measurements of a CSV file into an SQLite database.
+
+    Returns:
+        int: number of measurements copied.
+
+    """
+    source = CSVStorage(csv_path)
+    target = open_storage(sqlite_path)
+    if not isinstance(target, SQLiteStorage):
+        target = SQLiteStorage(sqlite_path)
+    count = 0
+    batch = []
+    for row in source:
+        # rows of older files lack the last columns
+        row = row + [None] * (len(COLUMNS) - len(row))
+        success_index = COLUMNS.index("success")
+        if row[success_index] is not None:
+            row[success_index] = row[success_index] == "True"
+        batch.append(row)
+        if len(batch) >= batch_size:
+            target.append(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        target.append(batch)
+        count += len(batch)
+    return count
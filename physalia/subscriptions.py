@@ -0,0 +1,88 @@
+"""Live statistics of the samples of a power meter."""
+
+from collections import deque, namedtuple
+
+PowerStats = namedtuple('PowerStats', [
+    'timestamp',
+    'mean_power',
+    'min_power',
+    'max_power',
+    'energy_consumption',
+])
+PowerStats.__doc__ = """Rolling statistics delivered to subscribers.
+
+Power is expressed in units of energy consumption per second, and the
+energy consumption is cumulative since the beginning of the capture.
+"""
+
+
+class Subscription(object):
+    """Rolling statistics over the latest samples of a power meter.
+
+    Statistics are updated with every chunk of samples, and delivered to
+    `callback` every `interval` seconds of samples.
+
+    Args:
+        callback    Function receiving `PowerStats`. It runs in the
+                    thread that processes samples, so it should be quick.
+        interval    Seconds between each delivery.
+        window      Seconds of samples covered by the statistics.
+
+    """
+
+    def __init__(self, callback, interval=1.0, window=10.0):  # noqa: D107
+        self.callback = callback
+        self.interval = interval
+        self.window = window
+        self.active = True
+        self._chunks = deque()
+        self._energy = 0.0
+        self._next_delivery = None
+
+    def cancel(self):
+        """Stop delivering statistics."""
+        self.active = False
+
+    def _reset(self):
+        self._chunks.clear()
+        self._energy = 0.0
+        self._next_delivery = None
+
+    def update(self, start, end, energy, min_current, max_current,
+               energy_consumption):
+        """Account for a chunk of samples.
+
+        Args:
+            start: timestamp where the chunk starts.
+            end: timestamp of the last sample of the chunk.
+            energy: energy consumed within the chunk.
+            min_current: lowest current of the chunk in mA.
+            max_current: highest current of the chunk in mA.
+            energy_consumption: energy consumed since the capture started.
+
+        Returns:
+            PowerStats: statistics due for delivery, or None.
+
+        """
+        # pylint: disable=too-many-arguments
+        if self._chunks and start < self._chunks[-1][1]:
+            # a new capture started
+            self._reset()
+        self._chunks.append((start, end, energy, min_current, max_current))
+        self._energy += energy
+        while self._chunks[0][1] <= end - self.window:
+            self._energy -= self._chunks.popleft()[2]
+        if self._next_delivery is None:
+            self._next_delivery = start + self.interval
+        if end < self._next_delivery:
+            return None
+        while self._next_delivery <= end:
+            self._next_delivery += self.interval
+        duration = end - self._chunks[0][0]
+        return PowerStats(
+            end,
+            self._energy/duration if duration > 0 else 0.0,
+            min(chunk[3] for chunk in self._chunks)/1000,
+            max(chunk[4] for chunk in self._chunks)/1000,
+            energy_consumption,
+        )
@@ -1,13 +1,17 @@
 """Test analytics module."""
 
 import unittest
+from io import StringIO
 from tempfile import NamedTemporaryFile
 
+import numpy
+
 from mock import patch, MagicMock
 
-from physalia.analytics import violinplot
+from physalia.analytics import describe, violinplot
 from physalia.fixtures.models import create_random_sample, create_random_samples
 from physalia.analytics import hypothesis_test, fancy_hypothesis_test, smart_hypothesis_testing
+from physalia.models import MeasurementSet
 from physalia.utils.symbols import GREEK_ALPHABET
 
 
@@ -30,6 +34,24 @@ class TestAnalytics(unittest.TestCase):
         _, pvalue = hypothesis_test(sample_a, sample_b)
         self.assertLess(pvalue, 0.05)
 
+    def test_measurement_sets_are_not_modified(self):
+        sample = MeasurementSet.from_measurements(create_random_sample(10, 1))
+        energy_consumption = sample.energy_consumption.copy()
+        describe(sample, names=["login"], mili_joules=True, out=StringIO())
+        with NamedTemporaryFile(prefix="violinplot",
+                                suffix='.png', delete=False) as tmp_file:
+            violinplot(sample, millijoules=True, save_fig=tmp_file)
+        numpy.testing.assert_array_equal(sample.energy_consumption,
+                                         energy_consumption)
+
+    def test_measurement_sets(self):
+        sample_a, sample_b = create_random_samples()
+        self.assertEqual(
+            hypothesis_test(MeasurementSet.from_measurements(sample_a),
+                            MeasurementSet.from_measurements(sample_b)),
+            hypothesis_test(sample_a, sample_b)
+        )
+
     def test_fancy_hypothesis_test(self):
         try:
             from StringIO import StringIO
@@ -1,8 +1,18 @@
 """Test energy_profiler module."""
 
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
+from mock import patch
+
 from physalia.energy_profiler import AndroidUseCase
+from physalia.models import Measurement
+from physalia.power_meters import EmulatedPowerMeter
 
 # pylint: disable=missing-docstring
 
@@ -20,3 +30,216 @@ class TestEnergyProfiler(unittest.TestCase):
             cleanup=None
         )
         use_case.run()
+
+    def test_mark_segments(self):
+        def run(use_case):
+            time.sleep(0.01)
+            use_case.mark("first")
+            time.sleep(0.02)
+            use_case.mark("second")
+
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+            run=run,
+        )
+        measurement = use_case.run(power_meter=EmulatedPowerMeter())
+        self.assertEqual(
+            [label for label, _, _ in measurement.segments],
+            ["start", "first", "second"]
+        )
+        self.assertAlmostEqual(
+            sum(duration for _, duration, _ in measurement.segments),
+            measurement.duration
+        )
+        self.assertGreaterEqual(measurement.segments[1][1], 0.02)
+
+    def test_phases(self):
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+            run=lambda use_case: time.sleep(0.02),
+            prepare=lambda use_case: time.sleep(0.01),
+        )
+        measurement = use_case.run(power_meter=EmulatedPowerMeter())
+        phases = dict(measurement.phases)
+        self.assertEqual(
+            [phase for phase, _ in measurement.phases],
+            ["prepare", "start", "run", "stop", "cleanup"]
+        )
+        self.assertGreaterEqual(phases["prepare"], 0.01)
+        self.assertGreaterEqual(phases["run"], 0.02)
+        self.assertLess(phases["start"] + phases["stop"], 0.01)
+
+    def test_profile_session(self):
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+        )
+        power_meter = EmulatedPowerMeter()
+        measurements = use_case.profile(
+            power_meter=power_meter,
+            count=3,
+            session=True
+        )
+        self.assertEqual(len(measurements), 3)
+        self.assertFalse(power_meter.in_session)
+
+    def test_aprofile_concurrently(self):
+        async def run(use_case):
+            # pylint: disable=unused-argument
+            await asyncio.sleep(0.1)
+
+        use_cases = [
+            AndroidUseCase(
+                name="Test",
+                app_apk="no/path",
+                app_pkg="no.package",
+                app_version="0.0.0",
+                run=run,
+            ).for_device(serialno)
+            for serialno in ("first", "second", "third")
+        ]
+
+        async def profile_all():
+            return await asyncio.gather(*(
+                use_case.aprofile(power_meter=EmulatedPowerMeter(),
+                                  count=2, verbose=False)
+                for use_case in use_cases
+            ))
+
+        start = time.time()
+        results = asyncio.run(profile_all())
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual([len(measurements) for measurements in results],
+                         [2, 2, 2])
+        for measurements in results:
+            for measurement in measurements:
+                self.assertGreaterEqual(measurement.duration, 0.1)
+
+    def test_threads(self):
+        threads = []
+
+        class RecordingPowerMeter(EmulatedPowerMeter):
+            def start(self):
+                threads.append(threading.current_thread())
+                super(RecordingPowerMeter, self).start()
+
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+            run=lambda use_case: threads.append(threading.current_thread()),
+        ).for_device("serial")
+        use_case.run(power_meter=RecordingPowerMeter())
+        # the sync API stays in the calling thread
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+        del threads[:]
+        asyncio.run(use_case.arun(power_meter=RecordingPowerMeter()))
+        # the measured window runs in the thread of the device
+        self.assertEqual(len(set(threads)), 1)
+        self.assertTrue(threads[0].name.startswith("physalia-serial"))
+
+    def test_run_inside_event_loop(self):
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+        )
+
+        async def run_blocking():
+            return use_case.run(power_meter=EmulatedPowerMeter())
+
+        measurement = asyncio.run(run_blocking())
+        self.assertEqual(measurement.use_case, "Test")
+
+    def test_profile_pipelined(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        filename = os.path.join(tmp_dir, "measurements.csv")
+        windows = []
+        saves = []
+
+        class RecordingPowerMeter(EmulatedPowerMeter):
+            def start(self):
+                windows.append([time.time(), None])
+                super(RecordingPowerMeter, self).start()
+
+            def stop(self):
+                result = super(RecordingPowerMeter, self).stop()
+                windows[-1][1] = time.time()
+                return result
+
+        save_to_csv = Measurement.save_to_csv
+
+        def slow_save(measurement, csv_file):
+            start = time.time()
+            time.sleep(0.05)
+            save_to_csv(measurement, csv_file)
+            saves.append((start, time.time()))
+
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+            run=lambda use_case: time.sleep(0.02),
+            prepare=lambda use_case: time.sleep(0.05),
+        )
+        with patch.object(Measurement, 'save_to_csv', slow_save):
+            measurements = use_case.profile(
+                power_meter=RecordingPowerMeter(),
+                count=4,
+                save_to_csv=filename,
+                pipelined=True,
+                verbose=False
+            )
+        self.assertEqual(len(measurements), 4)
+        self.assertEqual(len(saves), 4)
+        # waiting for the previous save is not part of preparing
+        self.assertEqual(
+            [phase for phase, _ in measurements[-1].phases],
+            ["prepare", "wait", "start", "run", "stop", "cleanup"]
+        )
+        with open(filename) as csv_file:
+            self.assertEqual(len(csv_file.readlines()), 5)
+        for save_start, save_end in saves:
+            for window_start, window_end in windows:
+                self.assertTrue(
+                    save_end <= window_start or save_start >= window_end
+                )
+
+    def test_profile_pipelined_error(self):
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+        )
+        for last in (True, False):
+            failures = [None, IOError("disk full")] if last else \
+                [IOError("disk full"), None]
+            with patch.object(Measurement, 'save_to_csv',
+                              side_effect=failures):
+                with self.assertRaises(IOError):
+                    use_case.profile(
+                        power_meter=EmulatedPowerMeter(), count=2,
+                        save_to_csv="measurements.csv", pipelined=True,
+                        verbose=False
+                    )
+            with patch.object(Measurement, 'save_to_csv',
+                              side_effect=failures):
+                with self.assertRaises(IOError):
+                    asyncio.run(use_case.aprofile(
+                        power_meter=EmulatedPowerMeter(), count=2,
+                        save_to_csv="measurements.csv", pipelined=True,
+                        verbose=False
+                    ))
@@ -0,0 +1,81 @@
+"""Test integrators module."""
+
+import unittest
+
+import numpy as np
+
+from physalia.integrators import integrate, cumulative_energy, StreamingIntegrator
+
+# pylint: disable=missing-docstring
+
+class TestIntegrators(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.timestamps = np.cumsum(np.random.uniform(0.0001, 0.0003, 5000))
+        self.currents = np.random.normal(300, 20, 5000)
+
+    def test_integrate(self):
+        self.assertAlmostEqual(
+            integrate([0, 1, 3], [1000, 2000, 5000]),
+            5.0
+        )
+        self.assertEqual(integrate([1], [1000]), 0.0)
+
+    def test_cumulative_energy(self):
+        cumulative = cumulative_energy(self.timestamps, self.currents)
+        self.assertEqual(cumulative[0], 0.0)
+        self.assertAlmostEqual(
+            cumulative[-1],
+            integrate(self.timestamps, self.currents)
+        )
+
+    def test_streaming_matches_batch(self):
+        integrator = StreamingIntegrator()
+        for start in range(0, 5000, 128):
+            integrator.add(
+                self.timestamps[start:start+128],
+                self.currents[start:start+128]
+            )
+        self.assertAlmostEqual(
+            integrator.energy_consumption,
+            integrate(self.timestamps, self.currents)
+        )
+        self.assertEqual(integrator.sample_count, 5000)
+        self.assertEqual(integrator.last_timestamp, self.timestamps[-1])
+
+    def test_checkpoints(self):
+        integrator = StreamingIntegrator()
+        before = integrator.checkpoint(self.timestamps[0] - 1)
+        middle = integrator.checkpoint(self.timestamps[2999])
+        after = integrator.checkpoint(self.timestamps[-1] + 1)
+        for start in range(0, 5000, 128):
+            integrator.add(
+                self.timestamps[start:start+128],
+                self.currents[start:start+128]
+            )
+        self.assertIsNone(after[1])
+        integrator.flush()
+        self.assertEqual(before[1], 0.0)
+        self.assertAlmostEqual(
+            middle[1],
+            integrate(self.timestamps[:3000], self.currents[:3000])
+        )
+        self.assertEqual(after[1], integrator.energy_consumption)
+
+    def test_resolved_checkpoints_released(self):
+        integrator = StreamingIntegrator()
+        flushed = integrator.checkpoint(self.timestamps[-1])
+        integrator.add(self.timestamps[:2500], self.currents[:2500])
+        integrator.flush()
+        energy = flushed[1]
+        pending = integrator.checkpoint(self.timestamps[-1])
+        integrator.add(self.timestamps[2500:], self.currents[2500:])
+        integrator.flush()
+        # only the checkpoint still open follows the later samples
+        self.assertEqual(flushed[1], energy)
+        self.assertAlmostEqual(
+            pending[1],
+            integrate(self.timestamps, self.currents)
+        )
+        self.assertGreater(pending[1], flushed[1])
@@ -1,8 +1,12 @@
 """ Test Models module
 """
 
+import os
+import shutil
+import tempfile
 import unittest
-from physalia.models import Measurement
+import numpy
+from physalia.models import Measurement, MeasurementSet
 from physalia.fixtures.models import create_measurement
 from physalia.fixtures.models import create_random_sample
 
@@ -25,6 +29,34 @@ class TestMeasurement(unittest.TestCase):
             content
         )
 
+    def test_persist_segments(self):
+        measurement = create_measurement()
+        measurement.segments = [("start", 0.5, 10.0), ("login", 1.5, 20.0)]
+        measurement.persist()
+        stored, = Measurement.get_all_entries_of_app(
+            measurement.app_pkg,
+            measurement.use_case
+        )
+        self.assertEqual(stored.segments, measurement.segments)
+        self.assertEqual(
+            Measurement.describe_segments([stored])["login"],
+            (20.0, 0.0, 1.5, 0.0)
+        )
+
+    def test_persist_phases(self):
+        measurement = create_measurement()
+        measurement.phases = [("start", 0.25), ("run", 2.0), ("stop", 0.5)]
+        measurement.persist()
+        stored, = Measurement.get_all_entries_of_app(
+            measurement.app_pkg,
+            measurement.use_case
+        )
+        self.assertEqual(stored.phases, measurement.phases)
+        self.assertEqual(
+            Measurement.describe_phases([stored, measurement])["stop"],
+            (0.5, 0.0)
+        )
+
     def test_get_unique_apps(self):
         for _ in range(10):
             measurement = create_measurement(app_pkg="com.test.one")
@@ -95,3 +127,136 @@ class TestMeasurement(unittest.TestCase):
             Measurement.get_position_in_ranking(compare_sample),
             (4, 6)
         )
+
+
+class TestMeasurementIndex(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        self.databases = [
+            os.path.join(tmp_dir, "db.csv"),
+            os.path.join(tmp_dir, "db.sqlite"),
+        ]
+
+    def test_reads_appended_rows(self):
+        for database in self.databases:
+            Measurement.csv_storage = database
+            create_measurement(app_pkg="com.one").persist()
+            index = Measurement.get_index()
+            first, = index.measurements
+            self.assertTrue(first.persisted)
+            self.assertIs(Measurement.get_index(), index)
+            create_measurement(app_pkg="com.two").persist()
+            self.assertEqual(len(Measurement.get_index().measurements), 2)
+            # rows read before are kept as they are
+            self.assertIs(index.measurements[0], first)
+            self.assertEqual(
+                Measurement.get_all_entries_of_app("com.two", "login"),
+                index.measurements[1:]
+            )
+            self.assertEqual(Measurement.get_unique_apps(),
+                             {"com.one", "com.two"})
+
+    def test_reload_after_clear(self):
+        for database in self.databases:
+            Measurement.csv_storage = database
+            create_measurement(app_pkg="com.one").persist()
+            self.assertEqual(len(Measurement.get_index().measurements), 1)
+            Measurement.clear_database()
+            create_measurement(app_pkg="com.two").persist()
+            create_measurement(app_pkg="com.two").persist()
+            self.assertEqual(list(Measurement.get_energy_ranking()),
+                             ["com.two"])
+            self.assertEqual(
+                len(Measurement.get_all_entries_of_app("com.two", None)), 2
+            )
+
+    def test_query(self):
+        Measurement.csv_storage = self.databases[0]
+        Measurement.persist_many([
+            create_measurement(use_case=use_case, app_pkg=app_pkg)
+            for use_case in ("login", "logout")
+            for app_pkg in ("com.one", "com.two")
+        ])
+        index = Measurement.get_index()
+        self.assertEqual(len(index.query(device_model="Nexus 5X")), 4)
+        measurement, = index.query(app_pkg="com.two", use_case="logout")
+        self.assertEqual(
+            (measurement.app_pkg, measurement.use_case),
+            ("com.two", "logout")
+        )
+        self.assertEqual(index.query(app_pkg="com.three"), [])
+
+
+class TestMeasurementSet(unittest.TestCase):
+
+    def setUp(self):
+        self.sample = (
+            create_random_sample(10, 1, app_pkg="com.one", count=10) +
+            create_random_sample(20, 1, app_pkg="com.two", use_case="logout",
+                                 count=5)
+        )
+        self.measurements = MeasurementSet.from_measurements(self.sample)
+
+    def test_columns(self):
+        self.assertEqual(len(self.measurements), 15)
+        numpy.testing.assert_array_equal(
+            numpy.array(self.measurements, dtype='float'),
+            numpy.array(self.sample, dtype='float')
+        )
+        self.assertTrue(numpy.shares_memory(
+            self.measurements.energy_consumption, self.measurements.data
+        ))
+        self.assertEqual(list(self.measurements.column("app_pkg")),
+                         [measurement.app_pkg for measurement in self.sample])
+        self.assertEqual(
+            Measurement.describe(self.measurements),
+            Measurement.describe(self.sample)
+        )
+
+    def test_as_list_of_measurements(self):
+        measurement = self.measurements[10]
+        self.assertIsInstance(measurement, Measurement)
+        self.assertEqual(
+            (measurement.app_pkg, measurement.use_case,
+             measurement.energy_consumption),
+            ("com.two", "logout", self.sample[10].energy_consumption)
+        )
+        self.assertEqual(len(list(self.measurements)), 15)
+        self.assertEqual(Measurement.get_unique_use_cases(self.measurements),
+                         {"login", "logout"})
+        self.assertAlmostEqual(
+            Measurement.mean_energy_consumption(self.measurements),
+            Measurement.mean_energy_consumption(self.sample)
+        )
+
+    def test_filter_and_groupby(self):
+        two = self.measurements.filter(app_pkg="com.two")
+        self.assertEqual(len(two), 5)
+        self.assertEqual(two.unique("use_case"), {"logout"})
+        self.assertEqual(len(self.measurements.filter(app_pkg="com.none")), 0)
+        self.assertEqual(
+            len(self.measurements.filter(use_case=["login", "logout"])), 15
+        )
+        high = self.measurements[self.measurements.energy_consumption > 15]
+        self.assertEqual(len(high), 5)
+        groups = self.measurements.groupby("app_pkg")
+        self.assertEqual(list(groups), ["com.one", "com.two"])
+        self.assertEqual([len(group) for group in groups.values()], [10, 5])
+
+    def test_get_measurement_set(self):
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        Measurement.csv_storage = os.path.join(tmp_dir, "db.csv")
+        Measurement.persist_many(self.sample)
+        stored = Measurement.get_measurement_set("com.one", "login")
+        numpy.testing.assert_array_equal(
+            stored.energy_consumption,
+            self.measurements.filter(app_pkg="com.one").energy_consumption
+        )
+        self.assertTrue(stored.data["success"].all())
@@ -1,9 +1,17 @@
 """Test power_meters module."""
 
+import shutil
+import tempfile
 import time
 import unittest
 
-from physalia.power_meters import MonsoonPowerMeter
+from physalia.fixtures.monsoon import SimulatedSampleEngine
+from physalia.fixtures.traces import create_synthetic_trace
+from physalia.integrators import integrate
+from physalia.power_meters import (EmulatedPowerMeter, MonsoonPowerMeter,
+                                   ReplayPowerMeter)
+from physalia.third_party.monsoon_async import MonsoonReader
+from physalia.traces import PowerTrace
 from physalia.utils.monsoon import is_monsoon_available
 
 # pylint: disable=missing-docstring
@@ -40,4 +48,152 @@ class TestPowerMeters(unittest.TestCase):
         energy_consumption, _, error = power_meter.stop()
         self.assertFalse(error, "Power meter flagged an error.")
         self.assertGreater(energy_consumption, 0)
-        
\ No newline at end of file
+
+    def test_subscribe_without_sampling(self):
+        power_meter = EmulatedPowerMeter()
+        received = []
+        subscription = power_meter.subscribe(received.append)
+        power_meter.start()
+        energy_consumption, _, _ = power_meter.stop()
+        stats, = received
+        self.assertEqual(stats.energy_consumption, energy_consumption)
+        self.assertEqual(stats.min_power, stats.max_power)
+        subscription.cancel()
+        power_meter.start()
+        power_meter.stop()
+        self.assertEqual(len(received), 1)
+
+
+class TestSimulatedMonsoonPowerMeter(unittest.TestCase):
+
+    def test_collect_sample(self):
+        engine = SimulatedSampleEngine(current=300, noise=10, seed=1)
+        power_meter = MonsoonPowerMeter(engine=engine)
+        power_meter.start()
+        time.sleep(0.3)
+        energy_consumption, duration, error = power_meter.stop()
+        self.assertFalse(error)
+        self.assertAlmostEqual(duration, 0.3, delta=0.1)
+        self.assertAlmostEqual(energy_consumption, 0.3*duration, delta=0.01)
+
+    def test_session_with_dropouts_and_stop_latency(self):
+        engine = SimulatedSampleEngine(
+            current=300, noise=10, dropout_rate=0.1,
+            stop_latency=0.05, seed=1
+        )
+        power_meter = MonsoonPowerMeter(engine=engine)
+        power_meter.start_session()
+        for _ in range(3):
+            power_meter.start()
+            time.sleep(0.1)
+            energy_consumption, duration, error = power_meter.stop()
+            self.assertFalse(error)
+            self.assertAlmostEqual(duration, 0.1, delta=0.05)
+            self.assertAlmostEqual(
+                energy_consumption, 0.3*duration, delta=0.01
+            )
+        power_meter.stop_session()
+        self.assertFalse(power_meter.monsoon_reader.is_alive())
+
+    def test_reader_with_slow_consumer(self):
+        engine = SimulatedSampleEngine(realtime=False, seed=1)
+        received = []
+
+        def on_samples(timestamps, _):
+            received.append(len(timestamps))
+            time.sleep(0.05)
+
+        reader = MonsoonReader(engine, on_samples, drain_interval=0.01,
+                               buffer_capacity=1024)
+        reader.ring_buffer.block_timeout = 0.001
+        reader.start()
+        time.sleep(0.3)
+        reader.stop()
+        self.assertGreater(reader.overflow_count, 0)
+        self.assertLessEqual(reader.ring_buffer.high_watermark, 1024)
+        self.assertLessEqual(max(received), 1024)
+
+
+class TestReplayPowerMeter(unittest.TestCase):
+
+    def setUp(self):
+        self.timestamps, self.currents = create_synthetic_trace(duration=2)
+
+    def test_replay_as_fast_as_possible(self):
+        power_meter = ReplayPowerMeter(
+            [(self.timestamps, self.currents)],
+            speed=None
+        )
+        power_meter.start()
+        energy_consumption, duration, error = power_meter.stop()
+        self.assertFalse(error)
+        self.assertAlmostEqual(
+            energy_consumption,
+            integrate(self.timestamps, self.currents)
+        )
+        self.assertAlmostEqual(duration, self.timestamps[-1])
+
+    def test_replay_in_real_time(self):
+        power_meter = ReplayPowerMeter(
+            [(self.timestamps, self.currents)],
+            speed=1.0
+        )
+        power_meter.start()
+        time.sleep(0.2)
+        power_meter.mark("second")
+        time.sleep(0.2)
+        energy_consumption, duration, error = power_meter.stop()
+        self.assertFalse(error)
+        self.assertAlmostEqual(duration, 0.4, delta=0.1)
+        self.assertAlmostEqual(energy_consumption, 0.3*duration, delta=0.01)
+        (_, first, _), (_, second, _) = power_meter.last_segments
+        self.assertAlmostEqual(first + second, duration)
+
+    def test_subscribe(self):
+        power_meter = ReplayPowerMeter(
+            [(self.timestamps, self.currents)],
+            speed=None
+        )
+        received = []
+        subscription = power_meter.subscribe(
+            received.append, interval=0.5, window=1.0
+        )
+        power_meter.start()
+        power_meter.stop()
+        self.assertEqual(len(received), 3)
+        for stats in received:
+            self.assertAlmostEqual(stats.mean_power, 0.3, delta=0.01)
+            self.assertLess(stats.min_power, stats.mean_power)
+            self.assertGreater(stats.max_power, stats.mean_power)
+        self.assertAlmostEqual(
+            received[-1].energy_consumption,
+            0.3*received[-1].timestamp,
+            delta=0.01
+        )
+        subscription.cancel()
+        power_meter.start()
+        power_meter.stop()
+        self.assertEqual(len(received), 3)
+
+    def test_replay_session(self):
+        trace_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trace_dir)
+        power_meter = ReplayPowerMeter(
+            [(self.timestamps, self.currents)],
+            speed=1.0,
+            trace_dir=trace_dir
+        )
+        power_meter.start_session()
+        results = []
+        for _ in range(3):
+            power_meter.start()
+            time.sleep(0.1)
+            results.append(power_meter.stop())
+            time.sleep(0.05)
+        power_meter.stop_session()
+        for energy_consumption, duration, error in results:
+            self.assertFalse(error)
+            self.assertAlmostEqual(duration, 0.1, delta=0.05)
+            self.assertAlmostEqual(energy_consumption, 0.3*duration, delta=0.01)
+        trace = PowerTrace(power_meter.last_trace)
+        self.assertAlmostEqual(trace.duration, results[-1][1], delta=0.01)
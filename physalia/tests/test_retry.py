@@ -0,0 +1,134 @@
+"""Test retry module."""
+
+import subprocess
+import unittest
+
+from mock import patch
+
+from physalia import retry
+from physalia.energy_profiler import AndroidUseCase
+from physalia.exceptions import PhysaliaExecutionFailed
+from physalia.models import Measurement
+from physalia.power_meters import EmulatedPowerMeter
+from physalia.retry import RetryPolicy
+
+# pylint: disable=missing-docstring
+
+class ReconnectingPowerMeter(EmulatedPowerMeter):
+
+    def __init__(self):
+        super(ReconnectingPowerMeter, self).__init__()
+        self.reconnections = 0
+        self.running = False
+
+    def start(self):
+        super(ReconnectingPowerMeter, self).start()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        return super(ReconnectingPowerMeter, self).stop()
+
+    def reconnect(self):
+        self.reconnections += 1
+
+
+def failing_run(*errors):
+    errors = list(errors)
+
+    def run(use_case):
+        # pylint: disable=unused-argument
+        if errors:
+            raise errors.pop(0)
+    return run
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_classify(self):
+        policy = RetryPolicy()
+        self.assertEqual(
+            policy.classify(subprocess.CalledProcessError(1, "adb")),
+            retry.TRANSIENT
+        )
+        self.assertEqual(policy.classify(PhysaliaExecutionFailed()),
+                         retry.METER)
+        self.assertEqual(policy.classify(ValueError()), retry.APP)
+        policy = RetryPolicy(classify=lambda error: (
+            retry.FATAL if isinstance(error, KeyError) else None
+        ))
+        self.assertEqual(policy.classify(KeyError()), retry.FATAL)
+        self.assertEqual(policy.classify(ValueError()), retry.APP)
+
+    def test_budgets_and_backoff(self):
+        policy = RetryPolicy(max_retries=4, backoff=1.0, backoff_factor=2.0,
+                             max_backoff=3.0, budgets={retry.APP: 1})
+        state = policy.attempt()
+        self.assertEqual(state.retry(retry.TRANSIENT), 1.0)
+        self.assertEqual(state.retry(retry.APP), 2.0)
+        self.assertIsNone(state.retry(retry.APP))
+        self.assertIsNone(state.retry(retry.FATAL))
+        self.assertEqual(state.retry(retry.TRANSIENT), 3.0)
+        self.assertEqual(state.retry(retry.TRANSIENT), 3.0)
+        self.assertIsNone(state.retry(retry.TRANSIENT))
+        self.assertEqual(state.counts, {retry.TRANSIENT: 3, retry.APP: 1})
+
+
+class TestRunRetries(unittest.TestCase):
+
+    def create_use_case(self, run):
+        # pylint: disable=no-self-use
+        return AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+            run=run,
+        )
+
+    def test_retries_recorded(self):
+        power_meter = ReconnectingPowerMeter()
+        use_case = self.create_use_case(failing_run(
+            subprocess.CalledProcessError(1, "adb"),
+            PhysaliaExecutionFailed(),
+        ))
+        measurement = use_case.run(
+            power_meter=power_meter,
+            retry_policy=RetryPolicy(max_retries=3, backoff=0.0)
+        )
+        self.assertEqual(measurement.retries,
+                         {retry.TRANSIENT: 1, retry.METER: 1})
+        self.assertEqual(power_meter.reconnections, 1)
+        self.assertFalse(power_meter.running)
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        Measurement.csv_storage = "./test_retry_db.csv"
+        self.addCleanup(Measurement.clear_database)
+        measurement.persist()
+        stored = Measurement.get_all_entries_of_app("no.package", "Test")
+        self.assertEqual(stored[0].retries, measurement.retries)
+
+    def test_budget_exhausted(self):
+        power_meter = ReconnectingPowerMeter()
+        use_case = self.create_use_case(failing_run(
+            ValueError("first"), ValueError("second")
+        ))
+        with self.assertRaises(ValueError):
+            use_case.run(
+                power_meter=power_meter,
+                retry_policy=RetryPolicy(max_retries=3, backoff=0.0)
+            )
+        self.assertEqual(power_meter.reconnections, 0)
+        self.assertFalse(power_meter.running)
+
+    def test_retry_limit(self):
+        use_case = self.create_use_case(failing_run(
+            ValueError("first"), ValueError("second")
+        ))
+        with patch.object(RetryPolicy, 'delay', return_value=0.0):
+            measurement = use_case.run(power_meter=ReconnectingPowerMeter(),
+                                       retry_limit=3)
+        self.assertEqual(measurement.retries, {retry.APP: 2})
+        policy = RetryPolicy.from_retry_limit(3)
+        self.assertEqual(policy.budgets[retry.APP], 3)
+        self.assertEqual(policy.budgets[retry.FATAL], 0)
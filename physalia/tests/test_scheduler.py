@@ -0,0 +1,38 @@
+"""Test scheduler module."""
+
+import threading
+import time
+import unittest
+
+from physalia.energy_profiler import AndroidUseCase
+from physalia.power_meters import EmulatedPowerMeter
+from physalia.scheduler import DevicePool, Rig
+
+# pylint: disable=missing-docstring
+
+class TestDevicePool(unittest.TestCase):
+
+    def test_profile(self):
+        devices = []
+        lock = threading.Lock()
+
+        def run(use_case):
+            with lock:
+                devices.append((use_case.name, use_case.serialno))
+            time.sleep(0.01)
+
+        use_cases = [
+            AndroidUseCase(name, "no/path", "no.package", "0.0.0", run=run)
+            for name in ("first", "second")
+        ]
+        pool = DevicePool([
+            Rig(EmulatedPowerMeter(), "device1"),
+            Rig(EmulatedPowerMeter(), "device2"),
+        ])
+        results = pool.profile(use_cases, count=4, verbose=False)
+        self.assertEqual([len(sample) for sample in results], [4, 4])
+        self.assertEqual(
+            {serialno for _, serialno in devices},
+            {"device1", "device2"}
+        )
+        self.assertIsNone(use_cases[0].serialno)
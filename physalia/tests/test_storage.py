@@ -0,0 +1,233 @@
+"""Test storage module."""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from physalia.fixtures.models import create_measurement, create_random_sample
+from physalia.models import Measurement
+from physalia.storage import (COLUMNS, BatchWriter, CSVStorage,
+                              SQLiteStorage, open_storage,
+                              migrate_csv_to_sqlite)
+
+# pylint: disable=missing-docstring
+
+def _append_rows(path, worker, count):
+    storage = CSVStorage(path)
+    for index in range(count):
+        measurement = create_measurement()
+        measurement.notes = "x" * 20000
+        measurement.use_case = "{}-{}".format(worker, index)
+        storage.append([measurement.to_row()])
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        Measurement.csv_storage = os.path.join(self.tmp_dir, "db.sqlite")
+
+    def test_open_storage(self):
+        self.assertIsInstance(Measurement.get_storage(), SQLiteStorage)
+        self.assertIs(Measurement.get_storage(), Measurement.get_storage())
+        self.assertIsInstance(
+            open_storage(os.path.join(self.tmp_dir, "db.csv")),
+            CSVStorage
+        )
+
+    def test_wal_and_indexes(self):
+        storage = Measurement.get_storage()
+        # pylint: disable=protected-access
+        connection = storage._connection
+        self.assertEqual(
+            connection.execute("PRAGMA journal_mode").fetchone()[0],
+            "wal"
+        )
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM measurements WHERE app_pkg = ?",
+            ("com.app",)
+        ).fetchall()
+        self.assertIn("measurements_app_pkg", str(plan))
+
+    def test_queries(self):
+        measurement = create_measurement(use_case="login", app_pkg="com.one")
+        measurement.segments = [("start", 1.0, 15.0), ("end", 1.0, 15.0)]
+        measurement.persist()
+        create_measurement(use_case="logout", app_pkg="com.one").persist()
+        create_measurement(use_case="login", app_pkg="com.two").persist()
+        stored, = Measurement.get_all_entries_of_app("com.one", "login")
+        self.assertEqual(stored.segments, measurement.segments)
+        self.assertIs(stored.success, True)
+        self.assertEqual(len(Measurement.get_all_entries_of_app("com.one", None)), 2)
+        self.assertEqual(Measurement.get_unique_apps(), {"com.one", "com.two"})
+        Measurement.clear_database()
+        self.assertEqual(Measurement.get_unique_apps(), set())
+
+    def test_energy_ranking(self):
+        for mean, app_pkg in ((12, "com.app2"), (10, "com.app1")):
+            for measurement in create_random_sample(mean, 1, app_pkg=app_pkg):
+                measurement.persist()
+        self.assertEqual(list(Measurement.get_energy_ranking()),
+                         ["com.app1", "com.app2"])
+
+    def test_migrate_csv(self):
+        csv_path = os.path.join(self.tmp_dir, "db.csv")
+        sample = create_random_sample(10, 1, count=25)
+        sample[0].phases = [("run", 1.0)]
+        for measurement in sample:
+            measurement.save_to_csv(csv_path)
+        # rows of older versions have fewer columns
+        with open(csv_path, 'at') as csv_file:
+            csv_file.write("1.0,login,com.package,1.0.0,Nexus 5X,2.0,30.0\n")
+        self.assertEqual(
+            migrate_csv_to_sqlite(csv_path, Measurement.csv_storage,
+                                  batch_size=10),
+            26
+        )
+        stored = Measurement.get_all_entries_of_app("com.package", "login")
+        self.assertEqual(len(stored), 26)
+        self.assertEqual(stored[0].phases, [("run", 1.0)])
+        self.assertEqual(
+            [measurement.energy_consumption for measurement in stored[:25]],
+            [measurement.energy_consumption for measurement in sample]
+        )
+        # empty values are kept as the CSV storage reads them
+        notes_index = COLUMNS.index("notes")
+        self.assertEqual(
+            [row[notes_index]
+             for row in Measurement.get_storage().query()[:25]],
+            [row[notes_index] for row in list(CSVStorage(csv_path))[:25]]
+        )
+
+    def test_read_from(self):
+        storage = Measurement.get_storage()
+        sample = create_random_sample(10, 1, count=3)
+        storage.append([measurement.to_row() for measurement in sample[:2]])
+        rows, position = storage.read_from()
+        self.assertEqual(len(rows), 2)
+        storage.append([sample[2].to_row()])
+        rows, position = storage.read_from(position)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(storage.read_from(position), ([], position))
+        # pylint: disable=protected-access
+        with storage._connection:
+            storage._connection.execute(
+                "DELETE FROM measurements WHERE rowid = 3"
+            )
+        self.assertIsNone(storage.read_from(position))
+        _, position = storage.read_from()
+        storage.clear()
+        storage.append([sample[0].to_row()])
+        self.assertIsNone(storage.read_from(position))
+
+
+class TestBatchWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_flush_on_size_and_exit(self):
+        storage = CSVStorage(os.path.join(self.tmp_dir, "db.csv"))
+        sample = create_random_sample(10, 1, count=5)
+        with BatchWriter(storage, batch_size=2,
+                         flush_interval=float('inf')) as writer:
+            for measurement in sample[:3]:
+                writer.write(measurement.to_row())
+            self.assertEqual(len(list(storage)), 2)
+            for measurement in sample[3:]:
+                writer.write(measurement.to_row())
+        self.assertEqual(len(list(storage)), 5)
+        with open(storage.path) as csv_file:
+            self.assertEqual(csv_file.read().count("timestamp"), 1)
+
+    def test_flush_on_interval(self):
+        storage = CSVStorage(os.path.join(self.tmp_dir, "db.csv"))
+        measurement = create_measurement()
+        with BatchWriter(storage, batch_size=100,
+                         flush_interval=0) as writer:
+            writer.write(measurement.to_row())
+            self.assertEqual(len(list(storage)), 1)
+
+    def test_persist_many(self):
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        Measurement.csv_storage = os.path.join(self.tmp_dir, "db.sqlite")
+        sample = create_random_sample(10, 1, count=5)
+        sample[0].persist()
+        self.assertEqual(Measurement.persist_many(sample, batch_size=2), 4)
+        self.assertTrue(all(measurement.persisted for measurement in sample))
+        self.assertEqual(
+            len(Measurement.get_all_entries_of_app("com.package", "login")), 5
+        )
+
+    def test_persist_many_failed_flush(self):
+        storage = MagicMock()
+        append = storage.sink.return_value.__enter__.return_value
+        append.side_effect = [None, IOError("disk full")]
+        sample = create_random_sample(10, 1, count=5)
+        with patch.object(Measurement, 'get_storage', return_value=storage):
+            with self.assertRaises(IOError):
+                Measurement.persist_many(sample, batch_size=2)
+        self.assertEqual(
+            [measurement.persisted for measurement in sample],
+            [True, True, False, False, False]
+        )
+
+
+class TestCSVStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "db.csv")
+
+    def test_concurrent_processes(self):
+        workers = [
+            multiprocessing.Process(target=_append_rows,
+                                    args=(self.path, worker, 20))
+            for worker in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        rows = list(CSVStorage(self.path))
+        self.assertEqual(len(rows), 80)
+        self.assertTrue(all(len(row) == len(COLUMNS) for row in rows))
+        self.assertEqual(len({row[1] for row in rows}), 80)
+        with open(self.path) as csv_file:
+            self.assertEqual(csv_file.read().count("timestamp"), 1)
+
+    def test_append_after_incomplete_row(self):
+        self.addCleanup(setattr, Measurement, 'csv_storage',
+                        Measurement.csv_storage)
+        Measurement.csv_storage = self.path
+        create_measurement().persist()
+        with open(self.path, 'at') as csv_file:
+            csv_file.write("1.0,login,com.pack")
+        self.assertEqual(len(list(CSVStorage(self.path))), 1)
+        self.assertEqual(len(Measurement.get_index().measurements), 1)
+        create_measurement().persist()
+        rows = list(CSVStorage(self.path))
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(all(len(row) == len(COLUMNS) for row in rows))
+        with open(self.path) as csv_file:
+            self.assertNotIn("com.pack\n", csv_file.read())
+        self.assertEqual(
+            len(Measurement.get_all_entries_of_app("com.package", "login")), 2
+        )
+
+    def test_skips_incomplete_rows(self):
+        with open(self.path, 'wt') as csv_file:
+            csv_file.write(",".join(COLUMNS) + "\n1.0,login,com.pack\n")
+        CSVStorage(self.path).append([create_measurement().to_row()])
+        self.assertEqual(len(list(CSVStorage(self.path))), 1)
+        rows, _ = CSVStorage(self.path).read_from()
+        self.assertEqual(len(rows), 1)
@@ -0,0 +1,46 @@
+"""Test subscriptions module."""
+
+import unittest
+
+from physalia.subscriptions import Subscription
+
+# pylint: disable=missing-docstring
+
+class TestSubscription(unittest.TestCase):
+
+    def test_rolling_window(self):
+        subscription = Subscription(None, interval=1.0, window=2.0)
+        delivered = []
+        for second in range(5):
+            stats = subscription.update(
+                second, second + 1,
+                energy=second + 1,
+                min_current=100 * (second + 1),
+                max_current=200 * (second + 1),
+                energy_consumption=sum(range(second + 2))
+            )
+            delivered.append(stats)
+        self.assertTrue(all(delivered))
+        last = delivered[-1]
+        self.assertEqual(last.timestamp, 5)
+        self.assertAlmostEqual(last.mean_power, (4 + 5) / 2.0)
+        self.assertAlmostEqual(last.min_power, 0.4)
+        self.assertAlmostEqual(last.max_power, 1.0)
+        self.assertEqual(last.energy_consumption, 15)
+
+    def test_delivery_interval(self):
+        subscription = Subscription(None, interval=1.0)
+        delivered = [
+            subscription.update(step * 0.25, (step + 1) * 0.25, 1, 1, 1, 1)
+            for step in range(8)
+        ]
+        self.assertEqual(
+            [stats is not None for stats in delivered],
+            [False, False, False, True, False, False, False, True]
+        )
+
+    def test_new_capture_resets_window(self):
+        subscription = Subscription(None, interval=1.0, window=10.0)
+        subscription.update(0, 5, 100, 1, 1, 100)
+        stats = subscription.update(0, 1, 1, 1, 1, 1)
+        self.assertAlmostEqual(stats.mean_power, 1.0)
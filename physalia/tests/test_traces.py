@@ -0,0 +1,66 @@
+"""Test traces module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from physalia.integrators import integrate
+from physalia.traces import TraceWriter, PowerTrace, load_trace, TRACE_DTYPE
+
+# pylint: disable=missing-docstring
+
+class TestTraces(unittest.TestCase):
+
+    def setUp(self):
+        self.trace_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.trace_dir)
+        self.path = os.path.join(self.trace_dir, "test.trace")
+
+    def test_write_and_load(self):
+        timestamps = np.arange(1000) * 0.0002
+        currents = np.random.normal(300, 20, 1000)
+        with TraceWriter(self.path, capacity=16) as writer:
+            for start in range(0, 1000, 128):
+                writer.write(
+                    timestamps[start:start+128],
+                    currents[start:start+128]
+                )
+        self.assertEqual(
+            os.path.getsize(self.path),
+            1000 * TRACE_DTYPE.itemsize
+        )
+        trace = load_trace(self.path)
+        np.testing.assert_array_equal(trace['timestamp'], timestamps)
+        np.testing.assert_array_equal(trace['current'], currents)
+
+    def test_empty_trace(self):
+        TraceWriter(self.path).close()
+        self.assertEqual(len(load_trace(self.path)), 0)
+
+    def test_energy_between(self):
+        timestamps = np.arange(5000) * 0.0002
+        currents = np.random.normal(300, 20, 5000)
+        with TraceWriter(self.path) as writer:
+            writer.write(timestamps, currents)
+        trace = PowerTrace(self.path)
+        self.assertAlmostEqual(
+            trace.energy_consumption,
+            integrate(timestamps, currents)
+        )
+        self.assertAlmostEqual(
+            trace.energy_between(0.1, 0.5),
+            integrate(timestamps[500:2501], currents[500:2501])
+        )
+        self.assertTrue(os.path.isfile(trace.index_path))
+        cached_trace = PowerTrace(self.path)
+        np.testing.assert_allclose(
+            cached_trace.energy_between_many([0.0, 0.1, 0.7], [0.1, 0.5, 0.2]),
+            [
+                integrate(timestamps[:501], currents[:501]),
+                integrate(timestamps[500:2501], currents[500:2501]),
+                0.0,
+            ]
+        )
@@ -0,0 +1,73 @@
+"""Test tracing module."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from physalia import tracing
+from physalia.energy_profiler import AndroidUseCase
+from physalia.power_meters import EmulatedPowerMeter
+
+# pylint: disable=missing-docstring
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracing.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        self.assertFalse(tracing.is_enabled())
+        self.assertIs(tracing.span("a"), tracing.span("b"))
+
+        @tracing.traced()
+        def add(first, second):
+            return first + second
+
+        self.assertEqual(add(1, second=2), 3)
+        tracing.instant("nothing")
+
+    def test_spans(self):
+        with tracing.trace() as tracer:
+            with tracing.span("outer", answer=42):
+                tracing.instant("mark")
+                with self.assertRaises(ValueError):
+                    with tracing.span("inner"):
+                        raise ValueError()
+        self.assertFalse(tracing.is_enabled())
+        inner, instant, outer = sorted(
+            tracer.events, key=lambda event: event['name']
+        )
+        self.assertEqual(outer['args'], {'answer': 42})
+        self.assertEqual(inner['args'], {'error': 'ValueError'})
+        self.assertEqual(instant['ph'], 'i')
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertLessEqual(
+            inner['ts'] + inner['dur'],
+            outer['ts'] + outer['dur']
+        )
+
+    def test_export_use_case(self):
+        filename = os.path.join(self.tmp_dir, "trace.json")
+        use_case = AndroidUseCase(
+            name="Test",
+            app_apk="no/path",
+            app_pkg="no.package",
+            app_version="0.0.0",
+        )
+        with tracing.trace(filename):
+            use_case.profile(power_meter=EmulatedPowerMeter(), count=2,
+                             verbose=False)
+        with open(filename) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        names = [event['name'] for event in events if event['ph'] == 'X']
+        self.assertEqual(names.count("AndroidUseCase.run"), 2)
+        self.assertEqual(names.count("EmulatedPowerMeter.start"), 2)
+        self.assertEqual(names.count("use case"), 2)
+        self.assertIn("AndroidUseCase.profile", names)
+        self.assertIn("thread_name", [event['name'] for event in events])
@@ -0,0 +1,157 @@
+"""Test adb module."""
+
+import asyncio
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from physalia.utils import adb
+from physalia.utils.adb import ShellSession, AdbSessionError
+
+# pylint: disable=missing-docstring
+
+
+class TestShellSession(unittest.TestCase):
+
+    def setUp(self):
+        self.session = ShellSession(["sh"])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_output(self):
+        self.assertEqual(self.session.run("echo hello"), (0, "hello\n"))
+        self.assertEqual(self.session.run("printf abc"), (0, "abc"))
+        self.assertEqual(self.session.run("true"), (0, ""))
+        self.assertEqual(
+            self.session.run("printf 'a\\n\\nb\\n' | grep -v b"),
+            (0, "a\n\n")
+        )
+
+    def test_exit_status(self):
+        self.assertEqual(self.session.run("echo no; exit 3"), (3, "no\n"))
+        self.assertEqual(self.session.run("echo yes | grep no"), (1, ""))
+        # the session survives commands that exit or read input
+        self.assertEqual(self.session.run("cat; echo ok"), (0, "ok\n"))
+        self.assertTrue(self.session.alive)
+
+    def test_closed_session(self):
+        self.session.close()
+        with self.assertRaises(AdbSessionError):
+            self.session.run("true")
+
+
+# `adb [-s serialno] shell command` runs `command` in the host
+FAKE_ADB = """#!/bin/sh
+while [ "$1" != shell ]; do shift; done
+shift
+if [ $# -eq 0 ]; then exec sh; fi
+exec sh -c "$1"
+"""
+
+
+class TestShell(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        fake_adb = os.path.join(tmp_dir, "adb")
+        with open(fake_adb, 'w') as script:
+            script.write(FAKE_ADB)
+        os.chmod(fake_adb, 0o755)
+        path = tmp_dir + os.pathsep + os.environ.get("PATH", "")
+        patcher = patch.dict(os.environ, {"PATH": path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        adb.close_sessions(everything=True)
+
+    def test_fallback(self):
+        command = "echo 'a  b' && echo c"
+        with patch.object(adb, '_get_session', side_effect=OSError()):
+            # the command reaches the device as a whole
+            self.assertEqual(adb.shell(command, "fake"), "a  b\nc\n")
+        self.assertEqual(adb.shell(command, "fake"), "a  b\nc\n")
+
+    def test_no_fallback_once_sent(self):
+        # pylint: disable=protected-access
+        adb._sessions["fake"] = ShellSession(["sh"])
+        log = os.path.join(tempfile.mkdtemp(), "log")
+        self.addCleanup(shutil.rmtree, os.path.dirname(log))
+        with self.assertRaises(AdbSessionError):
+            adb.shell("echo run >> {}; kill -9 $$".format(log), "fake")
+        with open(log) as log_file:
+            self.assertEqual(log_file.read(), "run\n")
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            adb.shell("sleep 5", "fake", timeout=0.2)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(adb.shell("echo hi", "fake"), "hi\n")
+
+    def test_ashell(self):
+        self.assertEqual(
+            asyncio.run(adb.ashell("echo 'a  b' && echo c", "fake")),
+            "a  b\nc\n"
+        )
+        with self.assertRaises(subprocess.CalledProcessError):
+            asyncio.run(adb.ashell("false", "fake"))
+
+    def test_session_reused(self):
+        # pylint: disable=protected-access
+        session = ShellSession(["sh"])
+        adb._sessions["fake"] = session
+        self.assertEqual(adb.shell("echo hi", "fake"), "hi\n")
+        self.assertEqual(adb.shell("echo hey", "fake"), "hey\n")
+        self.assertIs(adb._sessions["fake"], session)
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            adb.shell("echo out; false", "fake")
+        self.assertEqual(context.exception.output, "out\n")
+        self.assertIs(adb._sessions["fake"], session)
+
+
+def track_devices_args(*messages):
+    """Command line of a fake `adb track-devices` with `messages`."""
+    script = "; ".join(
+        "printf '%04x%b' {} '{}'; sleep 0.05".format(
+            len(message), message.replace("\t", "\\t").replace("\n", "\\n")
+        )
+        for message in messages
+    )
+    return ["sh", "-c", script]
+
+
+class TestDeviceWatcher(unittest.TestCase):
+
+    def test_read_device_states(self):
+        stream = io.BytesIO(b"0000001c0123abcd\tdevice\nemu\toffline\n")
+        self.assertEqual(
+            list(adb.read_device_states(stream)),
+            [{}, {"0123abcd": "device", "emu": "offline"}]
+        )
+
+    def test_wait_for_device(self):
+        args = track_devices_args("", "emu\toffline\n", "emu\tdevice\n")
+        with adb.DeviceWatcher(args) as watcher:
+            self.assertEqual(watcher.wait_for("emu", timeout=5), "emu")
+        with adb.DeviceWatcher(args) as watcher:
+            self.assertEqual(watcher.wait_for(timeout=5), "emu")
+
+    def test_timeout(self):
+        args = ["sh", "-c", "printf '000cemu\tdevice\n'; exec sleep 5"]
+        with adb.DeviceWatcher(args) as watcher:
+            start = time.time()
+            self.assertIsNone(watcher.wait_for("other", timeout=0.2))
+            self.assertLess(time.time() - start, 1)
+
+    def test_tracker_exits(self):
+        with adb.DeviceWatcher(track_devices_args("")) as watcher:
+            self.assertIsNone(watcher.wait_for("emu"))
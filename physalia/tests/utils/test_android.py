@@ -0,0 +1,151 @@
+"""Test android module."""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+from physalia.utils import android
+
+# pylint: disable=missing-docstring
+
+OUTPUTS = {
+    "getprop ro.product.model": "Nexus 5X\n",
+    "getprop ro.build.version.release": "8.1.0\n",
+    "getprop ro.build.display.id": "OPM7.181205.001\n",
+    "wm size": "Physical size: 1080x1920\nOverride size: 720x1280\n",
+}
+
+
+def fake_shell(command, serialno=None):
+    # pylint: disable=unused-argument
+    if command in OUTPUTS:
+        return OUTPUTS[command]
+    raise subprocess.CalledProcessError(1, command, "")
+
+
+class TestDeviceInfo(unittest.TestCase):
+
+    def setUp(self):
+        android.invalidate_device_info("serial")
+
+    def tearDown(self):
+        android.invalidate_device_info("serial")
+
+    @patch('physalia.utils.adb.shell', side_effect=fake_shell)
+    def test_cached(self, shell):
+        info = android.get_device_info("serial")
+        self.assertEqual(info.model, "Nexus 5X")
+        self.assertEqual(info.android_version, "8.1.0")
+        self.assertEqual(info.resolution, (720, 1280))
+        self.assertIsNone(info.battery_capacity)
+        calls = shell.call_count
+        self.assertEqual(android.get_device_info("serial"), info)
+        self.assertEqual(shell.call_count, calls)
+        android.get_device_info("serial", refresh=True)
+        self.assertEqual(shell.call_count, 2*calls)
+
+    @patch('physalia.utils.adb.shell', side_effect=fake_shell)
+    def test_invalidated_on_reconnect(self, shell):
+        android.get_device_info("serial")
+        calls = shell.call_count
+        with patch('subprocess.check_output'):
+            android.reconnect_adb_through_usb("serial")
+        android.get_device_info("serial")
+        self.assertEqual(shell.call_count, 2*calls)
+
+    @patch('physalia.utils.adb.shell',
+           side_effect=subprocess.CalledProcessError(1, "adb"))
+    def test_unavailable_device_cached(self, shell):
+        self.assertEqual(android.get_device_info("serial").model, "N/A")
+        self.assertEqual(shell.call_count, 1)
+        android.get_device_info("serial")
+        self.assertEqual(shell.call_count, 1)
+        android.get_device_info("serial", refresh=True)
+        self.assertEqual(shell.call_count, 2)
+
+
+class FakeDevice(object):
+
+    def __init__(self):
+        self.apk = None
+        self.version = 0
+        self.commands = []
+
+    def adb(self, args):
+        self.commands.append(args[-2])
+        if args[-2] == "uninstall":
+            self.apk = None
+            return
+        with open(args[-1], 'rb') as apk_file:
+            self.apk = apk_file.read()
+        self.version += 1
+
+    def shell(self, command, serialno=None):
+        # pylint: disable=unused-argument
+        self.commands.append(command)
+        path = "/data/app/pkg-{}/base.apk".format(self.version)
+        if command == "pm path pkg" and self.apk is not None:
+            return "package:{}\n".format(path)
+        if command == "stat -c '%n %s %Y' {}".format(path):
+            return "{} {} {}\n".format(path, len(self.apk), self.version)
+        if command == "sha256sum {}".format(path):
+            return "{}  {}\n".format(hashlib.sha256(self.apk).hexdigest(), path)
+        raise subprocess.CalledProcessError(1, command, "")
+
+
+class TestApkInstallCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.apk = os.path.join(self.tmp_dir, "app.apk")
+        with open(self.apk, 'wb') as apk_file:
+            apk_file.write(b"version 1")
+        self.device = FakeDevice()
+        self.patches = [
+            patch('physalia.utils.adb.shell', side_effect=self.device.shell),
+            patch('subprocess.check_output', side_effect=self.device.adb),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        android.uninstall_app("pkg", "serial")
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_installed(self):
+        self.assertFalse(android.is_apk_installed(self.apk, "pkg", "serial"))
+
+    def test_installed(self):
+        android.install_apk(self.apk, "serial", "pkg")
+        with patch('physalia.utils.apk.file_digest') as file_digest:
+            self.assertTrue(
+                android.is_apk_installed(self.apk, "pkg", "serial")
+            )
+        # cached: neither the local nor the device apk is hashed again
+        file_digest.assert_not_called()
+        self.assertFalse(any(
+            command.startswith("sha256sum") for command in self.device.commands
+        ))
+        with open(self.apk, 'wb') as apk_file:
+            apk_file.write(b"version 2")
+        stat = os.stat(self.apk)
+        os.utime(self.apk, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertFalse(android.is_apk_installed(self.apk, "pkg", "serial"))
+
+    def test_installed_elsewhere(self):
+        self.device.adb(["install", self.apk])
+        self.assertTrue(android.is_apk_installed(self.apk, "pkg", "serial"))
+        self.assertTrue(any(
+            command.startswith("sha256sum") for command in self.device.commands
+        ))
+        # the device apk changes behind the cache
+        self.device.apk = b"version 0"
+        self.device.version += 1
+        self.assertFalse(android.is_apk_installed(self.apk, "pkg", "serial"))
@@ -0,0 +1,154 @@
+"""Test apk module."""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from physalia.utils import apk
+
+# pylint: disable=missing-docstring
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+ATTRIBUTE_IDS = {
+    "name": 0x01010003,
+    "targetPackage": 0x01010021,
+    "versionCode": 0x0101021b,
+    "versionName": 0x0101021c,
+}
+
+
+def encode_string_pool(strings, utf8):
+    data = b""
+    offsets = []
+    for string in strings:
+        offsets.append(len(data))
+        if utf8:
+            encoded = string.encode('utf-8')
+            data += struct.pack('<BB', len(string), len(encoded))
+            data += encoded + b"\0"
+        else:
+            data += struct.pack('<H', len(string))
+            data += string.encode('utf-16-le') + b"\0\0"
+    data += b"\0" * (-len(data) % 4)
+    strings_start = 28 + 4*len(strings)
+    header = struct.pack(
+        '<HHIIIIII', 0x0001, 28, strings_start + len(data), len(strings), 0,
+        0x100 if utf8 else 0, strings_start, 0
+    )
+    return header + struct.pack('<{}I'.format(len(strings)), *offsets) + data
+
+
+def encode_axml(elements, utf8=False, strip_names=False):
+    """Encode (tag, attributes) in binary XML, all attributes in android ns.
+
+    Values are encoded as strings, or as decimal integers if they are
+    ints. The package attribute of manifest has no namespace.
+    """
+    # resource attribute names come first, to match the resource map
+    strings = sorted(
+        {name for _, attributes in elements for name in attributes
+         if name in ATTRIBUTE_IDS},
+        key=list(ATTRIBUTE_IDS).index
+    )
+    resource_ids = [ATTRIBUTE_IDS[name] for name in strings]
+    if strip_names:
+        strings = ["" for _ in strings]
+    def index(string):
+        if string not in strings[len(resource_ids):]:
+            strings.append(string)
+        return strings.index(string, len(resource_ids))
+    nodes = b""
+    for tag, attributes in elements:
+        encoded_attributes = b""
+        for name, value in sorted(attributes.items()):
+            if name in ATTRIBUTE_IDS:
+                name_index = resource_ids.index(ATTRIBUTE_IDS[name])
+                namespace = index(ANDROID_NS)
+            else:
+                name_index = index(name)
+                namespace = 0xffffffff
+            if isinstance(value, int):
+                raw, data_type, data = 0xffffffff, 0x10, value
+            else:
+                raw = data = index(value)
+                data_type = 0x03
+            encoded_attributes += struct.pack(
+                '<IIIHBBI', namespace, name_index, raw, 8, 0, data_type, data
+            )
+        extension = struct.pack(
+            '<IIHHHHHH', 0xffffffff, index(tag), 20, 20, len(attributes),
+            0, 0, 0
+        )
+        size = 16 + len(extension) + len(encoded_attributes)
+        nodes += struct.pack('<HHIII', 0x0102, 16, size, 1, 0xffffffff)
+        nodes += extension + encoded_attributes
+    for tag, _ in reversed(elements):
+        nodes += struct.pack('<HHIIIII', 0x0103, 16, 24, 1, 0xffffffff,
+                             0xffffffff, index(tag))
+    resource_map = struct.pack(
+        '<HHI{}I'.format(len(resource_ids)), 0x0180, 8,
+        8 + 4*len(resource_ids), *resource_ids
+    )
+    body = encode_string_pool(strings, utf8) + resource_map + nodes
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+MANIFEST = [
+    ("manifest", {"package": "com.example.app", "versionCode": 42,
+                  "versionName": "1.2.3"}),
+    ("uses-sdk", {}),
+    ("instrumentation", {"name": ".test.Runner",
+                         "targetPackage": "com.example.app"}),
+]
+
+
+class TestApkManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_apk(self, manifest):
+        path = os.path.join(self.tmp_dir, "app.apk")
+        with zipfile.ZipFile(path, 'w') as apk_file:
+            apk_file.writestr("AndroidManifest.xml", manifest)
+            apk_file.writestr("classes.dex", b"dex")
+        return path
+
+    def check_manifest(self, manifest):
+        self.assertEqual(manifest.package, "com.example.app")
+        self.assertEqual(manifest.version_name, "1.2.3")
+        self.assertEqual(manifest.version_code, 42)
+        self.assertEqual(
+            manifest.instrumentations,
+            [("com.example.app.test.Runner", "com.example.app")]
+        )
+
+    def test_parse_manifest(self):
+        self.check_manifest(apk.parse_manifest(encode_axml(MANIFEST)))
+        self.check_manifest(
+            apk.parse_manifest(encode_axml(MANIFEST, utf8=True))
+        )
+        self.check_manifest(
+            apk.parse_manifest(encode_axml(MANIFEST, strip_names=True))
+        )
+
+    def test_read_manifest(self):
+        path = self.create_apk(encode_axml(MANIFEST))
+        manifest = apk.read_manifest(path)
+        self.check_manifest(manifest)
+        self.assertIs(apk.read_manifest(path), manifest)
+
+    def test_invalid_manifest(self):
+        with self.assertRaises(apk.ManifestError):
+            apk.read_manifest(self.create_apk(b"<manifest/>"))
+        path = os.path.join(self.tmp_dir, "empty.apk")
+        with zipfile.ZipFile(path, 'w') as apk_file:
+            apk_file.writestr("classes.dex", b"dex")
+        with self.assertRaises(apk.ManifestError):
+            apk.read_manifest(path)
@@ -0,0 +1,48 @@
+"""Test ring_buffer module."""
+
+import threading
+import unittest
+
+import numpy as np
+
+from physalia.utils.ring_buffer import SampleRingBuffer
+
+# pylint: disable=missing-docstring
+
+class TestSampleRingBuffer(unittest.TestCase):
+
+    def test_wrap_around(self):
+        ring_buffer = SampleRingBuffer(capacity=10)
+        ring_buffer.write(np.arange(7), np.arange(7)*2)
+        timestamps, _ = ring_buffer.read()
+        np.testing.assert_array_equal(timestamps, np.arange(7))
+        ring_buffer.write(np.arange(7, 15), np.arange(7, 15)*2)
+        timestamps, currents = ring_buffer.read()
+        np.testing.assert_array_equal(timestamps, np.arange(7, 15))
+        np.testing.assert_array_equal(currents, np.arange(7, 15)*2)
+
+    def test_overflow(self):
+        ring_buffer = SampleRingBuffer(capacity=10, block_timeout=0)
+        self.assertEqual(ring_buffer.write(np.arange(8), np.arange(8)), 8)
+        self.assertEqual(ring_buffer.write(np.arange(8), np.arange(8)), 2)
+        self.assertEqual(ring_buffer.overflow_count, 6)
+        self.assertEqual(ring_buffer.overflow_events, 1)
+        self.assertEqual(ring_buffer.high_watermark, 10)
+        self.assertEqual(len(ring_buffer.read()[0]), 10)
+
+    def test_backpressure(self):
+        ring_buffer = SampleRingBuffer(capacity=10, block_timeout=5)
+        ring_buffer.write(np.arange(10), np.arange(10))
+        reader = threading.Timer(0.05, ring_buffer.read)
+        reader.start()
+        self.assertEqual(ring_buffer.write(np.arange(5), np.arange(5)), 5)
+        reader.join()
+        self.assertEqual(ring_buffer.overflow_count, 0)
+
+    def test_close(self):
+        ring_buffer = SampleRingBuffer(capacity=10)
+        ring_buffer.write(np.arange(3), np.arange(3))
+        ring_buffer.close()
+        self.assertEqual(len(ring_buffer.read()[0]), 3)
+        self.assertEqual(len(ring_buffer.read()[0]), 0)
+        self.assertTrue(ring_buffer.closed)
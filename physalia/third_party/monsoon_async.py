@@ -4,18 +4,59 @@ This is based on the original code by Google, which is
 licensed under the Apache License, Version 2.0 .
 """
 
-from threading import Thread
-from Monsoon.sampleEngine import triggers
+import time
+from threading import Thread, Event
 
-# pylint: disable=protected-access
+import numpy as np
+from Monsoon.sampleEngine import channels
+
+from physalia.utils.ring_buffer import SampleRingBuffer
+
+# sampling rate of Monsoon power monitors
+SAMPLE_HZ = 5000
 
 class MonsoonReader(Thread):
-    """`Thread` subclass to asynchronously control monsoon measurements."""
+    """`Thread` subclass to asynchronously control monsoon measurements.
+
+    The reader collects samples from the engine in periodic sampling
+    mode and moves them into a bounded ring buffer, and a consumer
+    thread drains the buffer into `on_samples`. Memory is thus bounded
+    by the capacity of the buffer, even if the consumer falls behind.
+
+    Args:
+        monsoon_engine      `SampleEngine` used to collect samples.
+        on_samples          Callback receiving chunks of (timestamps,
+                            currents) while sampling is running. Both
+                            arrays of a chunk have the same length.
+        drain_interval      Seconds between each collection of samples.
+        buffer_capacity     Maximum number of samples waiting for
+                            `on_samples`.
+
+    Attributes:
+        start_time          Host time at which sampling started, the
+                            origin of sample timestamps.
+        ring_buffer         Buffer between the collector and the consumer.
+    """
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, monsoon_engine):
+    def __init__(self, monsoon_engine, on_samples=None, drain_interval=0.1,
+                 buffer_capacity=2**20):
         super(MonsoonReader, self).__init__()
         self.monsoon_engine = monsoon_engine
+        self.on_samples = on_samples
+        self.drain_interval = drain_interval
+        self.start_time = None
+        self.ring_buffer = SampleRingBuffer(buffer_capacity)
+        self._stopped = Event()
+        self._pending_timestamps = np.empty(0)
+        self._pending_currents = np.empty(0)
+        self._consumer = Thread(target=self._consume_loop)
+        self._consumer.daemon = True
+
+    @property
+    def overflow_count(self):
+        """Number of samples dropped because the consumer fell behind."""
+        return self.ring_buffer.overflow_count
 
     def prepare(self):
         """Prepare monsoon to start measuring."""
@@ -24,9 +65,63 @@ class MonsoonReader(Thread):
 
     def run(self):
         """Start measuring."""
-        self.monsoon_engine.startSampling(triggers.SAMPLECOUNT_INFINITE)
+        if self.on_samples:
+            self._consumer.start()
+        self.start_time = time.time()
+        self.monsoon_engine.periodicStartSampling()
+        try:
+            while not self._stopped.is_set():
+                self.collect()
+        finally:
+            self.monsoon_engine.periodicStopSampling()
+
+    def timestamp(self):
+        """Get the current time in the clock of sample timestamps."""
+        if self.start_time is None:
+            return 0.0
+        return time.time() - self.start_time
+
+    def collect(self):
+        """Move about `drain_interval` seconds of samples into the buffer.
+
+        Each channel is collected at a slightly different moment, so
+        samples without a counterpart are held back until the next call.
+        """
+        samples = self.monsoon_engine.periodicCollectSamples(
+            max(int(self.drain_interval*SAMPLE_HZ), 1)
+        )
+        if not self.on_samples:
+            return
+        timestamps = np.concatenate((
+            self._pending_timestamps,
+            np.asarray(samples[channels.timeStamp], dtype='float')
+        ))
+        currents = np.concatenate((
+            self._pending_currents,
+            np.asarray(samples[channels.MainCurrent], dtype='float')
+        ))
+        count = min(len(timestamps), len(currents))
+        self._pending_timestamps = timestamps[count:]
+        self._pending_currents = currents[count:]
+        if count:
+            self.ring_buffer.write(timestamps[:count], currents[:count])
+
+    def _consume_loop(self):
+        while True:
+            timestamps, currents = self.ring_buffer.read()
+            if len(timestamps):
+                self.on_samples(timestamps, currents)
+            elif self.ring_buffer.closed:
+                return
 
     def stop(self):
-        """Stop measuring."""
-        self.monsoon_engine._SampleEngine__stopTriggerSet = True
+        """Stop measuring.
+
+        Returns once every sample collected has been handed to
+        `on_samples`.
+        """
+        self._stopped.set()
         self.join()
+        if self.on_samples:
+            self.ring_buffer.close()
+            self._consumer.join()
@@ -0,0 +1,181 @@
+"""Recording of raw power meter samples to disk.
+
+Traces are stored as flat binary files of `TRACE_DTYPE` records, which
+can be memory-mapped with NumPy for analysis without loading them into
+memory.
+"""
+
+import os
+
+import numpy as np
+
+from physalia import integrators
+
+TRACE_DTYPE = np.dtype([('timestamp', '<f8'), ('current', '<f8')])
+
+
+def load_trace(path):
+    """Memory-map the samples of a trace file.
+
+    Returns:
+        numpy.ndarray: records with fields `timestamp` and `current`.
+
+    """
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.memmap(path, dtype=TRACE_DTYPE, mode='r')
+
+
+class TraceWriter(object):
+    """Write samples into a preallocated, growable memory-mapped file.
+
+    The file doubles in size whenever it runs out of space, and it is
+    truncated to the actual number of samples once closed.
+
+    Args:
+        path        file where samples are stored.
+        capacity    initial number of samples allocated.
+
+    """
+
+    def __init__(self, path, capacity=2**16):  # noqa: D102,D107
+        self.path = path
+        self.sample_count = 0
+        self._capacity = 0
+        self._records = None
+        with open(self.path, 'wb'):
+            pass
+        self._resize(capacity)
+
+    def _resize(self, capacity):
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+        with open(self.path, 'r+b') as trace_file:
+            trace_file.truncate(capacity * TRACE_DTYPE.itemsize)
+        self._capacity = capacity
+        if capacity:
+            self._records = np.memmap(
+                self.path, dtype=TRACE_DTYPE, mode='r+', shape=(capacity,)
+            )
+
+    def write(self, timestamps, currents):
+        """Append a chunk of samples to the trace."""
+        count = len(timestamps)
+        end = self.sample_count + count
+        if end > self._capacity:
+            capacity = max(self._capacity, 1)
+            while capacity < end:
+                capacity *= 2
+            self._resize(capacity)
+        self._records['timestamp'][self.sample_count:end] = timestamps
+        self._records['current'][self.sample_count:end] = currents
+        self.sample_count = end
+
+    def close(self):
+        """Flush samples and trim the file to its content."""
+        self._resize(self.sample_count)
+
+    def __enter__(self):  # noqa: D105
+        return self
+
+    def __exit__(self, *args):  # noqa: D105
+        self.close()
+
+
+class PowerTrace(object):
+    """Recorded trace with fast energy queries over time windows.
+
+    The cumulative energy of the trace is computed once and cached next
+    to the trace file, so the energy of any window takes two binary
+    searches and a subtraction.
+
+    Args:
+        path    trace file recorded with `TraceWriter`.
+
+    """
+
+    def __init__(self, path):  # noqa: D102,D107
+        self.path = path
+        self.samples = load_trace(path)
+        self.timestamps = self.samples['timestamp']
+        self.currents = self.samples['current']
+        self._cumulative_energy = None
+
+    @property
+    def index_path(self):
+        """Path of the cached cumulative energy."""
+        return self.path + ".cumsum.npy"
+
+    @property
+    def cumulative_energy(self):
+        """Energy consumed from the beginning of the trace to each sample."""
+        if self._cumulative_energy is None:
+            self._cumulative_energy = self._load_index()
+        return self._cumulative_energy
+
+    def build_index(self):
+        """Compute the cumulative energy ahead of queries.
+
+        The result is cached next to the trace, so later instances of
+        the same trace do not have to integrate it again.
+        """
+        self._cumulative_energy = self._load_index()
+
+    def _load_index(self):
+        index_path = self.index_path
+        if (os.path.isfile(index_path) and
+                os.path.getmtime(index_path) >= os.path.getmtime(self.path)):
+            cumulative = np.load(index_path, mmap_mode='r')
+            if len(cumulative) == len(self.samples):
+                return cumulative
+        cumulative = integrators.cumulative_energy(
+            self.timestamps, self.currents
+        )
+        try:
+            np.save(index_path, cumulative)
+        except (IOError, OSError):
+            pass
+        return cumulative
+
+    @property
+    def energy_consumption(self):
+        """Energy consumption of the whole trace."""
+        if len(self.samples) == 0:
+            return 0.0
+        return float(self.cumulative_energy[-1])
+
+    @property
+    def duration(self):
+        """Duration of the trace."""
+        if len(self.samples) == 0:
+            return 0.0
+        return float(self.timestamps[-1] - self.timestamps[0])
+
+    def energy_between_many(self, starts, ends):
+        """Energy consumed in each of the given time windows.
+
+        Windows are bounded by the first sample at or after the start and
+        the last sample at or before the end.
+
+        Args:
+            starts (array-like): beginning of each window.
+            ends (array-like): end of each window.
+
+        Returns:
+            numpy.ndarray: energy consumption of each window.
+
+        """
+        if len(self.samples) == 0:
+            return np.zeros(len(starts))
+        first = np.searchsorted(self.timestamps, starts, side='left')
+        last = np.searchsorted(self.timestamps, ends, side='right') - 1
+        last_sample = len(self.samples) - 1
+        first = np.clip(first, 0, last_sample)
+        last = np.clip(last, first, last_sample)
+        cumulative = self.cumulative_energy
+        return cumulative[last] - cumulative[first]
+
+    def energy_between(self, start, end):
+        """Energy consumed between `start` and `end`."""
+        return float(self.energy_between_many([start], [end])[0])
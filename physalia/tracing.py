@@ -0,0 +1,222 @@
+"""Tracing of the time spent by Physalia itself.
+
+Spans record how long each step of a campaign takes (e.g., adb calls,
+apk installs, power meter setup), and are exported in the Chrome trace
+event format, to be viewed in `chrome://tracing` or Perfetto.
+
+Tracing is disabled by default. While disabled, `span` returns a shared
+no-op context manager and `traced` functions are called directly.
+
+Example:
+    with tracing.trace("campaign.json"):
+        use_case.profile(power_meter=EmulatedPowerMeter(), count=3)
+
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+_tracer = None
+
+
+class _NullSpan(object):
+    """Span that records nothing."""
+
+    def __enter__(self):  # noqa: D105
+        return self
+
+    def __exit__(self, *exc_info):  # noqa: D105
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    """Span recording a complete event in a tracer."""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):  # noqa: D107
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):  # noqa: D105
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):  # noqa: D105
+        end = self.tracer.now()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add_event({
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.start,
+            'dur': end - self.start,
+            'args': self.args,
+        })
+        return False
+
+
+class Tracer(object):
+    """Collector of trace events.
+
+    Events are timestamped in microseconds since the tracer was created,
+    with a monotonic clock.
+    """
+
+    def __init__(self):  # noqa: D107
+        self.events = []
+        self._origin = time.perf_counter()
+        self._threads = {}
+
+    def now(self):
+        """Get the current time in microseconds."""
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def add_event(self, event):
+        """Record an event of the current thread."""
+        thread = threading.current_thread()
+        event['pid'] = os.getpid()
+        event['tid'] = thread.ident
+        self._threads[thread.ident] = thread.name
+        self.events.append(event)
+
+    def span(self, name, category="physalia", **args):
+        """Get a context manager recording a span."""
+        return _Span(self, name, category, args)
+
+    def instant(self, name, category="physalia", **args):
+        """Record an instant event."""
+        self.add_event({
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 't',
+            'ts': self.now(),
+            'args': args,
+        })
+
+    def to_chrome_trace(self):
+        """Get the events in the Chrome trace event format."""
+        metadata = [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': ident,
+                'args': {'name': name},
+            }
+            for ident, name in sorted(self._threads.items())
+        ]
+        return {
+            'traceEvents': metadata + list(self.events),
+            'displayTimeUnit': 'ms',
+        }
+
+    def save(self, filename):
+        """Store the events in a Chrome trace JSON file."""
+        with open(filename, 'wt') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+
+def enable():
+    """Start tracing with a new tracer.
+
+    Returns:
+        Tracer: collector of the events.
+
+    """
+    global _tracer  # pylint: disable=global-statement
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    """Stop tracing.
+
+    Returns:
+        Tracer: collector of the events traced so far, or None.
+
+    """
+    global _tracer  # pylint: disable=global-statement
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_enabled():
+    """Check whether tracing is enabled."""
+    return _tracer is not None
+
+
+def span(name, category="physalia", **args):
+    """Get a context manager that traces a span named `name`."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, **args)
+
+
+def instant(name, category="physalia", **args):
+    """Trace an instant event named `name`."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.instant(name, category, **args)
+
+
+def traced(name=None, category="physalia"):
+    """Decorate a function to trace each call as a span.
+
+    Args:
+        name: name of the span (default: qualified name of the function).
+        category: category of the span.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                tracer = _tracer
+                if tracer is None:
+                    return await func(*args, **kwargs)
+                with tracer.span(span_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def trace(filename=None):
+    """Trace the enclosed block and export it to `filename`, if given.
+
+    Yields:
+        Tracer: collector of the events.
+
+    """
+    tracer = enable()
+    try:
+        yield tracer
+    finally:
+        disable()
+        if filename:
+            tracer.save(filename)
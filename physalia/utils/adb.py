@@ -0,0 +1,369 @@
+"""Persistent `adb shell` sessions to run commands in Android devices.
+
+Spawning `adb` for every command costs a host process and a new
+connection to the device. Instead, commands go through a long-lived
+`adb shell` per device, and fall back to a one-shot `adb shell` if the
+session cannot be used.
+
+Devices are discovered with `adb track-devices`, which notifies every
+change in the state of the devices connected to adb.
+"""
+
+import asyncio
+import atexit
+import queue
+import subprocess
+import threading
+import time
+import uuid
+
+from physalia import tracing
+
+
+def adb_command(serialno=None):
+    """Get the `adb` command line prefix for a device."""
+    if serialno:
+        return "adb -s {}".format(serialno)
+    return "adb"
+
+
+class AdbSessionError(IOError):
+    """Raise when a shell session is no longer usable.
+
+    Attributes:
+        command_sent    Whether the command had been sent when the session
+                        failed, in which case it may have run.
+    """
+
+    command_sent = False
+
+
+class ShellSession(object):
+    """Long-lived shell that runs one command at a time.
+
+    The exit status of each command is retrieved with a unique marker
+    printed after its output. Commands run in a subshell with no input,
+    so they can neither exit the session nor consume the next commands.
+    The output is read by a thread of the session, so that waiting for
+    it can time out.
+
+    Args:
+        args    command line of the shell (default: `adb shell`).
+
+    """
+
+    def __init__(self, args):  # noqa: D107
+        self.args = args
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        self._lines = queue.Queue()
+        threading.Thread(
+            target=self._read_lines,
+            name="adb-shell-reader",
+            daemon=True
+        ).start()
+
+    def _read_lines(self):
+        for line in self._process.stdout:
+            self._lines.put(line)
+        # end of output
+        self._lines.put(None)
+
+    @property
+    def alive(self):
+        """Whether the shell process is running."""
+        return self._process.poll() is None
+
+    def run(self, command, timeout=None):
+        """Run a command in the shell.
+
+        Args:
+            command: command to run.
+            timeout: seconds to wait for the command to finish, or None
+                to wait indefinitely. Once expired, the session is closed.
+
+        Returns:
+            tuple: exit status and output of the command.
+
+        Raises:
+            subprocess.TimeoutExpired: if the command did not finish in
+                time.
+            AdbSessionError: if the session failed.
+
+        """
+        marker = uuid.uuid4().hex
+        with self._lock:
+            try:
+                self._process.stdin.write(
+                    "( {} ) </dev/null; printf '\\n{}:%s\\n' $?\n".format(
+                        command, marker
+                    )
+                )
+                self._process.stdin.flush()
+            except (IOError, OSError, ValueError) as error:
+                raise AdbSessionError(str(error)) from error
+            lines = self._read_output(command, marker, timeout)
+        returncode = int(lines.pop().partition(":")[2])
+        # drop the newline printed before the marker
+        output = "\n".join(lines[:-1])
+        if lines[:-1]:
+            output += "\n"
+        output += lines[-1] if lines else ""
+        return returncode, output
+
+    def _read_output(self, command, marker, timeout):
+        """Read the lines of output up to the marker line, included."""
+        deadline = None if timeout is None else time.time() + timeout
+        lines = []
+        while True:
+            try:
+                line = self._lines.get(
+                    timeout=None if deadline is None
+                    else max(deadline - time.time(), 0)
+                )
+            except queue.Empty as error:
+                self.close()
+                raise subprocess.TimeoutExpired(command, timeout) from error
+            if line is None:
+                self._lines.put(None)
+                error = AdbSessionError(
+                    "Shell session closed: {}".format(" ".join(self.args))
+                )
+                error.command_sent = True
+                raise error
+            line = line.rstrip('\r\n')
+            lines.append(line)
+            if line.startswith(marker + ":"):
+                return lines
+
+    def close(self):
+        """Terminate the shell."""
+        if self.alive:
+            self._process.terminate()
+        self._process.wait()
+        self._process.stdin.close()
+
+
+# seconds to wait for a command of `shell` by default
+SHELL_TIMEOUT = 300
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(serialno):
+    with _sessions_lock:
+        session = _sessions.get(serialno)
+        if session is None or not session.alive:
+            session = ShellSession(adb_command(serialno).split() + ["shell"])
+            _sessions[serialno] = session
+        return session
+
+
+def close_sessions(serialno=None, everything=False):
+    """Close the shell session of a device, or of every device."""
+    with _sessions_lock:
+        if everything:
+            sessions = list(_sessions.values())
+            _sessions.clear()
+        else:
+            sessions = [_sessions.pop(serialno)] \
+                if serialno in _sessions else []
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_sessions, everything=True)
+
+
+def shell(command, serialno=None, timeout=SHELL_TIMEOUT):
+    """Run a shell command in the device, like `check_output`.
+
+    The command runs through the persistent session of the device. If
+    the session could not be used to send the command, it runs with a
+    one-shot `adb shell`. Commands that may have run are not run again.
+
+    Args:
+        command: command line, as run by the shell of the device.
+        serialno: serial number of the device.
+        timeout: seconds to wait for the command, or None.
+
+    Returns:
+        str: output of the command.
+
+    Raises:
+        subprocess.CalledProcessError: if the command fails.
+        subprocess.TimeoutExpired: if the command did not finish in time.
+        AdbSessionError: if the session failed after the command was sent.
+
+    """
+    with tracing.span("adb shell", "adb", command=command):
+        try:
+            returncode, output = _get_session(serialno).run(command, timeout)
+        except subprocess.TimeoutExpired:
+            close_sessions(serialno)
+            raise
+        except (AdbSessionError, OSError) as error:
+            close_sessions(serialno)
+            if getattr(error, 'command_sent', False):
+                raise
+            try:
+                return subprocess.check_output(
+                    adb_command(serialno).split() + ["shell", command],
+                    universal_newlines=True,
+                    timeout=timeout
+                )
+            except OSError as adb_error:
+                # adb is not available, like a shell's "command not found"
+                raise subprocess.CalledProcessError(
+                    127, command, ""
+                ) from adb_error
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, output)
+    return output
+
+
+async def ashell(command, serialno=None):
+    """Run a shell command in the device from a coroutine.
+
+    The command runs with a one-shot `adb shell` spawned as an asyncio
+    subprocess, so that no thread is held while it runs.
+
+    Returns:
+        str: output of the command.
+
+    Raises:
+        subprocess.CalledProcessError: if the command fails.
+
+    """
+    with tracing.span("adb shell", "adb", command=command):
+        process = await asyncio.create_subprocess_exec(
+            *(adb_command(serialno).split() + ["shell", command]),
+            stdout=subprocess.PIPE
+        )
+        output, _ = await process.communicate()
+    output = output.decode('utf-8', 'replace')
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command,
+                                            output)
+    return output
+
+
+def read_device_states(stream):
+    """Parse the messages of `adb track-devices`.
+
+    Each message is the list of devices, prefixed by its length as four
+    hexadecimal digits.
+
+    Args:
+        stream: binary file with the output of `adb track-devices`.
+
+    Yields:
+        dict: state of each device (e.g., "device", "offline") by serial
+        number.
+
+    """
+    while True:
+        length = stream.read(4)
+        if len(length) < 4:
+            return
+        payload = stream.read(int(length, 16)).decode('utf-8')
+        yield dict(
+            line.split('\t', 1)
+            for line in payload.splitlines()
+            if '\t' in line
+        )
+
+
+class DeviceWatcher(threading.Thread):
+    """`Thread` that keeps track of the state of the devices.
+
+    Args:
+        args    command line of the tracker (default: `adb track-devices`).
+
+    Attributes:
+        states  State of each device by serial number.
+        closed  Whether the tracker stopped.
+
+    """
+
+    def __init__(self, args=None):  # noqa: D107
+        super(DeviceWatcher, self).__init__()
+        self.daemon = True
+        self.args = args or ["adb", "track-devices"]
+        self.states = {}
+        self.closed = False
+        self._changed = threading.Condition()
+        try:
+            self._process = subprocess.Popen(
+                self.args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            self._process = None
+            self.closed = True
+
+    def run(self):
+        """Follow the changes of the devices."""
+        if self._process is None:
+            return
+        for states in read_device_states(self._process.stdout):
+            with self._changed:
+                self.states = states
+                self._changed.notify_all()
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def wait_for(self, serialno=None, timeout=None):
+        """Wait until a device is online.
+
+        Args:
+            serialno: serial number of the device; any device if None.
+            timeout: seconds to wait; forever if None.
+
+        Returns:
+            str: serial number of the device, or None on timeout.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while True:
+                for device, state in sorted(self.states.items()):
+                    if state == "device" and serialno in (None, device):
+                        return device
+                if self.closed:
+                    return None
+                if deadline is None:
+                    self._changed.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._changed.wait(remaining)
+
+    def close(self):
+        """Stop tracking devices."""
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+        if self.is_alive():
+            self.join()
+        if self._process is not None:
+            self._process.stdout.close()
+
+    def __enter__(self):  # noqa: D105
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):  # noqa: D105
+        self.close()
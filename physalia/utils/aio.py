@@ -0,0 +1,101 @@
+"""Helpers to combine blocking code with asyncio."""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_in_executor(func, *args, **kwargs):
+    """Run a blocking function in the default executor of the event loop.
+
+    Returns:
+        Awaitable with the result of the function.
+
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def run_in(executor, func, *args, **kwargs):
+    """Run a blocking function in `executor`.
+
+    Returns:
+        Awaitable with the result of the function.
+
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor,
+                                functools.partial(func, *args, **kwargs))
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def dedicated_executor(key):
+    """Get the single-thread executor dedicated to `key` (e.g., a device).
+
+    Blocking work of each key runs in its own thread, so it never waits
+    behind the work of other keys in a shared executor.
+    """
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor = _executors[key] = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="physalia-{}".format(key or "default")
+            )
+        return executor
+
+
+def to_async(func):
+    """Get a coroutine function that runs `func` in the default executor."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_executor(func, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = "a" + func.__name__
+    return wrapper
+
+
+async def call(func, *args, **kwargs):
+    """Call a function that may be a coroutine function.
+
+    Blocking functions run in the default executor.
+    """
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await run_in_executor(func, *args, **kwargs)
+
+
+def call_sync(func, *args, **kwargs):
+    """Call a function that may be a coroutine function from blocking code."""
+    if asyncio.iscoroutinefunction(func):
+        return run_sync(func(*args, **kwargs))
+    return func(*args, **kwargs)
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from blocking code.
+
+    If an event loop is already running in this thread (e.g., in
+    Jupyter), the coroutine runs in a loop of its own thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = asyncio.run(coroutine)
+        except BaseException as error:  # pylint: disable=broad-except
+            outcome['error'] = error
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
@@ -1,187 +1,430 @@
-"""Module with util functions to control Android devices."""
+"""Module with util functions to control Android devices.
+
+Functions accept an optional `serialno` to select the device when more
+than one is connected. Without it, `adb` uses its default device.
+"""
 
 import subprocess
 import re
+import threading
+import time
+from collections import namedtuple
 
 from whichcraft import which
 import click
 
+from physalia.exceptions import DeviceNotFound
+from physalia.tracing import traced
+from physalia.utils import adb
+from physalia.utils.adb import adb_command
+from physalia.utils.aio import to_async
+from physalia.utils.apk import cached_file_digest, read_manifest
+
+DeviceInfo = namedtuple('DeviceInfo', [
+    'model',
+    'android_version',
+    'build',
+    'resolution',
+    'battery_capacity',
+])
+DeviceInfo.__doc__ = """Static details of an Android device.
+
+`resolution` is a (width, height) tuple in pixels and `battery_capacity`
+the design capacity in mAh; each is None when the device does not tell.
+"""
+
+_device_info = {}
+_device_info_lock = threading.Lock()
+
+# (serialno, app_pkg) -> (digest of the apk, fingerprint of the device file)
+_installed_apks = {}
+_installed_apks_lock = threading.Lock()
+
+@traced(category='android')
 def set_charging_enabled(enabled, serialno=None):
     """Enable or disable charging the device."""
-    if serialno:
-        command = (
-            "adb shell -s {serialno} dumpsys battery set ac {enabled};"
-            "adb shell -s {serialno} dumpsys battery set usb {enabled};"
-        ).format(serialno=serialno, enabled=int(enabled))
-    else:
-        command = (
-            "adb shell dumpsys battery set ac {enabled};"
-            "adb shell dumpsys battery set usb {enabled}"
-        ).format(enabled=int(enabled))
+    adb.shell("dumpsys battery set ac {}".format(int(enabled)), serialno)
+    adb.shell("dumpsys battery set usb {}".format(int(enabled)), serialno)
 
-    subprocess.check_output(
-        command,
-        shell=True
-    )
-
-def prevent_device_from_sleep(enabled):
+@traced(category='android')
+def prevent_device_from_sleep(enabled, serialno=None):
     """Prevent device from sleep while usb connected."""
-    comand = "adb shell svc power stayon {}".format(
-        {True: 'usb', False: 'false'}[enabled]
-    )
-    subprocess.check_output(
-        comand,
-        shell=True
+    adb.shell(
+        "svc power stayon {}".format({True: 'usb', False: 'false'}[enabled]),
+        serialno
     )
 
-def is_screen_on():
+@traced(category='android')
+def is_screen_on(serialno=None):
     """Check whether the screen is on."""
     try:
-        subprocess.check_output(
-            "adb shell dumpsys input_method | grep mInteractive=true",
-            shell=True
-        )
+        adb.shell("dumpsys input_method | grep mInteractive=true", serialno)
         return True
     except subprocess.CalledProcessError:
         pass
     try:
-        subprocess.check_output(
-            'adb shell dumpsys power | grep "Display Power: state=ON"',
-            shell=True
-        )
+        adb.shell('dumpsys power | grep "Display Power: state=ON"', serialno)
         return True
     except subprocess.CalledProcessError:
         pass
     return False
 
-def is_locked():
+@traced(category='android')
+def is_locked(serialno=None):
     """Check whether device is locked."""
     try:
-        output = subprocess.check_output(
-            "adb shell service call trust 7",
-            shell=True,
-            universal_newlines=True
-        )
+        output = adb.shell("service call trust 7", serialno)
         match = re.search(r"Parcel\(00000000 00000001", output)
         return match is not None
     except subprocess.CalledProcessError as e:
         click.secho('Warning: {}'.format(e), fg='yellow')
         return True
 
-def wakeup():
+@traced(category='android')
+def wakeup(serialno=None):
     """Wake up device."""
-    if not is_screen_on():
-        subprocess.check_output(
-            "adb shell input keyevent 26",
-            shell=True
-        )
+    if not is_screen_on(serialno):
+        adb.shell("input keyevent 26", serialno)
 
-def unlock(pincode):
+@traced(category='android')
+def unlock(pincode, serialno=None):
     """Unlock device with the given PIN."""
-    wakeup()
-    comand = (
-        "adb shell input keyevent 82"
-        " && adb shell input text {}"
-        " && adb shell input keyevent 66"
-    ).format(pincode)
-    subprocess.check_output(
-        comand,
-        shell=True
+    wakeup(serialno)
+    adb.shell(
+        "input keyevent 82"
+        " && input text {}"
+        " && input keyevent 66".format(pincode),
+        serialno
     )
 
-def install_apk(apk):
+@traced(category='android')
+def install_apk(apk, serialno=None, app_pkg=None):
     """Install apk.
     Accepts Downgrade, grants all requestd permissions,
     and reinstalls if app already exists.
+
+    If `app_pkg` is given, the installed apk is remembered by
+    `is_apk_installed`.
     """
-    subprocess.check_output(["adb", "install", "-d", "-g", "-r", apk])
+    subprocess.check_output(
+        adb_command(serialno).split() + ["install", "-d", "-g", "-r", apk]
+    )
+    if app_pkg:
+        with _installed_apks_lock:
+            _installed_apks.pop((serialno, app_pkg), None)
+        fingerprint = _get_installed_fingerprint(app_pkg, serialno)
+        if fingerprint:
+            digest = cached_file_digest(apk)
+            with _installed_apks_lock:
+                _installed_apks[(serialno, app_pkg)] = (digest, fingerprint)
+
+@traced(category='android')
+def uninstall_app(app_pkg, serialno=None):
+    """Uninstall an app from the device."""
+    with _installed_apks_lock:
+        _installed_apks.pop((serialno, app_pkg), None)
+    subprocess.check_output(
+        adb_command(serialno).split() + ["uninstall", app_pkg]
+    )
+
+def _get_installed_path(app_pkg, serialno):
+    try:
+        paths = adb.shell("pm path {}".format(app_pkg), serialno).split()
+    except subprocess.CalledProcessError:
+        return None
+    if len(paths) != 1 or not paths[0].startswith("package:"):
+        # not installed, or split apks
+        return None
+    return paths[0][len("package:"):]
+
+def _get_installed_fingerprint(app_pkg, serialno):
+    """Get path, size and modification time of the installed apk."""
+    path = _get_installed_path(app_pkg, serialno)
+    if path is None:
+        return None
+    try:
+        return adb.shell("stat -c '%n %s %Y' {}".format(path), serialno).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+@traced(category='android')
+def is_apk_installed(apk, app_pkg, serialno=None):
+    """Check whether the device has exactly this apk installed.
+
+    The content of the installed apk is compared with `apk`, so that
+    both version and signature match. The result is cached until the
+    installed apk or the local file change.
+    """
+    digest = cached_file_digest(apk)
+    fingerprint = _get_installed_fingerprint(app_pkg, serialno)
+    with _installed_apks_lock:
+        if fingerprint is None:
+            _installed_apks.pop((serialno, app_pkg), None)
+            return False
+        if _installed_apks.get((serialno, app_pkg)) == (digest, fingerprint):
+            return True
+    try:
+        output = adb.shell(
+            "sha256sum {}".format(fingerprint.split()[0]),
+            serialno
+        )
+    except subprocess.CalledProcessError:
+        return False
+    if output.split()[:1] != [digest]:
+        return False
+    with _installed_apks_lock:
+        _installed_apks[(serialno, app_pkg)] = (digest, fingerprint)
+    return True
+
+@traced(category='android')
+def clear_app_data(app_pkg, serialno=None):
+    """Reset an app to a fresh state, keeping it installed.
+
+    Runtime permissions are granted again, as done by `install_apk`.
+    """
+    adb.shell("pm clear {}".format(app_pkg), serialno)
+    output = adb.shell("dumpsys package {}".format(app_pkg), serialno)
+    grant = _grant_permissions_command(app_pkg, output)
+    if grant:
+        adb.shell(grant, serialno)
+
+def _grant_permissions_command(app_pkg, dumpsys_output):
+    """Get the command granting the permissions an app was denied."""
+    permissions = re.findall(
+        r"^\s+(android\.permission\.\w+): granted=false",
+        dumpsys_output,
+        re.MULTILINE
+    )
+    if not permissions:
+        return None
+    return (
+        "for permission in {}; do"
+        " pm grant {} $permission 2>/dev/null; done; true".format(
+            " ".join(sorted(set(permissions))), app_pkg
+        )
+    )
+
+@traced(category='android')
+def open_app(app_pkg, serialno=None):
+    """Open an app in the device."""
+    adb.shell("monkey -p {} --pct-syskeys 0 1".format(app_pkg), serialno)
+
+@traced(category='android')
+def kill_app(app_pkg, serialno=None):
+    """Force an app of the device to stop."""
+    adb.shell("am force-stop {}".format(app_pkg), serialno)
 
 def check_adb():
     """Check whether adb is available."""
     return which("adb") is not None
 
-def is_android_device_available():
-    """Check whether there is at least an available android devices."""
-    if not check_adb():
-        return False
+@traced(category='android')
+def get_devices():
+    """Get the serial numbers of the devices connected through adb."""
     result = subprocess.check_output(
         "adb devices",
         shell=True,
         universal_newlines=True
     )
-    devices = result.partition('\n')[2].replace('\n', '').split('\tdevice')
-    devices = [device for device in devices if len(device) > 2]
-    if not devices:
+    return [
+        line.split('\t')[0]
+        for line in result.splitlines()[1:]
+        if line.endswith('\tdevice')
+    ]
+
+@traced(category='android')
+def is_android_device_available(serialno=None):
+    """Check whether there is at least an available android devices.
+
+    If `serialno` is given, check whether that device is available.
+    """
+    if not check_adb():
+        return False
+    devices = get_devices()
+    if not devices or serialno and serialno not in devices:
         return False
     try:
-        result = subprocess.check_output(
-            "adb shell getprop sys.boot_completed",
-            shell=True,
-            universal_newlines=True).strip()
+        result = adb.shell("getprop sys.boot_completed", serialno).strip()
         return result == "1"
     except subprocess.CalledProcessError:
         return False
 
+@traced(category='android')
+def wait_for_device(serialno=None, timeout=180):
+    """Wait until a device is online and has finished booting.
+
+    Args:
+        serialno: serial number of the device; any device if None.
+        timeout: seconds to wait.
+
+    Returns:
+        str: serial number of the device.
+
+    Raises:
+        DeviceNotFound: if the device is not ready within `timeout`.
+    """
+    deadline = time.time() + timeout
+    with adb.DeviceWatcher() as watcher:
+        device = watcher.wait_for(serialno, timeout)
+    if device is None:
+        raise DeviceNotFound("Could not find device.")
+    try:
+        subprocess.check_output(
+            adb_command(device).split() + [
+                "shell",
+                'while [ "$(getprop sys.boot_completed)" != 1 ];'
+                ' do sleep 0.1; done'
+            ],
+            timeout=max(deadline - time.time(), 0)
+        )
+    except (subprocess.TimeoutExpired,
+            subprocess.CalledProcessError) as error:
+        raise DeviceNotFound(
+            "Device {} did not boot.".format(device)
+        ) from error
+    return device
+
 def get_device_model(serialno=None):
     """Get the currently connected device model."""
-    if serialno:
-        command = ("adb shell -s {} "
-                   "getprop ro.product.model").format(serialno)
-    else:
-        command = "adb shell getprop ro.product.model"
     try:
-        return subprocess.check_output(
-            command,
-            shell=True,
-            universal_newlines=True
-        ).strip()
+        return adb.shell("getprop ro.product.model", serialno).strip()
     except subprocess.CalledProcessError:
         return "N/A"
 
-def connect_adb_through_wifi():
-    """Configure `adb` through a wifi connection."""
-    net_output = subprocess.check_output(
-        "adb shell ip -f inet addr show wlan0",
-        shell=True,
-        universal_newlines=True
+def _read_device_info(serialno):
+    def getprop(name):
+        try:
+            return adb.shell("getprop {}".format(name), serialno).strip()
+        except subprocess.CalledProcessError:
+            return None
+    model = getprop("ro.product.model")
+    if model is None:
+        # the device is not reachable, the other lookups would fail too
+        return DeviceInfo("N/A", None, None, None, None)
+    resolution = None
+    try:
+        sizes = re.findall(r"(\d+)x(\d+)", adb.shell("wm size", serialno))
+        if sizes:
+            # an override size comes after the physical size
+            resolution = tuple(int(value) for value in sizes[-1])
+    except subprocess.CalledProcessError:
+        pass
+    battery_capacity = None
+    try:
+        battery_capacity = int(adb.shell(
+            "cat /sys/class/power_supply/battery/charge_full_design",
+            serialno
+        ))//1000
+    except (subprocess.CalledProcessError, ValueError):
+        pass
+    return DeviceInfo(
+        model or "N/A",
+        getprop("ro.build.version.release"),
+        getprop("ro.build.display.id"),
+        resolution,
+        battery_capacity,
     )
+
+@traced(category='android')
+def get_device_info(serialno=None, refresh=False):
+    """Get the details of a device.
+
+    Details are read once per device and cached until the device
+    reconnects, or until `refresh` is set. A device that could not be
+    reached is cached as well, with model "N/A".
+
+    Returns:
+        DeviceInfo: details of the device.
+    """
+    with _device_info_lock:
+        info = _device_info.get(serialno)
+    if info is None or refresh:
+        info = _read_device_info(serialno)
+        with _device_info_lock:
+            _device_info[serialno] = info
+    return info
+
+def invalidate_device_info(serialno=None):
+    """Forget the cached details of a device."""
+    with _device_info_lock:
+        _device_info.pop(serialno, None)
+
+@traced(category='android')
+def connect_adb_through_wifi(serialno=None):
+    """Configure `adb` through a wifi connection.
+
+    Returns:
+        str: serial number of the device through wifi.
+    """
+    net_output = adb.shell("ip -f inet addr show wlan0", serialno)
     ip_address = re.search(r"inet \d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", net_output).group()[5:]
+    # adbd restarts, so the shell session of the device is gone
+    adb.close_sessions(serialno)
+    invalidate_device_info(serialno)
     subprocess.check_output(
-        "adb tcpip 5555",
+        "{} tcpip 5555".format(adb_command(serialno)),
         shell=True
     )
     subprocess.check_output(
         "adb connect {}".format(ip_address),
         shell=True
     )
+    return "{}:5555".format(ip_address)
 
-def reconnect_adb_through_usb():
+@traced(category='android')
+def reconnect_adb_through_usb(serialno=None):
     """Connect adb back to USB while in wifi."""
+    adb.close_sessions(serialno)
+    invalidate_device_info(serialno)
     try:
         subprocess.check_output(
-            "adb reconnect",
+            "{} reconnect".format(adb_command(serialno)),
             shell=True
         )
     except subprocess.CalledProcessError:
         pass
 
+@traced(category='android')
 def get_package_from_apk(apk_path):
-    aapt = "$ANDROID_HOME/build-tools/27.0.0/aapt"
-    result = subprocess.check_output(
-        aapt + " dump badging {} | awk '/package/{{gsub(\"name=|'\"'\"'\",\"\");  print $2}}'".format(apk_path),
-        shell=True
-    )
-    return str(result.strip(), 'utf-8')
+    """Get the package name declared in an apk."""
+    return read_manifest(apk_path).package
 
-def get_instrumentation_for_app(app_pkg, test_pkg=""):
+@traced(category='android')
+def get_instrumentation_for_app(app_pkg, test_pkg="", serialno=None):
     pattern = re.compile("instrumentation:(.*) ")
-    output = subprocess.check_output(
-        "adb shell pm list instrumentation | grep -i {}".format(app_pkg),
-        shell=True
+    output = adb.shell(
+        "pm list instrumentation | grep -i {}".format(app_pkg),
+        serialno
     )
-    if type(output) is bytes:
-        output = output.decode('utf-8')
     search = pattern.search(output)
     if search:
         return search.group(1)
-    
+
+
+# Asynchronous versions of the helpers, running in the default executor
+# of the event loop. Commands of a device still run one at a time.
+@traced(category='android')
+async def aclear_app_data(app_pkg, serialno=None):
+    """Reset an app to a fresh state, from a coroutine."""
+    await adb.ashell("pm clear {}".format(app_pkg), serialno)
+    output = await adb.ashell("dumpsys package {}".format(app_pkg), serialno)
+    grant = _grant_permissions_command(app_pkg, output)
+    if grant:
+        await adb.ashell(grant, serialno)
+
+@traced(category='android')
+async def aopen_app(app_pkg, serialno=None):
+    """Open an app in the device, from a coroutine."""
+    await adb.ashell("monkey -p {} --pct-syskeys 0 1".format(app_pkg), serialno)
+
+@traced(category='android')
+async def akill_app(app_pkg, serialno=None):
+    """Force an app of the device to stop, from a coroutine."""
+    await adb.ashell("am force-stop {}".format(app_pkg), serialno)
+
+# Helpers that keep caches or install files run in the default executor.
+ainstall_apk = to_async(install_apk)
+auninstall_app = to_async(uninstall_app)
+ais_apk_installed = to_async(is_apk_installed)
+aget_device_info = to_async(get_device_info)
+await_for_device = to_async(wait_for_device)
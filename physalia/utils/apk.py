@@ -0,0 +1,249 @@
+"""Module with util functions to inspect Android apk files.
+
+The manifest of an apk is stored in Android's binary XML format (AXML),
+which is decoded here without resorting to `aapt`.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import zipfile
+from collections import namedtuple
+
+ApkManifest = namedtuple('ApkManifest', [
+    'package',
+    'version_name',
+    'version_code',
+    'instrumentations',
+])
+ApkManifest.__doc__ = """Details declared in the manifest of an apk.
+
+`instrumentations` is a list of (name, target package) of each
+instrumentation of the apk.
+"""
+
+_RES_STRING_POOL_TYPE = 0x0001
+_RES_XML_TYPE = 0x0003
+_RES_XML_START_ELEMENT_TYPE = 0x0102
+_RES_XML_RESOURCE_MAP_TYPE = 0x0180
+_UTF8_FLAG = 0x100
+_NO_INDEX = 0xffffffff
+
+_TYPE_REFERENCE = 0x01
+_TYPE_STRING = 0x03
+_TYPE_INT_DEC = 0x10
+_TYPE_INT_HEX = 0x11
+_TYPE_INT_BOOLEAN = 0x12
+
+# ids of android attributes, used when their names were stripped
+_ATTRIBUTE_IDS = {
+    0x01010003: 'name',
+    0x01010021: 'targetPackage',
+    0x0101021b: 'versionCode',
+    0x0101021c: 'versionName',
+}
+
+
+class ManifestError(ValueError):
+    """Raise when the manifest of an apk cannot be decoded."""
+
+    pass
+
+
+def file_digest(path, chunk_size=2**20):
+    """Get the SHA-256 digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as apk_file:
+        for chunk in iter(lambda: apk_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _decode_length(data, offset, utf8):
+    if utf8:
+        length = data[offset]
+        if length & 0x80:
+            return ((length & 0x7f) << 8) | data[offset + 1], offset + 2
+        return length, offset + 1
+    length, = struct.unpack_from('<H', data, offset)
+    if length & 0x8000:
+        low, = struct.unpack_from('<H', data, offset + 2)
+        return ((length & 0x7fff) << 16) | low, offset + 4
+    return length, offset + 2
+
+
+def _read_string_pool(data, offset):
+    string_count, _, flags, strings_start = struct.unpack_from(
+        '<IIII', data, offset + 8
+    )
+    utf8 = bool(flags & _UTF8_FLAG)
+    offsets = struct.unpack_from(
+        '<{}I'.format(string_count), data, offset + 28
+    )
+    strings = []
+    for string_offset in offsets:
+        position = offset + strings_start + string_offset
+        if utf8:
+            # length in characters, then in bytes
+            _, position = _decode_length(data, position, utf8)
+            length, position = _decode_length(data, position, utf8)
+            strings.append(
+                data[position:position + length].decode('utf-8', 'replace')
+            )
+        else:
+            length, position = _decode_length(data, position, utf8)
+            strings.append(
+                data[position:position + 2*length].decode('utf-16-le',
+                                                          'replace')
+            )
+    return strings
+
+
+def _decode_value(strings, raw_value, data_type, data):
+    if raw_value != _NO_INDEX:
+        return strings[raw_value]
+    if data_type == _TYPE_STRING:
+        return strings[data]
+    if data_type in (_TYPE_INT_DEC, _TYPE_INT_HEX):
+        return data
+    if data_type == _TYPE_INT_BOOLEAN:
+        return data != 0
+    if data_type == _TYPE_REFERENCE:
+        return "@0x{:08x}".format(data)
+    return data
+
+
+def _read_start_element(data, extension, strings, resource_ids):
+    _, name, attribute_start, attribute_size, attribute_count = (
+        struct.unpack_from('<IIHHH', data, extension)
+    )
+    attributes = {}
+    for index in range(attribute_count):
+        (_, attribute_name, raw_value, _, _, data_type,
+         attribute_data) = struct.unpack_from(
+             '<IIIHBBI', data,
+             extension + attribute_start + index*attribute_size)
+        key = strings[attribute_name]
+        if attribute_name < len(resource_ids):
+            key = _ATTRIBUTE_IDS.get(resource_ids[attribute_name], key)
+        attributes[key] = _decode_value(
+            strings, raw_value, data_type, attribute_data
+        )
+    return strings[name], attributes
+
+
+def iter_elements(data):
+    """Decode the elements of a binary XML document.
+
+    Args:
+        data: content of the document.
+
+    Yields:
+        tuple: tag and dict of attributes of each element, in document
+        order. Attribute names have no namespace.
+
+    """
+    data = bytearray(data)
+    if len(data) < 8:
+        raise ManifestError("Document is too short.")
+    chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    if chunk_type != _RES_XML_TYPE:
+        raise ManifestError("Not a binary XML document.")
+    strings = []
+    resource_ids = []
+    offset = header_size
+    end = min(size, len(data))
+    while offset + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from(
+            '<HHI', data, offset
+        )
+        if chunk_size < 8:
+            raise ManifestError("Invalid chunk at {}.".format(offset))
+        if chunk_type == _RES_STRING_POOL_TYPE:
+            strings = _read_string_pool(data, offset)
+        elif chunk_type == _RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from(
+                '<{}I'.format((chunk_size - header_size)//4),
+                data, offset + header_size
+            )
+        elif chunk_type == _RES_XML_START_ELEMENT_TYPE:
+            yield _read_start_element(
+                data, offset + header_size, strings, resource_ids
+            )
+        offset += chunk_size
+
+
+def parse_manifest(data):
+    """Get the details of a binary `AndroidManifest.xml`.
+
+    Returns:
+        ApkManifest: details of the manifest.
+
+    """
+    package = version_name = version_code = None
+    instrumentations = []
+    for tag, attributes in iter_elements(data):
+        if tag == 'manifest':
+            package = attributes.get('package')
+            version_name = attributes.get('versionName')
+            version_code = attributes.get('versionCode')
+        elif tag == 'instrumentation':
+            name = attributes.get('name', '')
+            if name.startswith('.') and package:
+                name = package + name
+            instrumentations.append((name, attributes.get('targetPackage')))
+    if version_name is not None:
+        version_name = str(version_name)
+    return ApkManifest(package, version_name, version_code, instrumentations)
+
+
+_manifests = {}
+_digests = {}
+_manifests_lock = threading.Lock()
+
+
+def cached_file_digest(path):
+    """Get the SHA-256 digest of a file, hashing it only when it changed.
+
+    Digests are remembered while the size and modification time of the
+    file hold.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _manifests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _manifests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def read_manifest(path):
+    """Get the details declared in the manifest of an apk.
+
+    Results are memoised by the content hash of the apk, which is itself
+    remembered while the size and modification time of the file hold.
+
+    Returns:
+        ApkManifest: details of the manifest.
+
+    Raises:
+        ManifestError: if the apk has no valid manifest.
+
+    """
+    digest = cached_file_digest(path)
+    with _manifests_lock:
+        manifest = _manifests.get(digest)
+    if manifest is None:
+        try:
+            with zipfile.ZipFile(path) as apk_file:
+                data = apk_file.read('AndroidManifest.xml')
+            manifest = parse_manifest(data)
+        except (zipfile.BadZipfile, KeyError, struct.error,
+                IndexError) as error:
+            raise ManifestError("{}: {}".format(path, error)) from error
+        with _manifests_lock:
+            _manifests[digest] = manifest
+    return manifest
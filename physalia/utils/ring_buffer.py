@@ -0,0 +1,118 @@
+"""Bounded buffer of power samples shared between threads."""
+
+import threading
+
+import numpy as np
+
+
+class SampleRingBuffer(object):
+    """Preallocated ring buffer of (timestamp, current) samples.
+
+    A producer writes chunks of samples and a consumer drains them. When
+    the buffer is full, the producer waits up to `block_timeout` seconds
+    for the consumer to make room (backpressure); samples that still do
+    not fit are dropped and accounted in the overflow counters.
+
+    Args:
+        capacity        Maximum number of samples held.
+        block_timeout   Seconds a producer waits for free space.
+
+    Attributes:
+        overflow_count  Number of samples dropped because the buffer was
+                        full.
+        overflow_events Number of writes that dropped samples.
+        high_watermark  Maximum number of samples held at once.
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, capacity=2**20, block_timeout=0.5):  # noqa: D107
+        self.capacity = capacity
+        self.block_timeout = block_timeout
+        self.overflow_count = 0
+        self.overflow_events = 0
+        self.high_watermark = 0
+        self._timestamps = np.empty(capacity)
+        self._currents = np.empty(capacity)
+        self._head = 0
+        self._tail = 0
+        self._closed = False
+        self._changed = threading.Condition()
+
+    def __len__(self):
+        """Get the number of samples waiting to be read."""
+        return self._head - self._tail
+
+    def write(self, timestamps, currents):
+        """Append samples, waiting for room if the buffer is full.
+
+        Returns:
+            int: number of samples written.
+
+        """
+        count = len(timestamps)
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.capacity - len(self) >= count or self._closed,
+                timeout=self.block_timeout
+            )
+            written = min(count, self.capacity - len(self))
+            if written < count:
+                self.overflow_count += count - written
+                self.overflow_events += 1
+            offset = 0
+            for start, stop in self._spans(self._head, written):
+                end = offset + stop - start
+                self._timestamps[start:stop] = timestamps[offset:end]
+                self._currents[start:stop] = currents[offset:end]
+                offset = end
+            self._head += written
+            self.high_watermark = max(self.high_watermark, len(self))
+            self._changed.notify_all()
+        return written
+
+    def read(self, timeout=None):
+        """Take all samples available, waiting up to `timeout` for them.
+
+        Returns:
+            tuple: arrays of timestamps and currents; empty when the
+                timeout expires or the buffer is closed and drained.
+
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(self) or self._closed,
+                timeout=timeout
+            )
+            spans = list(self._spans(self._tail, len(self)))
+            timestamps = np.concatenate(
+                [self._timestamps[start:stop] for start, stop in spans] or
+                [np.empty(0)]
+            )
+            currents = np.concatenate(
+                [self._currents[start:stop] for start, stop in spans] or
+                [np.empty(0)]
+            )
+            self._tail = self._head
+            self._changed.notify_all()
+        return timestamps, currents
+
+    @property
+    def closed(self):
+        """Whether no more samples will be written."""
+        return self._closed
+
+    def close(self):
+        """Signal that no more samples will be written."""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def _spans(self, position, count):
+        """Contiguous index ranges of `count` samples from `position`."""
+        start = position % self.capacity
+        first = min(count, self.capacity - start)
+        if first:
+            yield start, start + first
+        if count > first:
+            yield 0, count - first
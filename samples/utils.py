@@ -3,6 +3,7 @@
 import sys
 from com.dtmilano.android.viewclient import ViewClient
 from physalia.energy_profiler import AndroidUseCase
+from physalia.tracing import traced
 
 class AndroidViewClientUseCase(AndroidUseCase):
     """`AndroidUseCase` to use with `AndroidViewClient`."""
@@ -21,6 +22,14 @@ class AndroidViewClientUseCase(AndroidUseCase):
         self.serialno = None
         self.view_client = None
 
+    def for_device(self, serialno):
+        """Get a copy of this use case that runs on device `serialno`."""
+        use_case = super(AndroidViewClientUseCase, self).for_device(serialno)
+        use_case.device = None
+        use_case.view_client = None
+        return use_case
+
+    @traced(category='view_client')
     def start_view_client(self, force=False):
         """Setup `AndroidViewClient`.
 
@@ -34,7 +43,8 @@ class AndroidViewClientUseCase(AndroidUseCase):
             sys.argv = original_argv[:1]
             kwargs1 = {'ignoreversioncheck': False,
                        'verbose': False,
-                       'ignoresecuredevice': False}
+                       'ignoresecuredevice': False,
+                       'serialno': self.serialno}
             device, serialno = ViewClient.connectToDeviceOrExit(**kwargs1)
             kwargs2 = {'forceviewserveruse': False,
                        'useuiautomatorhelper': False,
@@ -50,6 +60,7 @@ class AndroidViewClientUseCase(AndroidUseCase):
         #always refresh
         self.refresh()
 
+    @traced(category='view_client')
     def prepare(self):
         """Prepare environment for running.
 
@@ -58,6 +69,7 @@ class AndroidViewClientUseCase(AndroidUseCase):
         self.start_view_client()
         self._prepare()
 
+    @traced(category='view_client')
     def refresh(self):
         """Refresh `AndroidViewClient`."""
         while True:
@@ -67,6 +79,7 @@ class AndroidViewClientUseCase(AndroidUseCase):
                 continue
             break
 
+    @traced(category='view_client')
     def wait_for_id(self, view_id):
         """Refresh `AndroidViewClient` until view id is found."""
         view = self.view_client.findViewById(view_id)
@@ -75,6 +88,7 @@ class AndroidViewClientUseCase(AndroidUseCase):
             view = self.view_client.findViewById(view_id)
         return view
 
+    @traced(category='view_client')
     def wait_for_text(self, text):
         """Refresh `AndroidViewClient` until text is found."""
         view = self.view_client.findViewWithText(text)
@@ -83,6 +97,7 @@ class AndroidViewClientUseCase(AndroidUseCase):
             view = self.view_client.findViewWithText(text)
         return view
 
+    @traced(category='view_client')
     def wait_for_content_description(self, content_description):
         """Refresh `AndroidViewClient` until content description is found."""
         view = self.view_client.findViewWithContentDescription(